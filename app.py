@@ -1,6 +1,7 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import asyncio
 import sys
 import traceback
 from datetime import datetime
@@ -24,9 +25,13 @@ from botbuilder.core import MemoryStorage
 from bots.state_management_bot import StateManagementBot
 # from botbuilder.azure import BlobStorage
 from util.az_blob_storage import TABBlobStorageSettings, BlobStorage
-# Add these new imports
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
+from tools.hub_master import warm_hub_master_cache
+import graph_build
+from util.az_clients import get_credential, close_clients
+from util.graph_metrics import graph_metrics
+from util.retry import retry_stats
+from util.assistant_reconciler import assistant_reconciler
+from util.assistant_thread_pool import assistant_thread_pool
 
 import logging
 from opencensus.ext.azure.log_exporter import AzureLogHandler
@@ -34,11 +39,12 @@ from opencensus.ext.azure.log_exporter import AzureLogHandler
 
 CONFIG = DefaultConfig()
 
-credential = DefaultAzureCredential()
+credential = get_credential()
 BlobStorageSettings = TABBlobStorageSettings(
     container_name=CONFIG.az_blob_container_name_state,
     account_url=f"https://{CONFIG.az_storage_account_name}.blob.core.windows.net",
-    credential=credential
+    credential=credential,
+    max_concurrency=CONFIG.az_blob_state_max_concurrency,
 )
 
 # Set up blob settings
@@ -119,8 +125,63 @@ async def messages(req: Request) -> Response:
     return Response(status=201)
 
 
+# In-process latency and token metrics of the graph nodes, per node and per conversation
+async def stats(req: Request) -> Response:
+    return json_response(
+        data={
+            "graph": graph_metrics.snapshot(),
+            "agenda_prompts": graph_build.agenda_prompt_registry.stats(),
+            "agenda_cache": graph_build.agenda_cache.stats() if graph_build.agenda_cache else None,
+            "agenda_speculation": graph_build.agenda_speculator.stats() if graph_build.agenda_speculator else None,
+            "state_storage_writes": BLOB_STORAGE.get_write_stats(),
+            "storage_retries": retry_stats(),
+            "assistant": assistant_reconciler.stats(),
+            "assistant_threads": assistant_thread_pool.stats(),
+        }
+    )
+
+
+def warm_up():
+    if CONFIG.az_assistant_reconcile_on_startup:
+        # Update the Assistant of the Document Generator Agent, only if its definition has drifted
+        try:
+            assistant_reconciler.reconcile()
+        except Exception as e:
+            logger.warning(f"Unable to reconcile the Assistant at startup, retried on the first session: {str(e)}")
+    if CONFIG.graph_warm_up_on_startup:
+        # Compile the graph and create the model clients
+        graph_build.warm_up()
+    if CONFIG.hub_master_warm_on_startup:
+        # Load the Hub Master data of all hub cities, and compile their agenda prompts
+        warm_hub_master_cache()
+        graph_build.precompile_agenda_prompts()
+
+
+async def on_startup(app: web.Application):
+    # In the background, after the port is bound, without holding up the startup
+    asyncio.get_running_loop().run_in_executor(None, warm_up)
+    # The Assistants threads of the next sessions are created in the background
+    assistant_thread_pool.start()
+
+
+async def on_shutdown(app: web.Application):
+    # Let the graph turns in progress complete, and release the worker threads
+    BOT.turn_executor.shutdown()
+    if graph_build.agenda_speculator is not None:
+        # The speculative agendas are not presented any more
+        graph_build.agenda_speculator.close()
+    await BLOB_STORAGE.close()
+    # Delete the Assistants threads that no session has taken
+    await asyncio.get_running_loop().run_in_executor(None, assistant_thread_pool.close)
+    close_clients()
+
+
 APP = web.Application(middlewares=[aiohttp_error_middleware])
 APP.router.add_post("/api/messages", messages)
+if CONFIG.stats_endpoint_enabled:
+    APP.router.add_get("/api/stats", stats)
+APP.on_startup.append(on_startup)
+APP.on_shutdown.append(on_shutdown)
 
 if __name__ == "__main__":
     try:
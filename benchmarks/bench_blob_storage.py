@@ -0,0 +1,76 @@
+"""
+Measure the latency of the per-turn bot state I/O of util.az_blob_storage.BlobStorage against a local blob stub.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_blob_storage --latency-ms 40 --keys 2 --turns 20
+"""
+import os
+
+from benchmarks.replay_stubs import OFFLINE_ENV, detach_telemetry
+
+# The settings read by config.DefaultConfig at import, where not set in the environment or the .env file
+os.environ["az_application_insights_key"] = OFFLINE_ENV["az_application_insights_key"]
+os.environ.setdefault("log_level", "WARNING")
+for _name, _value in OFFLINE_ENV.items():
+    os.environ.setdefault(_name, _value)
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.blob_stub import StubContainerClient
+from util.az_blob_storage import BlobStorage, TABBlobStorageSettings
+
+detach_telemetry()
+
+
+async def measure(
+    max_concurrency: int, latency_ms: float, keys: int, turns: int, unchanged: bool = False
+) -> tuple:
+    settings = TABBlobStorageSettings(
+        container_name="tab-state", max_concurrency=max_concurrency
+    )
+    storage = BlobStorage(settings, container_client=StubContainerClient(latency_ms))
+    names = [f"msteams/conversations/conv-{i}" for i in range(keys)]
+    await storage.write({name: {"turn": 0} for name in names})
+
+    timings = []
+    for turn in range(turns):
+        start = time.perf_counter()
+        items = await storage.read(names)
+        await storage.write(
+            {
+                name: {"turn": 0 if unchanged else turn + 1, "e_tag": item["e_tag"]}
+                for name, item in items.items()
+            }
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, storage.get_write_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--keys", type=int, default=2)
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    scenarios = (
+        ("serial", 1, False),
+        ("concurrent", 8, False),
+        ("unchanged", 8, True),  # the state does not change, so the writes are skipped
+    )
+    for label, max_concurrency, unchanged in scenarios:
+        timings, write_stats = asyncio.run(
+            measure(max_concurrency, args.latency_ms, args.keys, args.turns, unchanged)
+        )
+        print(
+            f"{label:<10} read+write of {args.keys} state blobs: "
+            f"p50={statistics.median(timings):.1f} ms, max={max(timings):.1f} ms, "
+            f"uploads performed={write_stats['performed']}, skipped={write_stats['skipped']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure the cold start of the app, each run in a fresh interpreter: the import of app.py (the time before the port
+can be bound), the compilation of the graph on first use, and the warm up of the graph (see graph_build.warm_up).
+
+The Azure resources are not used: the settings are placeholders and the Entra ID token provider is stubbed, so the
+model clients are created but make no calls.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_startup --runs 5 --importtime 15 --max-import-seconds 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.replay_stubs import OFFLINE_ENV
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+
+import graph_build
+from util.az_clients import set_client
+set_client("openai_token_provider", lambda: "token")
+graph_build.get_graph()
+compiled = time.perf_counter()
+graph_build.warm_up()
+warmed_up = time.perf_counter()
+
+print(json.dumps({
+    "import_app": imported - start,
+    "compile_graph": compiled - imported,
+    "warm_up": warmed_up - compiled,
+}))
+"""
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    env.update(OFFLINE_ENV)
+    env.setdefault("log_level", "WARNING")
+    env["PYTHONWARNINGS"] = "ignore"
+    return env
+
+
+def run_once(importtime: bool) -> tuple:
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD]
+    result = subprocess.run(command, capture_output=True, text=True, env=child_env(), check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr: str, count: int) -> list:
+    """The modules with the largest cumulative import time, from the -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of the app, in fresh interpreters")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--importtime", type=int, default=0, help="list the N slowest imports of the last run")
+    parser.add_argument("--max-import-seconds", type=float, default=0.0, help="fail when the median import exceeds it")
+    args = parser.parse_args()
+
+    samples = []
+    stderr = ""
+    for index in range(args.runs):
+        timings, stderr = run_once(importtime=args.importtime and index == args.runs - 1)
+        samples.append(timings)
+
+    print(f"{'phase':<16}{'median s':>10}{'max s':>10}")
+    for phase in ("import_app", "compile_graph", "warm_up"):
+        values = [s[phase] for s in samples]
+        print(f"{phase:<16}{statistics.median(values):>10.3f}{max(values):>10.3f}")
+
+    if args.importtime:
+        print("\nslowest imports (cumulative, last run):")
+        for cumulative, name in slowest_imports(stderr, args.importtime):
+            print(f"{cumulative / 1e6:>8.3f} s  {name}")
+
+    median_import = statistics.median(s["import_app"] for s in samples)
+    if args.max_import_seconds and median_import > args.max_import_seconds:
+        print(f"FAILED: the median import of the app {median_import:.2f} s exceeds {args.max_import_seconds} s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
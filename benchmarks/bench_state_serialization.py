@@ -0,0 +1,92 @@
+"""
+Compare the size and encode/decode time of a conversation state bag, as stored earlier with jsonpickle
+and as stored with the compact codec in data_models/state_codec.py. Also times the migration of a legacy blob.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_state_serialization --iterations 2000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+from jsonpickle import encode
+from jsonpickle.unpickler import Unpickler
+from openai.types.beta import Thread
+
+from data_models.conversation_data import ConversationData
+from data_models.state_codec import decode_state, encode_state
+
+
+class LegacyConversationData:
+    """The shape of ConversationData before the versioned schema, holding the Assistants API Thread object."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def sample_fields() -> dict:
+    return {
+        "timestamp": datetime(2025, 5, 12, 10, 30, tzinfo=timezone.utc),
+        "channel_id": "msteams",
+        "prompted_for_user_name": False,
+        "prompted_for_hub_location": False,
+        "hub_location": "Bengaluru",
+        "config": {
+            "configurable": {
+                "customer_name": "Ravi Kumar",
+                "thread_id": "8f0c6d1e-4a43-4a57-9a0e-1d2b3c4d5e6f",
+                "asst_thread_id": "thread_abc123def456ghi789",
+                "hub_location": "Bengaluru",
+            }
+        },
+    }
+
+
+def timed(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1e6 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    fields = sample_fields()
+    thread = Thread(
+        id=fields["config"]["configurable"]["asst_thread_id"],
+        created_at=1747045800,
+        metadata={},
+        object="thread",
+        tool_resources=None,
+    )
+    legacy_bag = {"ConversationData": LegacyConversationData(**fields, thread=thread), "e_tag": "0x8DD"}
+    compact_bag = {"ConversationData": ConversationData(**fields), "e_tag": "0x8DD"}
+
+    legacy_str = encode(legacy_bag)
+    compact_str = encode_state(compact_bag)
+    # a blob as written by the earlier storage, for the migration path
+    migrated_str = legacy_str.replace(
+        f"{__name__}.LegacyConversationData", "data_models.conversation_data.ConversationData"
+    )
+
+    rows = [
+        ("jsonpickle", len(legacy_str), timed(lambda: encode(legacy_bag), args.iterations),
+         timed(lambda: Unpickler().restore(json.loads(legacy_str)), args.iterations)),
+        ("compact", len(compact_str), timed(lambda: encode_state(compact_bag), args.iterations),
+         timed(lambda: decode_state(compact_str), args.iterations)),
+        ("migration", len(migrated_str), float("nan"),
+         timed(lambda: decode_state(migrated_str), args.iterations)),
+    ]
+    print(f"{'format':<12}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for name, size, encode_us, decode_us in rows:
+        print(f"{name:<12}{size:>8}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+    assert decode_state(migrated_str)["ConversationData"] == compact_bag["ConversationData"]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+An in-memory, Azurite-style stand-in for the async Azure Blob container client used by util.az_blob_storage.BlobStorage.
+Every request waits for a configurable latency, to approximate the round trip to the Storage Account.
+"""
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+
+
+class StubDownloader:
+    def __init__(self, data: str, etag: str):
+        self._data = data
+        self.properties = SimpleNamespace(etag=f'"{etag}"')
+
+    async def content_as_text(self) -> str:
+        return self._data
+
+
+class StubBlobClient:
+    def __init__(self, container, name: str):
+        self._container = container
+        self.name = name
+        self.url = f"http://127.0.0.1:10000/{container.account_name}/{name}"
+
+    async def download_blob(self, **kwargs) -> StubDownloader:
+        await self._container.round_trip()
+        if self.name not in self._container.blobs:
+            error = ResourceNotFoundError("The specified blob does not exist.")
+            error.status_code = 404
+            raise error
+        data, etag = self._container.blobs[self.name]
+        return StubDownloader(data, etag)
+
+    async def upload_blob(self, data, overwrite=False, etag=None, match_condition=None, **kwargs):
+        await self._container.round_trip()
+        current = self._container.blobs.get(self.name)
+        if etag and (current is None or current[1] != etag):
+            error = ResourceModifiedError("The condition specified using HTTP conditional header(s) is not met.")
+            error.status_code = 412
+            raise error
+        if current is not None and not overwrite and not etag:
+            error = ResourceExistsError("The specified blob already exists.")
+            error.status_code = 409
+            raise error
+        self._container.blobs[self.name] = (data, uuid.uuid4().hex)
+        self._container.uploads += 1
+
+    async def delete_blob(self, **kwargs):
+        await self._container.round_trip()
+        if self._container.blobs.pop(self.name, None) is None:
+            raise ResourceNotFoundError("The specified blob does not exist.")
+
+
+class StubContainerClient:
+    def __init__(self, latency_ms: float = 0.0, account_name: str = "devstoreaccount1"):
+        self.latency_ms = latency_ms
+        self.account_name = account_name
+        self.blobs = {}  # blob name -> (data, etag)
+        self.requests = 0
+        self.uploads = 0
+        self._created = False
+
+    async def round_trip(self):
+        self.requests += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    async def create_container(self):
+        await self.round_trip()
+        if self._created:
+            raise ResourceExistsError("The specified container already exists.")
+        self._created = True
+
+    def get_blob_client(self, name: str) -> StubBlobClient:
+        return StubBlobClient(self, name)
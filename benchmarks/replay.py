@@ -0,0 +1,278 @@
+"""
+Replay a recorded session, with the briefing notes of input_files/user_input.txt, through StateManagementBot and
+the graph of graph_build, fully offline: a deterministic fake chat model plays the agents, and the Assistants API, the
+Storage management plane, the hub master data and the bot state storage are in-process stubs.
+
+Reports the latency percentiles, graph events, model tokens and bot state and checkpoint sizes per turn, and the
+peak RSS of the process.
+
+Usage (from the repository root):
+    python -m benchmarks.replay --sessions 5 --storage-latency-ms 20 --max-p95-ms 2000
+"""
+import os
+
+from benchmarks.replay_stubs import OFFLINE_ENV
+
+# The settings read by config.DefaultConfig at import, where not set in the environment or the .env file
+os.environ["az_application_insights_key"] = OFFLINE_ENV["az_application_insights_key"]
+os.environ.setdefault("log_level", "WARNING")
+for _name, _value in OFFLINE_ENV.items():
+    os.environ.setdefault(_name, _value)
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import resource
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+from botbuilder.core import ConversationState, UserState
+from botbuilder.core.adapters import TestAdapter
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+
+from benchmarks.blob_stub import StubContainerClient
+from benchmarks.replay_stubs import (
+    ReplayChatModel,
+    StubBlobServiceClient,
+    StubOpenAIClient,
+    StubStorageManagementClient,
+    detach_telemetry,
+)
+from config import DefaultConfig
+from util.az_clients import set_client
+
+CONFIG = DefaultConfig()
+CHAT_MODEL = ReplayChatModel()
+OPENAI_CLIENT = StubOpenAIClient()
+
+# The clients are registered before the graph and the bot are loaded
+set_client("chat_llm", CHAT_MODEL)
+set_client("openai", OPENAI_CLIENT)
+set_client(f"storage_mgmt:{CONFIG.az_subscription_id}", StubStorageManagementClient())
+set_client(
+    f"blob:https://{CONFIG.az_storage_account_name}.blob.core.windows.net",
+    StubBlobServiceClient(CONFIG.az_storage_account_name),
+)
+
+import graph_build  # noqa: E402
+from bots.state_management_bot import StateManagementBot  # noqa: E402
+from tools.hub_master import hub_master_cache, normalize_city  # noqa: E402
+from util.assistant_thread_pool import assistant_thread_pool  # noqa: E402
+from util.az_blob_storage import BlobStorage, TABBlobStorageSettings  # noqa: E402
+from util.graph_metrics import MAX_TRACKED_CONVERSATIONS, graph_metrics  # noqa: E402
+
+HUB_CITY = "Bengaluru"
+
+# The replies that are not an answer of the agents: the repr of a graph update without a message, or an error
+INVALID_REPLY = re.compile(r"^(\{'\w+': |No response received|Error in processing the request)")
+
+
+detach_telemetry()
+
+
+def session_script(notes: str) -> list:
+    """The turns of the user in the recorded session: (label, text)."""
+    return [
+        ("greeting", "Hi"),
+        ("user name", "Ravi Kumar"),
+        ("hub location", "Bangalore"),
+        ("briefing notes", notes),
+        ("confirm goals", "Yes, confirmed"),
+        ("create agenda", "Please create the agenda"),
+        ("confirm agenda", "Yes, looks good"),
+        ("generate document", "Generate the Word document for the agenda"),
+        ("close", "Thanks"),
+    ]
+
+
+class CountingGraph:
+    """Counts the events streamed by the graph, per graph thread."""
+
+    def __init__(self, graph):
+        self._graph = graph
+        self.events = defaultdict(int)
+
+    def stream(self, *args, **kwargs):
+        config = kwargs.get("config") or (args[1] if len(args) > 1 else {})
+        thread_id = config["configurable"]["thread_id"]
+        for event in self._graph.stream(*args, **kwargs):
+            # The chunks of the model answers streamed for the progress of the turn are not counted
+            if not (len(event) == 3 and event[1] == "messages"):
+                self.events[thread_id] += 1
+            yield event
+
+    def __getattr__(self, name):
+        return getattr(self._graph, name)
+
+
+def _thread_tokens(thread_id: str) -> int:
+    conversations = graph_metrics.snapshot(top_conversations=MAX_TRACKED_CONVERSATIONS)["top_conversations_by_tokens"]
+    usage = conversations.get(thread_id)
+    return usage["prompt_tokens"] + usage["completion_tokens"] if usage else 0
+
+
+def _percentile(values: list, percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+async def graph_thread_id(storage, conversation_id: str) -> str:
+    key = f"test/conversations/{conversation_id}"
+    conversation_data = (await storage.read([key])).get(key, {}).get("ConversationData")
+    return conversation_data.config["configurable"]["thread_id"] if conversation_data else None
+
+
+async def replay_session(bot, graph, storage, container, script: list, results: list):
+    conversation_id = f"replay-{uuid.uuid4().hex[:8]}"
+    template = Activity(
+        channel_id="test",
+        service_url="https://replay.invalid",
+        conversation=ConversationAccount(id=conversation_id),
+        from_property=ChannelAccount(id=f"user-{conversation_id}", name="Ravi Kumar"),
+        recipient=ChannelAccount(id="bot", name="TAB"),
+    )
+    adapter = TestAdapter(bot.on_turn, template_or_conversation=template)
+
+    thread_id = None
+    for index, (label, text) in enumerate(script):
+        # The graph thread is created on the first turn that reaches the graph
+        events_before = graph.events[thread_id]
+        tokens_before = _thread_tokens(thread_id)
+        replies_before = len(adapter.activity_buffer)
+        start = time.perf_counter()
+        await adapter.receive_activity(text)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        state_bytes = sum(len(data) for name, (data, _) in container.blobs.items() if conversation_id in name)
+        current_thread_id = await graph_thread_id(storage, conversation_id)
+        if current_thread_id != thread_id:
+            thread_id = current_thread_id
+            events_before = tokens_before = 0
+        results.append(
+            {
+                "turn": index,
+                "label": label,
+                "latency_ms": latency_ms,
+                "events": graph.events[thread_id] - events_before,
+                "tokens": _thread_tokens(thread_id) - tokens_before,
+                "state_bytes": state_bytes,
+                "checkpoint_bytes": graph_build.get_checkpointer().thread_memory_usage(thread_id) if thread_id else 0,
+                "replies": [a.text for a in adapter.activity_buffer[replies_before:] if a.text],
+            }
+        )
+
+
+async def run(args) -> dict:
+    notes = open(args.notes, encoding="utf-8").read()
+    hub_master = open(args.hub_master, encoding="utf-8").read()
+    hub_master_cache.store(normalize_city(HUB_CITY), hub_master, "replay")
+    OPENAI_CLIENT.latency_seconds = args.openai_latency_ms / 1000
+    CHAT_MODEL.latency_seconds = args.model_latency_ms / 1000
+    # As at the startup of the app
+    assistant_thread_pool.start()
+
+    container = StubContainerClient(args.storage_latency_ms)
+    storage = BlobStorage(TABBlobStorageSettings(container_name="replay-state"), container_client=container)
+    bot = StateManagementBot(ConversationState(storage), UserState(storage))
+    get_graph = graph_build.get_graph
+    graph = CountingGraph(get_graph())
+    graph_build.get_graph = lambda: graph
+
+    script = session_script(notes)
+    results = []
+    start = time.perf_counter()
+    try:
+        for first in range(0, args.sessions, args.concurrency):
+            batch = range(first, min(first + args.concurrency, args.sessions))
+            await asyncio.gather(*(replay_session(bot, graph, storage, container, script, results) for _ in batch))
+    finally:
+        bot.turn_executor.shutdown()
+        assistant_thread_pool.close()
+        if graph_build.agenda_speculator is not None:
+            graph_build.agenda_speculator.close()
+        graph_build.get_graph = get_graph
+    return {
+        "wall_seconds": time.perf_counter() - start,
+        "turns": results,
+        "script": script,
+    }
+
+
+def report(summary: dict, args) -> int:
+    turns = summary["turns"]
+    print(f"{'turn':<20}{'p50 ms':>9}{'p95 ms':>9}{'events':>8}{'tokens':>9}{'state B':>9}{'ckpt KB':>9}")
+    for index, (label, _) in enumerate(summary["script"]):
+        rows = [t for t in turns if t["turn"] == index]
+        latencies = [t["latency_ms"] for t in rows]
+        print(
+            f"{label:<20}{statistics.median(latencies):>9.1f}{_percentile(latencies, 95):>9.1f}"
+            f"{statistics.mean(t['events'] for t in rows):>8.1f}{statistics.mean(t['tokens'] for t in rows):>9.0f}"
+            f"{max(t['state_bytes'] for t in rows):>9}{max(t['checkpoint_bytes'] for t in rows) / 1024:>9.0f}"
+        )
+
+    latencies = [t["latency_ms"] for t in turns]
+    p95 = _percentile(latencies, 95)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    print(
+        f"\n{args.sessions} sessions, {len(turns)} turns in {summary['wall_seconds']:.1f} s: "
+        f"p50={statistics.median(latencies):.1f} ms, p95={p95:.1f} ms, max={max(latencies):.1f} ms; "
+        f"model calls={CHAT_MODEL.calls}, Azure OpenAI calls={OPENAI_CLIENT.calls} "
+        f"({OPENAI_CLIENT.assistant_updates} assistant updates), peak RSS={peak_rss_mb:.0f} MB\n"
+        f"Assistants thread pool: {assistant_thread_pool.stats()}"
+    )
+    if graph_build.agenda_speculator is not None:
+        print(f"Agenda speculation: {graph_build.agenda_speculator.stats()}")
+    if args.verbose:
+        for t in turns[: len(summary["script"])]:
+            print(f"\n--- {t['label']} ---\n" + "\n".join(r[:600] for r in t["replies"]))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "p50_ms": statistics.median(latencies),
+                    "p95_ms": p95,
+                    "peak_rss_mb": peak_rss_mb,
+                    "turns": [{k: v for k, v in t.items() if k != "replies"} for t in turns],
+                    "graph": graph_metrics.snapshot(),
+                },
+                f,
+                indent=2,
+            )
+
+    invalid = [(t["label"], r) for t in turns for r in t["replies"] if INVALID_REPLY.match(r)]
+    if invalid:
+        label, reply = invalid[0]
+        print(f"FAILED: {len(invalid)} replies are not answers of the agents, e.g. to '{label}': {reply[:200]}")
+        return 1
+    if args.max_p95_ms and p95 > args.max_p95_ms:
+        print(f"FAILED: the p95 turn latency {p95:.1f} ms exceeds {args.max_p95_ms} ms")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--notes", default="input_files/user_input.txt")
+    parser.add_argument("--hub-master", default="input_files/Hub-Bengaluru.md")
+    parser.add_argument("--sessions", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="sessions replayed at the same time")
+    parser.add_argument("--storage-latency-ms", type=float, default=0.0)
+    parser.add_argument("--openai-latency-ms", type=float, default=0.0, help="latency of the Assistants API calls")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="latency of each call to the chat model")
+    parser.add_argument("--max-p95-ms", type=float, default=0.0, help="fail when the p95 turn latency exceeds it")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="print the replies of the first session")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    sys.exit(report(summary, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Deterministic, in-process stand-ins for the model and the Azure services, used by benchmarks/replay.py:
+- ReplayChatModel: a LangChain chat model that plays each agent of the graph from a fixed script
+- StubOpenAIClient: the Assistants API and chat completions calls made by the bot
+- StubBlobServiceClient / StubStorageManagementClient: the synchronous Blob and Storage management clients
+The settings (OFFLINE_ENV) and detach_telemetry are shared with the other benchmarks that load the modules of the app.
+"""
+import base64
+import itertools
+import logging
+import re
+import time
+import uuid
+from types import SimpleNamespace
+
+from azure.storage.blob import UserDelegationKey
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+
+# The settings read by config.DefaultConfig, for the runs without the Azure resources. The telemetry key is a placeholder
+OFFLINE_ENV = {
+    "az_application_insights_key": "InstrumentationKey=00000000-0000-0000-0000-000000000000",
+    "az_openai_endpoint": "https://replay.openai.azure.com/",
+    "az_openai_api_version": "2025-01-01-preview",
+    "az_deployment_name": "replay",
+    "az_assistant_id": "asst_replay",
+    "az_blob_storage_account_name": "replayaccount",
+    "az_blob_container_name": "agendas",
+    "az_blob_container_name_state": "state",
+    "az_blob_container_name_hubmaster": "hub-master",
+    "az_subscription_id": "00000000-0000-0000-0000-000000000000",
+    "az_storage_rg": "replay-rg",
+    "hub_cities": "Bengaluru, London, New York",
+    # The tiktoken encoding is downloaded when it is not in the cache; the token budget of the replay counts a quarter
+    # of the characters instead, so that the runs make no network call and count the same tokens on every machine
+    "token_counter": "estimate",
+}
+
+
+def detach_telemetry():
+    """Remove the AzureLogHandler each module adds to its logger; the logs of the offline runs stay in the process."""
+    loggers = [logging.getLogger()] + [
+        l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger)
+    ]
+    for l in loggers:
+        for handler in [h for h in l.handlers if isinstance(h, AzureLogHandler)]:
+            l.removeHandler(handler)
+    logging.getLogger("opencensus").setLevel(logging.CRITICAL)
+
+
+CONFIRMATIONS = ("yes", "confirm", "looks good", "ok", "go ahead", "proceed", "thanks")
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Answers as the agent whose system prompt it receives, from the conversation so far; no randomness."""
+
+    calls: int = 0
+    latency_seconds: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.calls += 1
+        time.sleep(self.latency_seconds)
+        # The system messages at the start of the prompt (the Agenda Creator Agent sends two)
+        system = "\n".join(
+            m.content for m in itertools.takewhile(lambda m: isinstance(m, SystemMessage), messages)
+        )
+        tool_names = {t["function"]["name"] for t in kwargs.get("tools") or []}
+        if "BriefingNotesExtraction" in tool_names:
+            message = self._briefing_notes_extraction(messages)
+        elif "Summarize the conversation" in system:
+            message = AIMessage(content="The Architect shared the briefing notes and confirmed the engagement goals.")
+        elif "You are the Notes Extractor Agent" in system:
+            message = self._notes_extraction(messages)
+        elif "You are the Agenda Creator Agent" in system:
+            message = self._agenda_creation(messages, system)
+        elif "You are the DocumentGeneratorAgent" in system:
+            message = self._document_generation(messages)
+        else:
+            message = self._primary_assistant(messages)
+
+        prompt_text = " ".join(str(m.content) for m in messages)
+        completion_text = str(message.content) + str(message.tool_calls)
+        message.usage_metadata = {
+            "input_tokens": _estimate_tokens(prompt_text),
+            "output_tokens": _estimate_tokens(completion_text),
+            "total_tokens": _estimate_tokens(prompt_text) + _estimate_tokens(completion_text),
+        }
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def _tool_call(name: str, args: dict) -> AIMessage:
+        return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+
+    @staticmethod
+    def _is_confirmation(message) -> bool:
+        return isinstance(message, HumanMessage) and message.content.strip().lower().startswith(CONFIRMATIONS)
+
+    @staticmethod
+    def _latest(messages, marker: str) -> str:
+        for message in reversed(messages):
+            texts = [message.content if isinstance(message.content, str) else ""]
+            texts += [str(v) for tc in getattr(message, "tool_calls", None) or [] for v in tc["args"].values()]
+            for text in texts:
+                if marker in text:
+                    return text[text.index(marker):]
+        return ""
+
+    def _primary_assistant(self, messages) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, HumanMessage):
+            text = last.content.lower()
+            if "briefing notes" in text:
+                return self._tool_call(
+                    "ToNotesExtractor",
+                    {
+                        "request": "Extract the metadata and agenda goals from the meeting notes",
+                        "internal_briefing_notes": "",
+                        "external_briefing_notes": last.content,
+                    },
+                )
+            if "document" in text or "word" in text:
+                agenda = self._latest(messages, "### Innovation Hub Engagement Agenda ###")
+                return self._tool_call("ToDocumentGenerator", {"query": agenda, "config": {}})
+            if "agenda" in text:
+                goals = self._latest(messages, "### Engagement Goals Confirmation Message ###")
+                return self._tool_call(
+                    "ToAgendaCreator",
+                    {"request": "Create the agenda for the Innovation Hub session", "agenda_goals": goals},
+                )
+        return AIMessage(content="Shall I proceed to the next step of the agenda preparation?")
+
+    @staticmethod
+    def _goal_headings(notes: str) -> list:
+        # The headings of the meeting notes (e.g. 'Bhaskar's Role and Expectations:') stand in for the goals
+        return re.findall(r"^([A-Z][^:\n]{5,80}):\s*$", notes, flags=re.MULTILINE)[:4]
+
+    def _briefing_notes_extraction(self, messages) -> AIMessage:
+        notes = messages[-1].content
+
+        def inferred(value, reasoning="stated in the notes", ambiguous=False):
+            return {"value": value, "reasoning": reasoning, "ambiguous": ambiguous}
+
+        return self._tool_call(
+            "BriefingNotesExtraction",
+            {
+                "customer_name": inferred("Mastek"),
+                "engagement_type": inferred("ADS", "inferred from the architecture discussions in the notes"),
+                "mode_of_delivery": inferred("In person at the Microsoft Innovation Hub facility, Bengaluru"),
+                "conversation_depth": inferred("combination of technical & business", "inferred", ambiguous=True),
+                "lead_architect": inferred("Pallavi Lokesh"),
+                "engagement_date": inferred("15-Dec-2026"),
+                "engagement_time": inferred("10:00 AM", "assumed, not in the notes"),
+                "target_audience": inferred(None, ""),
+                "goals": [
+                    {"name": heading, "details": [f"Discuss {heading.lower()} with Azure AI Foundry and Microsoft Fabric"]}
+                    for heading in self._goal_headings(notes)
+                ],
+            },
+        )
+
+    def _notes_extraction(self, messages) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, ToolMessage) and last.name is None and "engagement metadata is recorded" in last.content:
+            return self._tool_call("CompleteOrEscalate", {"cancel": True, "reason": "I have fully completed the task."})
+        if self._is_confirmation(last):
+            return self._tool_call(
+                "EngagementMetadata",
+                {
+                    "customer_name": "Mastek",
+                    "engagement_type": "ADS",
+                    "mode_of_delivery": "In person at the Microsoft Innovation Hub facility, Bengaluru",
+                    "conversation_depth": "combination of technical & business",
+                    "lead_architect": "Pallavi Lokesh",
+                    "engagement_date": "15-Dec-2026",
+                    "engagement_time": "10:00 AM",
+                },
+            )
+        notes = next(
+            (m.content for m in reversed(messages) if isinstance(m, HumanMessage) and "briefing notes" in m.content.lower()),
+            "",
+        )
+        goals = "\n".join(
+            f"- Goal {i}: {heading}\n    - Discuss {heading.lower()} with Azure AI Foundry and Microsoft Fabric"
+            for i, heading in enumerate(self._goal_headings(notes), start=1)
+        )
+        return AIMessage(
+            content="Type of Engagement: ADS (inferred from the architecture discussions in the notes)\n"
+            "### Engagement Goals Confirmation Message ###\n"
+            "**Customer Name:** Mastek\n**Date of the Engagement:** 15-Dec-2026\n"
+            "**Mode of Delivery:** In person at the Microsoft Innovation Hub facility, Bengaluru\n"
+            "**Type of Engagement:** ADS\n**Lead Architect:** Pallavi Lokesh\n"
+            f"{goals}\n\nCan you confirm if this is ok?"
+        )
+
+    def _agenda_creation(self, messages, system: str) -> AIMessage:
+        last = messages[-1]
+        if self._is_confirmation(last):
+            return self._tool_call("CompleteOrEscalate", {"cancel": True, "reason": "I have fully completed the task."})
+        if not any(isinstance(m, ToolMessage) and m.name == "assign_speakers" for m in messages[-3:]):
+            return self._tool_call(
+                "assign_speakers", {"topics": ["Welcome & Introductions", "Wrap up & discuss next steps"]}
+            )
+        # The rows of the ##MatchedSpeakers table in the system prompt
+        rows = re.findall(r"^\| ([^|\n]+) \| ([^|\n]+) \| [^|\n]+ \|$", system, flags=re.MULTILINE)
+        rows = [(topic, speaker) for topic, speaker in rows if topic not in ("Topic", "---")]
+        start = 10
+        lines = [
+            "### Innovation Hub Engagement Agenda ###",
+            "Customer Name: Mastek",
+            "Date: 15-Dec-2026",
+            "Location: Microsoft Innovation Hub, Bengaluru",
+            "Engagement Type: ADS",
+            "",
+            "| Time | Speaker | Topic | Description |",
+            "|---|---|---|---|",
+            "| 10:00 AM - 10:15 AM | Moderator | Welcome & Introductions | Introductions and expectations |",
+        ]
+        for topic, speaker in rows:
+            lines.append(f"| {start}:15 AM - {start + 1}:15 AM | {speaker} | {topic.split(';')[0]} | {topic} |")
+            start += 1
+        lines.append(f"| {start}:15 PM - {start}:30 PM | Moderator | Wrap up & discuss next steps | Next steps |")
+        return AIMessage(content="\n".join(lines) + "\n\nPlease confirm the agenda.")
+
+    def _document_generation(self, messages) -> AIMessage:
+        last = messages[-1]
+        if self._is_confirmation(last):
+            return self._tool_call("CompleteOrEscalate", {"cancel": True, "reason": "I have fully completed the task."})
+        if isinstance(last, ToolMessage) and last.name == "generate_agenda_document":
+            return AIMessage(content=last.content)
+        agenda = self._latest(messages, "### Innovation Hub Engagement Agenda ###")
+        return self._tool_call("generate_agenda_document", {"query": agenda})
+
+
+class StubOpenAIClient:
+    """The Azure OpenAI client calls made outside of the graph: Assistants threads and the city validation."""
+
+    def __init__(self, latency_seconds: float = 0.0):
+        counter = itertools.count(1)
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self.assistant_updates = 0
+
+        def create_thread(**kwargs):
+            self.calls += 1
+            time.sleep(self.latency_seconds)
+            return SimpleNamespace(id=f"thread_replay_{next(counter)}")
+
+        assistant = SimpleNamespace(instructions="", tools=[], tool_resources=None, temperature=1.0)
+
+        def delete_thread(thread_id):
+            self.calls += 1
+            return SimpleNamespace(id=thread_id, deleted=True)
+
+        def retrieve_assistant(assistant_id):
+            self.calls += 1
+            return assistant
+
+        def update_assistant(assistant_id, instructions, tools, tool_resources, temperature):
+            self.calls += 1
+            time.sleep(self.latency_seconds)
+            self.assistant_updates += 1
+            assistant.instructions = instructions
+            assistant.tools = [SimpleNamespace(type=t["type"]) for t in tools]
+            assistant.tool_resources = SimpleNamespace(
+                code_interpreter=SimpleNamespace(file_ids=tool_resources["code_interpreter"]["file_ids"])
+            )
+            assistant.temperature = temperature
+            return SimpleNamespace(id=assistant_id)
+
+        def create_completion(**kwargs):
+            self.calls += 1
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content='{"city": null}'))]
+            )
+
+        self.beta = SimpleNamespace(
+            threads=SimpleNamespace(create=create_thread, delete=delete_thread),
+            assistants=SimpleNamespace(retrieve=retrieve_assistant, update=update_assistant),
+        )
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create_completion))
+
+    def close(self):
+        pass
+
+
+class _StubSyncBlobClient:
+    def __init__(self, container, name):
+        self._container = container
+        self.url = f"https://{container.account_name}.blob.core.windows.net/{container.name}/{name}"
+
+
+class _StubSyncContainerClient:
+    def __init__(self, account_name, name):
+        self.account_name = account_name
+        self.name = name
+        self.blobs = {}
+
+    def upload_blob(self, name, data, overwrite=False, **kwargs):
+        self.blobs[name] = data
+
+    def get_blob_client(self, name):
+        return _StubSyncBlobClient(self, name)
+
+
+class StubBlobServiceClient:
+    """The synchronous Blob service client used to upload the agenda document and create its SAS link."""
+
+    def __init__(self, account_name: str):
+        self.account_name = account_name
+        self.containers = {}
+
+    def get_container_client(self, name):
+        return self.containers.setdefault(name, _StubSyncContainerClient(self.account_name, name))
+
+    def get_user_delegation_key(self, key_start_time, key_expiry_time):
+        key = UserDelegationKey()
+        key.signed_oid = key.signed_tid = str(uuid.UUID(int=0))
+        key.signed_start = key_start_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        key.signed_expiry = key_expiry_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        key.signed_service = "b"
+        key.signed_version = "2023-11-03"
+        key.value = base64.b64encode(b"replay-key").decode()
+        return key
+
+    def close(self):
+        pass
+
+
+class StubStorageManagementClient:
+    """Reports the public network access of every Storage Account as enabled."""
+
+    def __init__(self):
+        self.storage_accounts = SimpleNamespace(
+            get_properties=lambda **kwargs: SimpleNamespace(public_network_access="Enabled"),
+        )
+
+    def close(self):
+        pass
@@ -1,42 +1,32 @@
+import asyncio
 from botbuilder.core import ActivityHandler, ConversationState, TurnContext, UserState
 from data_models.user_profile import UserProfile
 from data_models.conversation_data import ConversationData
 import time
-from datetime import datetime
 from config import DefaultConfig
-from openai import AzureOpenAI
-import time
 import graph_build
 import uuid
 import traceback
-from botbuilder.core import ActivityHandler, TurnContext
 import json
 from datetime import datetime, timedelta, timezone
 import logging
 from opencensus.ext.azure.log_exporter import AzureLogHandler
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from util.az_clients import get_openai_client
 from botbuilder.core.teams import TeamsActivityHandler, TeamsInfo
-from util.az_blob_account_access import set_blob_account_public_access
+from util.az_blob_account_access import set_blob_account_public_access_async
+from util.graph_turn_executor import GraphTurnExecutor
+from util.city_resolver import CityResolver, parse_city_aliases
+from util.turn_progress import TurnProgress
+from util.assistant_reconciler import assistant_reconciler
+from util.assistant_thread_pool import assistant_thread_pool
+from botbuilder.schema import ActivityTypes
+from langchain_core.messages import AIMessage
 
 
 class StateManagementBot(ActivityHandler):
 
     connection = None
 
-    asst_sys_prompt = """
-    You are an AI Assistant tasked with helping the Technical Architects at the Microsoft Innovation Hub prepare a Microsoft Office Word Document (.docx format) containing the planned Agenda for the Customer Engagement.
-    You have been provided with an empty Word document - Innovation Hub Agenda Format.docx
-
-    You need to take the Markdown format agenda provided by the user and fill the Word document above. 
-    You will set the values like the following:
-    - Customer Name
-    - Date of the Engagement
-    - Location where the Innovation Hub Session would be held
-    - Engagement Type: (Whether Business Envisioning, or Solution Envisioning, or ADS, or Rapid Prototype or Hackathon, or Consult)
-    - Fill in the topics in the agenda into the table provided. You will have to add rows to the table as required, to accommodate all the topics mentioned by the user in the Markdown format
-    - Save the document with a File Name in the format [Agenda-$EngagementType-CustomerName.docx] 
-    """
-
     def __init__(self, conversation_state: ConversationState, user_state: UserState):
         if conversation_state is None:
             raise TypeError(
@@ -69,24 +59,53 @@ class StateManagementBot(ActivityHandler):
         self.logger.debug(f"Logging level set to {log_level_str}")
         # self.logger.setLevel(logging.DEBUG)
 
-    async def on_message_activity(self, turn_context: TurnContext):
+        # The graph turns are run on a bounded pool of worker threads, so that they do not block the event loop
+        self.turn_executor = GraphTurnExecutor(self.config.graph_max_concurrent_turns)
 
-        # First ensure public network access is enabled for the blob account before processing each request
-        # Due to Secure Futures Initiative at Microsoft, the public network access is set to disabled for the blob account, daily.
-        # All the Bot state is presently stored in the blob account, and the bot needs to access the blob account to store and retrieve the state data.
-        flag = set_blob_account_public_access(
-            self.config.az_storage_account_name,
-            self.config.az_subscription_id,
-            self.config.az_storage_rg_name,
+        # The index of the hub cities and their aliases, used to resolve the hub location the user enters
+        self.city_resolver = CityResolver(
+            self.config.hub_cities, parse_city_aliases(self.config.hub_city_aliases)
         )
-        if not flag:
-            self.logger.debug(
-                "Public network access is not enabled. Please contact your administrator."
-            )
-            await turn_context.send_activity(
-                "Public network access is not enabled to the Storage Account. Please contact your administrator."
-            )
-            return
+
+        # The channels where the progress of a graph turn is shown by updating a status message in place
+        self.streaming_update_channels = {
+            c.strip().lower() for c in self.config.bot_streaming_update_channels.split(",") if c.strip()
+        }
+
+    def validate_city_with_llm(self, client, user_input: str, hub_cities: str) -> str:
+        """
+        Use Azure OpenAI to match the user input against the hub cities, when the local resolution is ambiguous.
+        Returns the matched city, or None.
+        """
+        # Create a system message to instruct the model on the task
+        messages = [
+            {
+                "role": "system",
+                "content": f'You are a city validation assistant. Based on the user input identify the match from the list of valid Innovation Hub location cities: {hub_cities}. Return a JSON response in the format {{"city": "matched_city_name"}} or {{"city": null}} if no match. Use your knowledge of the cities to validate the user input, even if the user provides synonyms for the city names.',
+            },
+            {
+                "role": "user",
+                "content": f"Is '{user_input}' a valid city in this list: {hub_cities}?",
+            },
+        ]
+
+        # Get the validation from Azure OpenAI
+        response = client.chat.completions.create(
+            model=self.config.az_deployment_name,
+            messages=messages,
+            response_format={"type": "json_object"},
+        )
+
+        # Parse the JSON response
+        result = json.loads(response.choices[0].message.content)
+        self.logger.debug(f"Hub location validation result from the model: {result}")
+        matched_city = result.get("city")
+        # Only accept one of the candidate cities
+        if matched_city not in [c.strip() for c in hub_cities.split(",")]:
+            return None
+        return matched_city
+
+    async def on_message_activity(self, turn_context: TurnContext):
 
         # Get the state properties from the turn context.
         user_profile = await self.user_profile_accessor.get(turn_context, UserProfile)
@@ -104,16 +123,8 @@ class StateManagementBot(ActivityHandler):
             )
             return
 
-        # Initialize Azure OpenAI Service client with Entra ID authentication
-        token_provider = get_bearer_token_provider(
-            DefaultAzureCredential(),
-            "https://cognitiveservices.azure.com/.default",
-        )
-        client = AzureOpenAI(
-            azure_endpoint=self.config.az_openai_endpoint,
-            azure_ad_token_provider=token_provider,
-            api_version=self.config.az_openai_api_version,
-        )
+        # The Azure OpenAI Service client (Entra ID authentication) is shared across messages and conversations
+        client = get_openai_client()
         sender_name = None
 
         if conversation_data.config is None:
@@ -184,31 +195,17 @@ class StateManagementBot(ActivityHandler):
             # Get hub location from user input
             user_input = turn_context.activity.text
 
-            # Use Azure OpenAI to validate the city against the list of valid cities
             try:
-                # Create a system message to instruct the model on the task
-                messages = [
-                    {
-                        "role": "system",
-                        "content": f'You are a city validation assistant. Based on the user input identify the match from the list of valid Innovation Hub location cities: {self.config.hub_cities}. Return a JSON response in the format {{"city": "matched_city_name"}} or {{"city": null}} if no match. Use your knowledge of the cities to validate the user input, even if the user provides synonyms for the city names.',
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Is '{user_input}' a valid city in this list: {self.config.hub_cities}?",
-                    },
-                ]
-
-                # Get the validation from Azure OpenAI
-                response = client.chat.completions.create(
-                    model=self.config.az_deployment_name,
-                    messages=messages,
-                    response_format={"type": "json_object"},
+                # Resolve the city locally; the model is only asked to choose when the input matches several hub cities
+                resolution = self.city_resolver.resolve(user_input)
+                matched_city = resolution.city
+                self.logger.debug(
+                    f"Hub location resolution for '{user_input}': {resolution.method}, candidates {resolution.candidates}"
                 )
-
-                # Parse the JSON response
-                result = json.loads(response.choices[0].message.content)
-                print("Debug - Validation result:", result)
-                matched_city = result.get("city")
+                if resolution.is_ambiguous:
+                    matched_city = self.validate_city_with_llm(
+                        client, user_input, ", ".join(resolution.candidates)
+                    )
 
                 if matched_city:
                     # Store the matched city in conversation data
@@ -254,51 +251,107 @@ class StateManagementBot(ActivityHandler):
                     "Debug - Timestamp is older than 10 minutes, resetting conversation data."
                 )
                 # conversation_data.config = None
+                # The Assistants thread of the expired session is deleted in the background
+                assistant_thread_pool.retire(conversation_data.config["configurable"]["asst_thread_id"])
                 conversation_data.config["configurable"]["thread_id"] = None
                 conversation_data.config["configurable"]["asst_thread_id"] = None
 
             conversation_data.channel_id = turn_context.activity.channel_id
+            new_asst_thread_id = None
             if conversation_data.config["configurable"]["thread_id"] is None:
                 # Create a graph
                 l_graph_thread_id = str(uuid.uuid4())
 
-                # Initialize the Assistants API instance with the tools, Document Templates and instructions
-                client.beta.assistants.update(
-                    self.config.az_assistant_id,
-                    instructions=StateManagementBot.asst_sys_prompt,
-                    tools=[{"type": "code_interpreter"}],
-                    tool_resources={
-                        "code_interpreter": {"file_ids": self.config.file_ids}
-                    },
-                    temperature=0.3,
-                )
-                self.logger.debug(
-                    "Debug - Document Generator Agent updated successfully with the Office Word document template"
-                )
+                # The Assistants API instance is brought in line with its definition (the tools, Document Templates and
+                # instructions) once per process, usually at startup; it is only updated when it has drifted
+                if not assistant_reconciler.reconciled:
+                    try:
+                        await asyncio.get_running_loop().run_in_executor(None, assistant_reconciler.reconcile)
+                    except Exception as e:
+                        self.logger.warning(f"Unable to reconcile the Document Generator Agent assistant: {str(e)}")
 
-                # Create a new thread for the conversation (user session)
-                conversation_data.thread = client.beta.threads.create()
+                # Take a thread for the conversation (user session) from the pool, created ahead of the session.
+                # Only its id is kept in the conversation state
+                new_asst_thread_id = await assistant_thread_pool.take_async()
 
                 # For the user session, this config is to bootstrap the multi-agent system for Agenda creation
                 conversation_data.config["configurable"][
                     "asst_thread_id"
-                ] = conversation_data.thread.id
+                ] = new_asst_thread_id
                 conversation_data.config["configurable"][
                     "thread_id"
                 ] = l_graph_thread_id
                 conversation_data.config["configurable"]["customer_name"] = user_profile.name
                 print("user name:", conversation_data.config["configurable"]["customer_name"])
             # Now we can use the graph to send messages and get responses
-            response = self.stream_graph_updates(
-                turn_context.activity.text, graph_build.graph, conversation_data.config
-            )
+            # While the graph runs, the user sees a typing indicator and, where the channel supports it, the progress
+            progress = None
+            if self.config.bot_streaming_enabled:
+                progress = TurnProgress(
+                    turn_context,
+                    update_supported=(turn_context.activity.channel_id or "").lower()
+                    in self.streaming_update_channels,
+                    update_interval_seconds=self.config.bot_streaming_update_interval_seconds,
+                )
+                progress.start()
+            # The turn runs on a worker thread; turns of the same conversation are processed in order (see on_turn)
+            try:
+                response = await self.turn_executor.run(
+                    self.stream_graph_updates,
+                    turn_context.activity.text,
+                    conversation_data.config,
+                    progress,
+                )
+            except Exception:
+                if new_asst_thread_id:
+                    # The conversation state of the turn is not saved, so the session does not keep the thread
+                    assistant_thread_pool.retire(new_asst_thread_id)
+                raise
+            finally:
+                if progress is not None:
+                    await progress.stop()
+            if progress is not None:
+                return await progress.deliver(response)
             return await turn_context.send_activity(response)
 
     async def on_turn(self, turn_context: TurnContext):
-        await super().on_turn(turn_context)
+        # First ensure public network access is enabled for the blob account before processing each request, and before
+        # the state is loaded: a state read refused by the Storage Account would otherwise start the conversation afresh.
+        # Due to Secure Futures Initiative at Microsoft, the public network access is set to disabled for the blob account, daily.
+        # All the Bot state is presently stored in the blob account, and the bot needs to access the blob account to store and retrieve the state data.
+        # The access state is cached process-wide, so the management plane is only queried after the TTL expires or a data-plane call fails.
+        # The check does not block the event loop, so a slow Storage Account does not hold up the other conversations.
+        flag = await set_blob_account_public_access_async(
+            self.config.az_storage_account_name,
+            self.config.az_subscription_id,
+            self.config.az_storage_rg_name,
+        )
+        if not flag:
+            self.logger.debug(
+                "Public network access is not enabled. Please contact your administrator."
+            )
+            if turn_context.activity.type == ActivityTypes.message:
+                await turn_context.send_activity(
+                    "Public network access is not enabled to the Storage Account. Please contact your administrator."
+                )
+            return
+
+        # The turns of the same conversation are processed one after the other, from the load of the state to its save:
+        # a message sent while the previous one is processed must not read the state the previous turn has not saved yet
+        async with self.turn_executor.conversation(turn_context.activity.conversation.id):
+            # Load the conversation and user state in a single parallel round, instead of one after the other
+            await asyncio.gather(
+                self.conversation_state.load(turn_context),
+                self.user_state.load(turn_context),
+            )
 
-        await self.conversation_state.save_changes(turn_context)
-        await self.user_state.save_changes(turn_context)
+            await super().on_turn(turn_context)
+
+            # Likewise, persist both state bags in a single parallel round
+            await asyncio.gather(
+                self.conversation_state.save_changes(turn_context),
+                self.user_state.save_changes(turn_context),
+            )
 
     def __datetime_from_utc_to_local(self, utc_datetime):
         now_timestamp = time.time()
@@ -309,21 +362,37 @@ class StateManagementBot(ActivityHandler):
 
         return result.strftime("%I:%M:%S %p, %A, %B %d of %Y")
 
-    def stream_graph_updates(self, user_input: str, graph, config) -> str:
+    def stream_graph_updates(self, user_input: str, config, progress: TurnProgress = None) -> str:
         try:
+            # The graph is compiled on first use, on the worker thread, unless it was warmed up at startup
+            graph = graph_build.get_graph()
+            # With a progress, the chunks of the model answers are streamed along with the node updates
             events = graph.stream(
                 {"messages": [("user", user_input)]},
                 config=config,
                 subgraphs=True,
-                stream_mode=None,
+                stream_mode=["updates", "messages"] if progress is not None else None,
             )
 
-            l_events = list(events)
+            last_update = None
+            for event in events:
+                if progress is None:
+                    last_update = event
+                    continue
+                namespace, mode, data = event
+                if mode == "messages":
+                    chunk, metadata = data
+                    if isinstance(chunk, AIMessage) and isinstance(chunk.content, str):
+                        progress.publish_token(metadata.get("langgraph_node"), chunk.id, chunk.content)
+                else:
+                    last_update = (namespace, data)
+                    for node in data:
+                        progress.publish_node(node)
 
-            if not l_events:
+            if last_update is None:
                 return "No response received"
 
-            msg = list(l_events[-1])
+            msg = list(last_update)
 
             # Debug logging for development
             # print("Debug - Last message structure:", msg[-1])
@@ -21,9 +21,40 @@ class DefaultConfig:
 
     """ Azure OpenAI Assistants API Configuration """
     az_assistant_id = os.getenv("az_assistant_id")
+
+    """ at startup, update the Assistant with its definition in the code (instructions, code interpreter and file_ids), only when the live Assistant differs from it """
+    az_assistant_reconcile_on_startup = os.getenv("az_assistant_reconcile_on_startup", "true").lower() == "true"
+
+    """ the number of Assistants API threads created ahead of the new sessions (0 creates the thread of each session when it starts), and the age after which an unused thread is replaced """
+    assistant_thread_pool_size = int(os.getenv("assistant_thread_pool_size", "4"))
+    assistant_thread_pool_max_age_minutes = int(os.getenv("assistant_thread_pool_max_age_minutes", "60"))
     
     """ comma separated list of Agenda Document Template Word Document file ids,used by Azure OpenAI Assistants API. Use a single document template for now"""
     file_ids = os.getenv("file_ids", "").split(",") 
+
+    """ the agendas created for the confirmed goals are cached, and presented again without calling the model when the same goals are sent for the same hub; unless the user asks to regenerate the agenda. agenda_cache_dir, when set, keeps them on disk as well, in a directory that can be shared by the instances of the app """
+    agenda_cache_enabled = os.getenv("agenda_cache_enabled", "true").lower() == "true"
+    agenda_cache_max_entries = int(os.getenv("agenda_cache_max_entries", "256"))
+    agenda_cache_dir = os.getenv("agenda_cache_dir", "")
+
+    """ the agenda is created in the background as soon as the Notes Extractor Agent proposes the engagement goals, and presented as soon as the user confirms them unchanged; it is discarded when the user edits them, at the cost of its tokens. agenda_speculation_wait_seconds is how long the agenda request waits for the speculation in progress, before creating the agenda itself """
+    agenda_speculation_enabled = os.getenv("agenda_speculation_enabled", "false").lower() == "true"
+    agenda_speculation_max_workers = int(os.getenv("agenda_speculation_max_workers", "4"))
+    agenda_speculation_wait_seconds = float(os.getenv("agenda_speculation_wait_seconds", "120"))
+    agenda_speculation_max_age_minutes = float(os.getenv("agenda_speculation_max_age_minutes", "30"))
+
+    """ how the agenda Word document is produced: 'local' fills the document template with python-docx, 'assistants' uses the code interpreter of the Azure OpenAI Assistants API """
+    agenda_renderer = os.getenv("agenda_renderer", "local")
+    """ when set to true, the Assistants API is used if the local rendering of the agenda fails """
+    agenda_renderer_fallback = os.getenv("agenda_renderer_fallback", "false").lower() == "true"
+    """ the Assistants API runs are streamed (when false, they are polled), and abandoned after the deadline """
+    assistants_run_streaming = os.getenv("assistants_run_streaming", "true").lower() == "true"
+    assistants_run_deadline_seconds = int(os.getenv("assistants_run_deadline_seconds", "180"))
+    """ the Agenda Document Template Word Document used by the local renderer """
+    agenda_template_path = os.getenv(
+        "agenda_template_path",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "input_files", "Innovation Hub Agenda Format.docx"),
+    )
     
     """ Azure Blob Storage Configuration """
     az_storage_account_name = os.getenv("az_blob_storage_account_name")
@@ -34,16 +65,78 @@ class DefaultConfig:
     """the container name where the Hub Master Data Word Document for a Hub Location should be available"""
     az_blob_container_name_hubmaster = os.getenv("az_blob_container_name_hubmaster") 
     
+    """seconds for which the cached Hub Master data of a city is served before it is revalidated against the blob; optionally cache all hub cities at startup"""
+    hub_master_cache_ttl_seconds = int(os.getenv("hub_master_cache_ttl_seconds", "3600"))
+    hub_master_warm_on_startup = os.getenv("hub_master_warm_on_startup", "false").lower() == "true"
+    
     """the container name where the user conversation state will be stored"""
     az_blob_container_name_state = os.getenv("az_blob_container_name_state")
+
+    """the maximum number of conversation state blobs read or written in parallel"""
+    az_blob_state_max_concurrency = int(os.getenv("az_blob_state_max_concurrency", "8"))
     
     """ Azure Storage configuration required for Management plane operations """
     az_subscription_id = os.getenv("az_subscription_id")
     az_storage_rg_name = os.getenv("az_storage_rg")
+
+    """ seconds for which a known 'Enabled' public network access state of the Storage Account is trusted, before it is checked again """
+    az_storage_access_ttl_seconds = int(os.getenv("az_storage_access_ttl_seconds", "300"))
+
+    """ seconds to wait, once the public network access of the Storage Account has been enabled, for it to take effect """
+    az_storage_access_settle_seconds = float(os.getenv("az_storage_access_settle_seconds", "10"))
+
+    """ the retries of the Storage operations (the Hub Master data read, the agenda document upload and the public network access check): the attempts, the jittered exponential backoff between them, and the deadline of each operation across its attempts """
+    az_storage_retry_max_attempts = int(os.getenv("az_storage_retry_max_attempts", "3"))
+    az_storage_retry_base_delay_seconds = float(os.getenv("az_storage_retry_base_delay_seconds", "5"))
+    az_storage_retry_max_delay_seconds = float(os.getenv("az_storage_retry_max_delay_seconds", "20"))
+    az_storage_retry_deadline_seconds = float(os.getenv("az_storage_retry_deadline_seconds", "60"))
+
+    """ the retries allowed per Storage operation across the process (the retry budget), and the consecutive failures after which an operation fails fast for the reset period (the circuit breaker) """
+    az_storage_retry_budget_ratio = float(os.getenv("az_storage_retry_budget_ratio", "0.2"))
+    az_storage_circuit_failure_threshold = int(os.getenv("az_storage_circuit_failure_threshold", "5"))
+    az_storage_circuit_reset_seconds = float(os.getenv("az_storage_circuit_reset_seconds", "30"))
     
     """ Log keys and log level verbosity configuration """
     az_application_insights_key=os.getenv("az_application_insights_key")
     log_level=os.getenv("log_level", "INFO")
+
+    """ expose the latency and token metrics of the graph nodes at /api/stats. The endpoint is not authenticated, enable it only where the app is not publicly reachable """
+    stats_endpoint_enabled = os.getenv("stats_endpoint_enabled", "false").lower() == "true"
     
+    """ the number of LangGraph turns that can run in parallel across conversations; turns of the same conversation are always run in order """
+    graph_max_concurrent_turns = int(os.getenv("graph_max_concurrent_turns", "8"))
+
+    """ compile the graph and create the model clients in the background when the app starts, instead of on the first turn """
+    graph_warm_up_on_startup = os.getenv("graph_warm_up_on_startup", "true").lower() == "true"
+
+    """ the graph checkpointer backend, 'memory' or 'sqlite'. Use 'sqlite' with a database path on shared storage to share graph state across app instances """
+    graph_checkpointer = os.getenv("graph_checkpointer", "memory")
+    graph_checkpoint_db_path = os.getenv("graph_checkpoint_db_path", "graph_checkpoints.sqlite")
+
+    """ how the Notes Extractor Agent confirms the metadata of the engagement: 'sequential' asks the user to confirm each field one after another; 'batch' extracts all the metadata and goals in one structured call, presents them in a single confirmation form, and asks again only for the fields the user rejects or that are ambiguous """
+    notes_extraction_mode = os.getenv("notes_extraction_mode", "sequential").lower()
+
+    """ the token budget for the messages sent to the model on each hop of the graph; the current turn, a summary of the earlier turns and the confirmed goals and agenda are always sent. 0 sends the whole conversation """
+    graph_context_max_tokens = int(os.getenv("graph_context_max_tokens", "12000"))
+
+    """ when a stage of the conversation completes, the earlier turns are summarized by the model once they exceed this many tokens; 0 disables the summarization """
+    graph_context_summarize_min_tokens = int(os.getenv("graph_context_summarize_min_tokens", "6000"))
+
+    """ how the tokens of the messages are counted for the token budget: 'tiktoken' with the o200k_base encoding, 'estimate' as a quarter of the characters. The encoding file is read from tiktoken_cache_dir when set (pre-fetched at build time, see the readme), else downloaded once at the warm up of the graph; the counts are estimated until it is loaded """
+    token_counter = os.getenv("token_counter", "tiktoken").lower()
+    tiktoken_cache_dir = os.getenv("tiktoken_cache_dir", "")
+
+    """ graph threads idle beyond the ttl, or least recently used beyond the max count, are evicted from the checkpointer """
+    graph_max_threads = int(os.getenv("graph_max_threads", "500"))
+    graph_thread_ttl_minutes = int(os.getenv("graph_thread_ttl_minutes", "30"))
+
     """ The comma separated list of cities where Innovation Hub Centers are located """
-    hub_cities = os.getenv("hub_cities")
\ No newline at end of file
+    hub_cities = os.getenv("hub_cities")
+
+    """ additional aliases of the hub cities, in the format 'Alias=City, Alias=City', used to resolve the hub location the user enters """
+    hub_city_aliases = os.getenv("hub_city_aliases", "")
+
+    """ show the progress of the graph turns: a typing indicator, and on the channels listed in bot_streaming_update_channels a status message updated in place with the stage and the answer of the agents as it is generated """
+    bot_streaming_enabled = os.getenv("bot_streaming_enabled", "true").lower() == "true"
+    bot_streaming_update_channels = os.getenv("bot_streaming_update_channels", "msteams,emulator")
+    bot_streaming_update_interval_seconds = float(os.getenv("bot_streaming_update_interval_seconds", "1.5"))
\ No newline at end of file
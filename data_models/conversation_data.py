@@ -1,20 +1,42 @@
-from openai import AzureOpenAI
+from dataclasses import dataclass
+from datetime import datetime
 
+
+@dataclass(slots=True)
 class ConversationData:
-    def __init__(
-        self,
-        timestamp: str = None,
-        channel_id: str = None,
-        prompted_for_user_name: bool = False,
-        prompted_for_hub_location: bool = False,  # New flag
-        hub_location: str = None,  # New field
-        thread = None,
-        config = None
-    ):
-        self.timestamp = timestamp
-        self.channel_id = channel_id
-        self.prompted_for_user_name = prompted_for_user_name
-        self.prompted_for_hub_location = prompted_for_hub_location  # New flag
-        self.hub_location = hub_location  # New field
-        self.thread = thread
-        self.config = config
\ No newline at end of file
+    """Per conversation state of the bot. Only plain values and identifiers are held here, never SDK objects,
+    so that the state serializes to compact JSON (see data_models/state_codec.py)."""
+
+    SCHEMA_VERSION = 2
+
+    timestamp: datetime = None
+    channel_id: str = None
+    prompted_for_user_name: bool = False
+    prompted_for_hub_location: bool = False
+    hub_location: str = None
+    # holds customer_name, thread_id (graph thread), asst_thread_id (Assistants API thread) and hub_location
+    config: dict = None
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp.isoformat() if self.timestamp else None,
+            "channel_id": self.channel_id,
+            "prompted_for_user_name": self.prompted_for_user_name,
+            "prompted_for_hub_location": self.prompted_for_hub_location,
+            "hub_location": self.hub_location,
+            "config": self.config,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConversationData":
+        timestamp = data.get("timestamp")
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        return cls(
+            timestamp=timestamp,
+            channel_id=data.get("channel_id"),
+            prompted_for_user_name=data.get("prompted_for_user_name", False),
+            prompted_for_hub_location=data.get("prompted_for_hub_location", False),
+            hub_location=data.get("hub_location"),
+            config=data.get("config"),
+        )
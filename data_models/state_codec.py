@@ -0,0 +1,86 @@
+"""
+Compact, versioned serialization of the bot state bags stored by util.az_blob_storage.BlobStorage.
+
+A state bag, e.g. {"ConversationData": ConversationData(...)}, is stored as
+    {"_v": 1, "ConversationData": {"_t": "ConversationData", "_v": 2, "timestamp": "...", ...}}
+where the top level "_v" is the codec version, "_t" the registered model type and the nested "_v" its schema version.
+Blobs written earlier with jsonpickle are recognised by the missing codec version, and migrated on read.
+"""
+import json
+from datetime import datetime
+
+from jsonpickle import encode
+from jsonpickle.unpickler import Unpickler
+
+from data_models.conversation_data import ConversationData
+from data_models.user_profile import UserProfile
+
+CODEC_VERSION = 1
+
+MODEL_TYPES = {
+    ConversationData.__name__: ConversationData,
+    UserProfile.__name__: UserProfile,
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable in the bot state")
+
+
+def encode_state(item: object) -> str:
+    """Serialize a state bag to compact JSON. The e_tag of the bag is blob metadata, and is not stored."""
+    if not isinstance(item, dict):
+        # Not a state bag written by BotState, keep the generic representation
+        return encode(item)
+
+    payload = {"_v": CODEC_VERSION}
+    for key, value in item.items():
+        if key == "e_tag":
+            continue
+        model = MODEL_TYPES.get(type(value).__name__)
+        if model is not None and isinstance(value, model):
+            payload[key] = {"_t": model.__name__, "_v": model.SCHEMA_VERSION, **value.to_dict()}
+        else:
+            payload[key] = value
+    return json.dumps(payload, separators=(",", ":"), sort_keys=True, default=_json_default)
+
+
+def decode_state(text: str) -> object:
+    """Deserialize a state bag written by encode_state, or by the earlier jsonpickle based storage."""
+    data = json.loads(text)
+    if not isinstance(data, dict) or "_v" not in data:
+        return _decode_legacy(data)
+
+    item = {}
+    for key, value in data.items():
+        if key == "_v":
+            continue
+        if isinstance(value, dict) and value.get("_t") in MODEL_TYPES:
+            value = MODEL_TYPES[value["_t"]].from_dict(value)
+        item[key] = value
+    return item
+
+
+def _decode_legacy(data: object) -> object:
+    """
+    Migrate a jsonpickle state bag. The type tags of the state models are dropped, so that the fields are restored
+    as plain values and mapped onto the current schema; fields no longer in the schema (like the Assistants API
+    Thread object held earlier by ConversationData) are discarded.
+    """
+    if not isinstance(data, dict):
+        return Unpickler().restore(data)
+
+    legacy_models = {}
+    for key, value in data.items():
+        if isinstance(value, dict) and "py/object" in value:
+            type_name = value["py/object"].rsplit(".", 1)[-1]
+            if type_name in MODEL_TYPES:
+                legacy_models[key] = MODEL_TYPES[type_name]
+                data[key] = {k: v for k, v in value.items() if k != "py/object"}
+
+    item = Unpickler().restore(data)
+    for key, model in legacy_models.items():
+        item[key] = model.from_dict(item[key])
+    return item
@@ -1,3 +1,15 @@
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
 class UserProfile:
-    def __init__(self, name: str = None):
-        self.name = name
\ No newline at end of file
+    SCHEMA_VERSION = 1
+
+    name: str = None
+
+    def to_dict(self) -> dict:
+        return {"name": self.name}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserProfile":
+        return cls(name=data.get("name"))
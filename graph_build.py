@@ -1,42 +1,51 @@
-from dotenv import load_dotenv
-import os
-from langchain_openai import AzureChatOpenAI
-
-from langchain_core.tools import tool
-from langgraph.prebuilt import tools_condition
-from typing_extensions import TypedDict
-from langgraph.graph import StateGraph, START, END
-from typing import Callable
-
-from langchain_core.messages import ToolMessage
-from langchain_core.runnables import RunnableLambda
-from langgraph.prebuilt import ToolNode
-from langchain_core.messages import HumanMessage
-from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
-
-from typing import Annotated, Literal, Optional
-from typing_extensions import TypedDict
-from langgraph.graph.message import AnyMessage, add_messages
+import datetime
+import logging
+import threading
+import time
+from typing import Annotated, Callable, Literal, Optional, get_args
 
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import Runnable, RunnableConfig
-from langgraph.graph import StateGraph
-from pydantic import BaseModel, Field
-from openai import AzureOpenAI
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import AnyMessage, add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+from pydantic import BaseModel, Field, ValidationError
+from typing_extensions import TypedDict
 
 from tools.doc_generator import generate_agenda_document
-from tools.agenda_selector import set_prompt_template
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-
-import datetime
-from IPython.display import display, Image
+from tools.agenda_prompt_registry import AgendaPromptRegistry
+from tools.agenda_cache import (
+    GOALS_MARKER,
+    AgendaResultCache,
+    agenda_cache_key,
+    canonical_text,
+    confirmation_fields,
+    wants_regeneration,
+)
+from tools.agenda_speculation import AgendaSpeculator
+from tools.agenda_selector import get_prompt_for_engagement_type
+from util.az_clients import get_chat_llm, get_openai_client, get_openai_token_provider
 
-import logging
 from opencensus.ext.azure.log_exporter import AzureLogHandler
-from tools.hub_master import get_hub_masterdata
+from tools.hub_master import get_hub_masterdata, hub_master_cache, read_hub_masterdata
+from tools.speaker_mapping import (
+    assign_speaker,
+    assign_speakers,
+    build_speaker_index,
+    extract_goal_topics,
+    format_speaker_assignments,
+    summarize_hub_master,
+)
 from config import DefaultConfig
+from util.graph_checkpointer import build_checkpointer
+from util.graph_metrics import current_run_tokens, instrument_node, record_llm_usage, record_retry
+from util.conversation_context import (
+    build_context,
+    count_messages_tokens,
+    load_encoding,
+    summarize_messages,
+)
 
 l_config = DefaultConfig()
 
@@ -56,26 +65,6 @@ logger.setLevel(log_level)
 # logger.debug(f"Logging level set to {log_level_str}")
 # logger.setLevel(logging.DEBUG)
 
-# Initialize Azure OpenAI Service client with Entra ID authentication
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
-)
-
-llm = AzureChatOpenAI(
-    azure_endpoint=az_openai_endpoint,
-    azure_deployment=az_openai_deployment_name,
-    azure_ad_token_provider=token_provider,
-    openai_api_type=az_api_type,
-    api_version=az_openai_version,
-    temperature=0.3,
-)
-
-client = AzureOpenAI(
-    azure_ad_token_provider=token_provider,
-    azure_endpoint=az_openai_endpoint,
-    api_version=az_openai_version,
-)
-
 
 def update_dialog_stack(left: list[str], right: Optional[str]) -> list[str]:
     """Push or pop the state."""
@@ -89,9 +78,13 @@ def update_dialog_stack(left: list[str], right: Optional[str]) -> list[str]:
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
     engagement_type: str
-    prompt_template: str
+    engagement_metadata: Optional[dict]
     user_name: Optional[str]
     hub_master_info: str
+    matched_speakers: str
+    agenda_cache_key: Optional[str]
+    context_summary: Optional[str]
+    summarized_message_id: Optional[str]
     dialog_state: Annotated[
         list[
             Literal[
@@ -106,18 +99,36 @@ class State(TypedDict):
 
 
 class Assistant:
-    def __init__(self, runnable: Runnable):
-        self.runnable = runnable
+    def __init__(self, prompt: ChatPromptTemplate, tools: list):
+        self.prompt = prompt
+        self.tools = tools
+        self._runnable = None
+
+    @property
+    def runnable(self) -> Runnable:
+        # The model is bound to the tools on first use, so that importing the module does not create the clients
+        if self._runnable is None:
+            self._runnable = self.prompt | get_chat_llm().bind_tools(self.tools)
+        return self._runnable
 
     def __call__(self, state: State, config: RunnableConfig):
+        # Send the model a token budgeted context instead of the whole conversation
+        messages = build_context(
+            state["messages"],
+            state.get("context_summary"),
+            state.get("summarized_message_id"),
+        )
+        state = {**state, "messages": messages}
         while True:
             result = self.runnable.invoke(state)
+            record_llm_usage(result)
 
             if not result.tool_calls and (
                 not result.content
                 or isinstance(result.content, list)
                 and not result.content[0].get("text")
             ):
+                record_retry()
                 messages = state["messages"] + [("user", "Respond with a real output.")]
                 state = {**state, "messages": messages}
             else:
@@ -149,10 +160,51 @@ class CompleteOrEscalate(BaseModel):
         }
 
 
+EngagementType = Literal[
+    "BUSINESS_ENVISIONING",
+    "SOLUTION_ENVISIONING",
+    "ADS",
+    "RAPID_PROTOTYPE",
+    "HACKATHON",
+    "CONSULT",
+]
+
+
+class EngagementMetadata(BaseModel):
+    """A tool to record the engagement metadata the user has confirmed, before the final summary output."""
+
+    customer_name: str = Field(description="The name of the customer")
+    engagement_type: EngagementType = Field(description="The confirmed type of engagement")
+    mode_of_delivery: str = Field(description="The confirmed mode of delivery")
+    conversation_depth: str = Field(
+        description="purely technical, purely domain/business, or combination of technical & business"
+    )
+    lead_architect: str = Field(description="The lead architect from the Microsoft Innovation Hub")
+    engagement_date: str = Field(description="The date of the engagement, in DD-MMM-YYYY format")
+    engagement_time: Optional[str] = Field(
+        default=None, description="The time the customer team arrives for the engagement"
+    )
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "customer_name": "Contoso",
+                "engagement_type": "ADS",
+                "mode_of_delivery": "In person at the Microsoft Innovation Hub facility, Bengaluru",
+                "conversation_depth": "combination of technical & business",
+                "lead_architect": "Pallavi Lokesh",
+                "engagement_date": "15-Dec-2026",
+                "engagement_time": "10:00 AM",
+            }
+        }
+
+
 # -------------------------------
 # Notes Extractor Agent Prompt
 # -------------------------------
-notes_extractor_sys_prompt = """
+# The parts of the system prompt of the Notes Extractor Agent. The agent either confirms the metadata one field after
+# another (sequential), or from a single confirmation form (batch); see notes_extraction_mode in the configuration
+notes_extractor_role = """
 - **Identity and Role:**
   - You are the Notes Extractor Agent.
   - Your primary responsibility is to extract, validate, and confirm essential metadata and customer goals from meeting notes.
@@ -161,7 +213,9 @@ notes_extractor_sys_prompt = """
   - Present the final structured response **only after confirming both metadata and agenda goals** with the user. {user_name} will be the user.
   - Refer to the content below to evaluate the rules and criteria specificed \n ----- hub master info ------\n {hub_master_info}\n ----- end of hub master info ------\n
 
-- **Briefing Notes Handling:**
+"""
+
+notes_briefing_notes_handling = """- **Briefing Notes Handling:**
   - Meeting notes may be provided as either:
     - `### Internal Briefing Notes ###` (internal Microsoft team), or
     - `### External Briefing Notes ###` (from meetings with the customer).
@@ -170,24 +224,9 @@ notes_extractor_sys_prompt = """
     - If both are missing, prompt the user to provide at least one before proceeding.
   - If only Internal notes are available, proceed with extraction without prompting further.
 
-- **Step 1: Metadata Extraction (Sequential with Confirmation)**
-  - The following metadata fields must be extracted **one after another**:
-    1. Customer Name
-    2. Type of Engagement
-    3. Mode of Delivery
-    4. Depth of the Conversation
-    5. Lead Architect
-    6. Date and Time of the Engagement (with future date validation)
-    7. Target Audience (Optional)
-
-  - For each field:
-    - If clearly available in the notes, extract it directly.
-    - If partially inferable, provide the **inferred value with reasoning**.
-      - e.g., `Customer Name: Contoso (inferred from multiple mentions of 'Contoso Ltd.' in the notes)`
-    - If not inferable, prompt the user for that field alone. **Do not ask for multiple fields at once.**
-    - Wait for user confirmation before proceeding to the next metadata.
+"""
 
-  - **Business Rules for Each Metadata Field:**
+notes_metadata_rules = """  - **Business Rules for Each Metadata Field:**
 
     - **Customer Name:**
       - Extract from mentions like “Contoso Ltd.” or “Contoso”.
@@ -233,7 +272,44 @@ notes_extractor_sys_prompt = """
       - Group by Microsoft and Customer teams.
       - Infer and confirm if mentioned.
 
-- **Step 2: Metadata Confirmation Message**
+"""
+
+notes_final_summary = """- **Step 5: Final Summary Output**
+  - Only after both metadata and goals are confirmed.
+  - First call the 'EngagementMetadata' tool, once, with the confirmed metadata.
+  - Then the output must be:
+    ```
+    Type of Engagement: <ENGAGEMENT_TYPE> (inferred from ...)
+    ### Engagement Goals Confirmation Message ###
+    [Include confirmed metadata summary here]
+    [Include confirmed goal summary here]
+    ```
+
+"""
+
+notes_extractor_sys_prompt = (
+    notes_extractor_role
+    + notes_briefing_notes_handling
+    + """- **Step 1: Metadata Extraction (Sequential with Confirmation)**
+  - The following metadata fields must be extracted **one after another**:
+    1. Customer Name
+    2. Type of Engagement
+    3. Mode of Delivery
+    4. Depth of the Conversation
+    5. Lead Architect
+    6. Date and Time of the Engagement (with future date validation)
+    7. Target Audience (Optional)
+
+  - For each field:
+    - If clearly available in the notes, extract it directly.
+    - If partially inferable, provide the **inferred value with reasoning**.
+      - e.g., `Customer Name: Contoso (inferred from multiple mentions of 'Contoso Ltd.' in the notes)`
+    - If not inferable, prompt the user for that field alone. **Do not ask for multiple fields at once.**
+    - Wait for user confirmation before proceeding to the next metadata.
+
+"""
+    + notes_metadata_rules
+    + """- **Step 2: Metadata Confirmation Message**
   - Once all metadata is confirmed, show the user:
     ```
     **Customer Name:** $CustomerName  
@@ -279,17 +355,9 @@ notes_extractor_sys_prompt = """
     ```
   - Wait for confirmation.
 
-- **Step 5: Final Summary Output**
-  - Only after both metadata and goals are confirmed.
-  - Output must be:
-    ```
-    Type of Engagement: <ENGAGEMENT_TYPE> (inferred from ...)
-    ### Engagement Goals Confirmation Message ###
-    [Include confirmed metadata summary here]
-    [Include confirmed goal summary here]
-    ```
-
-- **Important Do’s and Don’ts:**
+"""
+    + notes_final_summary
+    + """- **Important Do’s and Don’ts:**
   - ✅ Use chain-of-thought for every inference.
   - ✅ Ask for missing metadata **one by one**, not all at once.
   - ❌ Do not move to agenda goals until metadata is confirmed.
@@ -297,12 +365,125 @@ notes_extractor_sys_prompt = """
   - ❌ Do not restate briefing notes unnecessarily.
   - If the user needs help, and none of your tools are appropriate for it, then 'CompleteOrEscalate' the dialog to the host assistant. Do not waste the user\'s time. Do not make up invalid tools or functions.
 """
+)
+
+
+notes_extractor_batch_sys_prompt = (
+    """
+- **Identity and Role:**
+  - You are the Notes Extractor Agent.
+  - Your primary responsibility is to extract, validate, and confirm essential metadata and customer goals from meeting notes.
+  - All the metadata and the goals are extracted from the notes at once, and presented to the user in a single confirmation form.
+  - Always use **chain-of-thought reasoning** while inferring values.
+  - Present the final structured response **only after confirming both metadata and agenda goals** with the user. {user_name} will be the user.
+  - Refer to the content below to evaluate the rules and criteria specificed \n ----- hub master info ------\n {hub_master_info}\n ----- end of hub master info ------\n
+
+"""
+    + notes_briefing_notes_handling
+    + """- **Step 1: Metadata and Goals Extraction (Single Pass)**
+  - Extract, in one pass, the metadata fields: Customer Name, Type of Engagement, Mode of Delivery, Depth of the Conversation, Lead Architect, Date and Time of the Engagement, Target Audience (Optional); and the Customer Goals relevant to the session, each with a short name and bullet points with its details.
+  - For each field, give the **inferred value with reasoning**. Leave out the value of a field that cannot be inferred, and mark the fields the user needs to choose or confirm as ambiguous.
+
+"""
+    + notes_metadata_rules
+    + """- **Step 2: Single Confirmation Form**
+  - The metadata and the goals are presented together, in one message; the user confirms them, or corrects the fields that are not right.
+  - When the user confirms the form without changes, the form is the final summary: call the 'EngagementMetadata' tool with its metadata, then 'CompleteOrEscalate' the dialog.
+  - When the user corrects some fields, apply the corrections. Ask again, in a single message, **only** for the fields the user rejected and the ones still to be provided or ambiguous. Do not ask again for the fields already confirmed.
+
+"""
+    + notes_final_summary
+    + """- **Important Do’s and Don’ts:**
+  - ✅ Use chain-of-thought for every inference.
+  - ✅ Ask for all the missing or rejected fields in one message.
+  - ❌ Do not ask again for the fields the user has confirmed.
+  - ❌ Do not create meeting agendas or schedules.
+  - ❌ Do not restate briefing notes unnecessarily.
+  - If the user needs help, and none of your tools are appropriate for it, then 'CompleteOrEscalate' the dialog to the host assistant. Do not waste the user\'s time. Do not make up invalid tools or functions.
+"""
+)
+
+
+class InferredValue(BaseModel):
+    value: Optional[str] = Field(default=None, description="The value, none when it cannot be inferred from the notes")
+    reasoning: str = Field(default="", description="Where in the notes the value comes from, or how it is inferred")
+    ambiguous: bool = Field(default=False, description="Whether the user needs to choose or confirm the value")
+
+
+class EngagementGoal(BaseModel):
+    name: str = Field(description="The short name of the goal")
+    details: list[str] = Field(default_factory=list, description="The details of the goal from across the notes")
+
+
+class BriefingNotesExtraction(BaseModel):
+    """The metadata and the goals of the engagement, extracted from the briefing notes in one pass."""
+
+    customer_name: InferredValue
+    engagement_type: InferredValue = Field(
+        description="One of BUSINESS_ENVISIONING, SOLUTION_ENVISIONING, ADS, RAPID_PROTOTYPE, HACKATHON, CONSULT"
+    )
+    mode_of_delivery: InferredValue
+    conversation_depth: InferredValue
+    lead_architect: InferredValue
+    engagement_date: InferredValue = Field(description="The date of the engagement, in DD-MMM-YYYY format")
+    engagement_time: InferredValue
+    target_audience: InferredValue
+    goals: list[EngagementGoal]
+
+
+# The fields of the confirmation form of the batch mode, in the order of the final summary
+BATCH_FORM_FIELDS = [
+    ("customer_name", "Customer Name"),
+    ("engagement_date", "Date of the Engagement"),
+    ("engagement_time", "Customer Team will arrive for the Engagement at"),
+    ("mode_of_delivery", "Mode of Delivery"),
+    ("engagement_type", "Type of Engagement"),
+    ("conversation_depth", "Depth of the Conversation"),
+    ("target_audience", "Key stakeholders who would be attending the Session"),
+    ("lead_architect", "Lead Architect"),
+]
+
+
+def format_confirmation_form(extraction: BriefingNotesExtraction) -> str:
+    """The metadata and goals as a single confirmation form, in the format of the final summary of the agent"""
+    engagement_type = extraction.engagement_type
+    lines = [
+        f"Type of Engagement: {engagement_type.value or 'to be provided'} ({engagement_type.reasoning or 'not found in the notes'})",
+        "### Engagement Goals Confirmation Message ###",
+    ]
+    to_ask = []
+    for field, label in BATCH_FORM_FIELDS:
+        inferred = getattr(extraction, field)
+        if not inferred.value:
+            if field == "target_audience":
+                # Optional, not asked for
+                lines.append(f"**{label}:** _not mentioned in the notes_")
+                continue
+            lines.append(f"**{label}:** _to be provided_")
+            to_ask.append(label)
+            continue
+        note = f" ({inferred.reasoning})" if inferred.reasoning else ""
+        if inferred.ambiguous:
+            note += " - _please confirm_"
+            to_ask.append(label)
+        lines.append(f"**{label}:** {inferred.value}{note}")
+    lines.append("")
+    for number, goal in enumerate(extraction.goals, start=1):
+        lines.append(f"- Goal {number}: {goal.name}")
+        lines.extend(f"    - {detail}" for detail in goal.details)
+    lines.append("")
+    if to_ask:
+        lines.append(f"Please provide or confirm: {', '.join(to_ask)}.")
+    lines.append(
+        "Can you confirm if this is ok? Reply with the corrections of any field or goal that is not right."
+    )
+    return "\n".join(lines)
 
 
 notes_Extractor_Agent_prompt = (
     ChatPromptTemplate(
         [
-            ("system", notes_extractor_sys_prompt + "\nCurrent time: {time}."),
+            ("system", (notes_extractor_batch_sys_prompt if l_config.notes_extraction_mode == "batch" else notes_extractor_sys_prompt) + "\nCurrent time: {time}."),
             ("placeholder", "{messages}"),
         ]
     )
@@ -310,11 +491,6 @@ notes_Extractor_Agent_prompt = (
     .partial(user_name=State["user_name"])
 )
 
-notes_extractor_runnable = notes_Extractor_Agent_prompt | llm.bind_tools(
-    [CompleteOrEscalate]
-)
-
-
 # -------------------------------
 # Data Transfer Models
 # -------------------------------
@@ -339,35 +515,66 @@ class ToNotesExtractor(BaseModel):
         }
 
 
+# The instructions, the agenda template and the Hub Master data; compiled once per engagement type and hub, see
+# tools/agenda_prompt_registry.py. Nothing specific to the conversation goes here, so that the prompt stays byte-identical
 agenda_creator_sys_prompt = """
     **You are the Agenda Creator Agent**
     - Your primary responsibility is to generate a detailed Agenda based on the metadata and goals provided as input.
-    - Refer to the content below to evaluate the rules and criteria specificed \n ----- hub master info ------\n {hub_master_info}\n ----- end of hub master info ------\n
-    - Use the Agenda Template format and instructions below and populate the topics.\n ----- start of agenda template ------\n {prompt_template} \n  ----- end of agenda template ------\n
-    - To identify the speakers for the topics, refer to the #SpeakerMappingTable in the hub master info above.
     - You will receive the input for agenda topics creation inside the section labeled **### Engagement Goals Confirmation Message ###**.
-    - When missing information is identified, ask the user for the missing details.  {user_name} will be the user you are interacting with. Address the user when interacting with, but do not overdo it.
+    - When missing information is identified, ask the user for the missing details. Address the user when interacting with, but do not overdo it.
     - **Create a final Agenda** in the Markdown table format following the sample provided.
     - Add the created agenda information under the **### Innovation Hub Engagement Agenda ###** section of the message.
     - Present it to the user and ask for confirmation before finalizing your work.
     - If the user needs help, and none of your tools are appropriate for it, then 'CompleteOrEscalate' the dialog to the host assistant. Do not waste the user\'s time. Do not make up invalid tools or functions.
+    - Use the Agenda Template format and instructions below and populate the topics.\n ----- start of agenda template ------\n {prompt_template} \n  ----- end of agenda template ------\n
+    - Refer to the content below to evaluate the rules and criteria specificed \n ----- hub master info ------\n {hub_master_info}\n ----- end of hub master info ------\n
 """
 
-agenda_Creator_Agent_prompt = (
-    ChatPromptTemplate(
-        [
-            ("system", agenda_creator_sys_prompt),
-            ("placeholder", "{messages}"),
-        ]
-    )
-    .partial(time=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-    .partial(user_name=State["user_name"])
+# The part of the system prompt specific to the conversation, sent after the compiled one
+agenda_creator_conversation_prompt = """
+    - {user_name} will be the user you are interacting with.
+    - The speakers matched to the engagement goals from the #SpeakerMappingTable are below. Use them for the topics of these goals. For any other topic, call the 'assign_speakers' tool to get its speaker.\n ----- ##MatchedSpeakers ------\n {matched_speakers}\n ----- end of matched speakers ------\n
+"""
+
+agenda_prompt_registry = AgendaPromptRegistry(agenda_creator_sys_prompt)
+
+
+def agenda_creator_messages(state: State) -> list:
+    """The system prompt of the hub and engagement type, the part specific to the conversation, then the messages."""
+    engagement_type = state.get("engagement_type") or infer_engagement_type(state["messages"])
+    return [
+        SystemMessage(content=agenda_prompt_registry.get(engagement_type, state.get("hub_master_info"))),
+        SystemMessage(
+            content=agenda_creator_conversation_prompt.format(
+                user_name=state.get("user_name"),
+                matched_speakers=state.get("matched_speakers") or "None",
+            )
+        ),
+    ] + list(state["messages"])
+
+
+agenda_Creator_Agent_prompt = RunnableLambda(agenda_creator_messages)
+
+# The agendas created for the confirmed goals, see tools/agenda_cache.py
+agenda_cache = (
+    AgendaResultCache(l_config.agenda_cache_max_entries, l_config.agenda_cache_dir)
+    if l_config.agenda_cache_enabled
+    else None
 )
 
-agenda_creator_runnable = agenda_Creator_Agent_prompt | llm.bind_tools(
-    [CompleteOrEscalate]
+# The agendas created while the user reviews the proposed goals, see tools/agenda_speculation.py
+agenda_speculator = (
+    AgendaSpeculator(
+        l_config.agenda_speculation_max_workers,
+        l_config.agenda_speculation_wait_seconds,
+        l_config.agenda_speculation_max_age_minutes * 60,
+    )
+    if l_config.agenda_speculation_enabled
+    else None
 )
 
+agenda_creation_tools = [assign_speakers]
+
 
 class ToAgendaCreator(BaseModel):
     request: str = Field(
@@ -376,12 +583,17 @@ class ToAgendaCreator(BaseModel):
     agenda_goals: str = Field(
         description="The metadata and detailed goals for the agenda are as follows."
     )
+    regenerate: bool = Field(
+        default=False,
+        description="True only when the user explicitly asks for a new agenda instead of the agenda already created for these goals",
+    )
 
     class Config:
         json_schema_extra = {
             "example": {
                 "request": "I want to prepare a detailed Agenda for the Innovation Hub Session for Customer Contoso",
                 "agenda_goals": "### Engagement Goals Confirmation Message ### \n lot of text",
+                "regenerate": False,
             }
         }
 
@@ -411,10 +623,6 @@ document_generation_prompt = (
 
 document_generation_tools = [generate_agenda_document]
 
-document_generation_runnable = document_generation_prompt | llm.bind_tools(
-    document_generation_tools + [CompleteOrEscalate]
-)
-
 
 class ToDocumentGenerator(BaseModel):
     query: str = Field(
@@ -462,9 +670,6 @@ primary_agent_prompt = (
     .partial(user_name=State["user_name"])
 )
 
-primary_agent_runnable = primary_agent_prompt | llm.bind_tools(
-    [ToNotesExtractor, ToAgendaCreator, ToDocumentGenerator]
-)
 
 
 # -------------------------------
@@ -529,11 +734,23 @@ def _print_event(event: dict, _printed: set, max_length=1500):
 builder = StateGraph(State)
 
 
+# The agents of the graph, see warm_up
+assistants = []
+
+
+def add_node(name: str, node):
+    """Add the node to the graph, instrumented for the latency and token metrics"""
+    if isinstance(node, Assistant):
+        assistants.append(node)
+    builder.add_node(name, instrument_node(name, node))
+
+
 def hub_master_info(state: State):
     if state.get("hub_master_info"):
         return {"hub_master_info": state.get("hub_master_info")}
     else:
-        return {"hub_master_info": get_hub_masterdata.invoke({})}
+        # Only the speakers of each category are passed to the prompts; the topic keywords are matched by the speaker index
+        return {"hub_master_info": summarize_hub_master(get_hub_masterdata.invoke({}))}
 
 
 def extract_user_name(state: State, config: RunnableConfig) -> dict:
@@ -549,75 +766,174 @@ def extract_user_name(state: State, config: RunnableConfig) -> dict:
     return {"user_name": user_name}
 
 
-builder.add_node("extract_user_name", extract_user_name)
+add_node("extract_user_name", extract_user_name)
 builder.add_edge(START, "extract_user_name")
 builder.add_edge("extract_user_name", "fetch_hub_info")
-builder.add_node("fetch_hub_info", hub_master_info)
+add_node("fetch_hub_info", hub_master_info)
 # builder.add_edge(START, "fetch_hub_info")
 
 
-def prompt_template(state: State) -> dict:
-    logger.debug("Setting update_prompt_template_node")
+def infer_engagement_type(messages: list) -> str:
+    """The engagement type in the latest 'Type of Engagement:' line of the conversation, SOLUTION_ENVISIONING by default.
 
+    Only used when the Notes Extractor Agent has not recorded the engagement metadata, see record_engagement_metadata.
+    """
     assistant_response = None
     # Iterate backwards over messages to find the desired assistant response
-    for msg in reversed(state["messages"]):
-        if hasattr(msg, "content") and "Type of Engagement:" in msg.content:
+    for msg in reversed(messages):
+        if hasattr(msg, "content") and isinstance(msg.content, str) and "Type of Engagement:" in msg.content:
             assistant_response = msg.content
             break
 
     if assistant_response:
-        try:
-            part = assistant_response.split("Type of Engagement:")[1].strip()
-            engagement_inferred = part.split("(")[0].strip()
-            state["engagement_type"] = engagement_inferred
-            logger.debug(f"Extracted engagement type: {engagement_inferred}")
-
-            # Define valid engagement types
-            valid_types = {
-                "BUSINESS_ENVISIONING",
-                "SOLUTION_ENVISIONING",
-                "ADS",
-                "RAPID_PROTOTYPE",
-                "HACKATHON",
-                "CONSULT",
-            }
-
-            # Find the first matching valid type in the string
-            engagement_type = next(
-                (t for t in valid_types if t in engagement_inferred),
-                "SOLUTION_ENVISIONING",
-            )
-            state["engagement_type"] = engagement_type
-        except Exception:
-            state["engagement_type"] = "SOLUTION_ENVISIONING"  # Fallback default
-    else:
-        state["engagement_type"] = "SOLUTION_ENVISIONING"  # Default if not found
+        part = assistant_response.split("Type of Engagement:")[1].strip()
+        engagement_inferred = part.split("(")[0].strip()
+        logger.debug(f"Extracted engagement type: {engagement_inferred}")
+        # Find the first matching valid type in the string
+        engagement_type = next((t for t in get_args(EngagementType) if t in engagement_inferred), None)
+        if engagement_type:
+            return engagement_type
+    logger.warning("The engagement type is not known, the SOLUTION_ENVISIONING agenda template is used")
+    return "SOLUTION_ENVISIONING"
 
-    if state.get("engagement_type"):
-        engagement_type = state["engagement_type"]
-        template_result = set_prompt_template(engagement_type)
-        state["prompt_template"] = template_result["prompt_template"]
-        logger.debug(f"Updated prompt_template for engagement type {engagement_type}")
-    else:
-        logger.debug(
-            "engagement_type not found in state; cannot update prompt_template"
-        )
 
-    return {"prompt_template": state.get("prompt_template", None)}
+def prompt_template(state: State) -> dict:
+    # Reached when the Notes Extractor Agent completed without recording the engagement metadata
+    logger.debug("Setting update_prompt_template_node")
+    # Only the engagement type is kept in the state; its agenda template is compiled in the system prompt
+    engagement_type = infer_engagement_type(state["messages"])
+    logger.debug(f"Updated the engagement type to {engagement_type}")
+    return {"engagement_type": engagement_type}
 
 
-builder.add_node("set_prompt_template", prompt_template)
+add_node("set_prompt_template", prompt_template)
 
 # -------------------------------
 # Nodes for Notes Extraction
 # -------------------------------
-builder.add_node(
+add_node(
     "enter_notes_extraction",
     create_entry_node("Notes Extraction Agent", "notes_extraction"),
 )
-builder.add_node("notes_extraction", Assistant(notes_extractor_runnable))
-builder.add_edge("enter_notes_extraction", "notes_extraction")
+
+
+def proposes_goals(message) -> bool:
+    """Whether the message proposes the engagement goals to the user, and the agenda is to be speculated"""
+    return (
+        agenda_speculator is not None
+        and not getattr(message, "tool_calls", None)
+        and isinstance(message.content, str)
+        and GOALS_MARKER in message.content
+    )
+
+
+class NotesExtractor(Assistant):
+    """The Notes Extractor Agent. When it proposes the engagement goals to the user, the creation of their agenda is
+    started in the background, see speculate_agenda."""
+
+    def __call__(self, state: State, config: RunnableConfig):
+        update = super().__call__(state, config)
+        if proposes_goals(update["messages"]):
+            speculate_agenda(state, config, update["messages"])
+        return update
+
+
+add_node("notes_extraction", NotesExtractor(notes_Extractor_Agent_prompt, [EngagementMetadata, CompleteOrEscalate]))
+
+
+def record_engagement_metadata(state: State) -> dict:
+    """Keep the engagement metadata confirmed by the user in the state, for the routing and the agenda prompt"""
+    update = {"messages": []}
+    for tool_call in state["messages"][-1].tool_calls:
+        if tool_call["name"] == CompleteOrEscalate.__name__:
+            content = "Resuming dialog with the host assistant. Please reflect on the past conversation and assist the user as needed."
+        else:
+            try:
+                metadata = EngagementMetadata.model_validate(tool_call["args"])
+                update["engagement_metadata"] = metadata.model_dump()
+                update["engagement_type"] = metadata.engagement_type
+                content = "The engagement metadata is recorded."
+                logger.debug(f"Recorded the engagement metadata, engagement type {metadata.engagement_type}")
+            except ValidationError as e:
+                content = f"Error: {repr(e)}\n please fix your mistakes."
+        update["messages"].append(ToolMessage(content=content, tool_call_id=tool_call["id"]))
+    return update
+
+
+def route_record_engagement_metadata(state: State):
+    did_cancel = any(
+        tc["name"] == CompleteOrEscalate.__name__ for tc in _last_tool_calls(state["messages"])
+    )
+    return "leave_skill" if did_cancel else "notes_extraction"
+
+
+def _last_tool_calls(messages: list) -> list:
+    for msg in reversed(messages):
+        if getattr(msg, "tool_calls", None):
+            return msg.tool_calls
+    return []
+
+
+add_node("record_engagement_metadata", record_engagement_metadata)
+builder.add_conditional_edges(
+    "record_engagement_metadata",
+    route_record_engagement_metadata,
+    ["notes_extraction", "leave_skill"],
+)
+
+
+def briefing_notes(messages: list) -> str:
+    """The briefing notes handed to the Notes Extractor Agent, else the latest message of the user"""
+    for msg in reversed(messages):
+        for tool_call in getattr(msg, "tool_calls", None) or []:
+            if tool_call["name"] == ToNotesExtractor.__name__:
+                notes = [tool_call["args"].get("external_briefing_notes"), tool_call["args"].get("internal_briefing_notes")]
+                if any(notes):
+                    return "\n\n".join(n for n in notes if n)
+        if isinstance(msg, HumanMessage):
+            return msg.content if isinstance(msg.content, str) else None
+    return None
+
+
+def extract_briefing_notes(state: State, config: RunnableConfig) -> dict:
+    """In the batch mode, extract the metadata and the goals from the briefing notes in one structured call, and
+    present them in a single confirmation form. The Notes Extractor Agent then handles the answer of the user"""
+    notes = briefing_notes(state["messages"])
+    if not notes:
+        return {}
+    prompt = notes_Extractor_Agent_prompt.invoke({**state, "messages": [HumanMessage(content=notes)]})
+    try:
+        result = (
+            get_chat_llm()
+            .with_structured_output(BriefingNotesExtraction, method="function_calling", include_raw=True)
+            .invoke(prompt)
+        )
+    except Exception as e:
+        logger.warning(f"The single pass extraction of the briefing notes failed, the agent extracts them instead: {str(e)}")
+        return {}
+    record_llm_usage(result["raw"])
+    if result["parsed"] is None:
+        logger.warning(f"The single pass extraction of the briefing notes is invalid: {result.get('parsing_error')}")
+        return {}
+    form = AIMessage(content=format_confirmation_form(result["parsed"]))
+    if proposes_goals(form):
+        speculate_agenda(state, config, form)
+    return {"messages": [form]}
+
+
+def route_extract_briefing_notes(state: State):
+    # The confirmation form is presented to the user; else the agent takes over
+    if isinstance(state["messages"][-1], AIMessage):
+        return END
+    return "notes_extraction"
+
+
+if l_config.notes_extraction_mode == "batch":
+    add_node("extract_briefing_notes", extract_briefing_notes)
+    builder.add_edge("enter_notes_extraction", "extract_briefing_notes")
+    builder.add_conditional_edges("extract_briefing_notes", route_extract_briefing_notes, ["notes_extraction", END])
+else:
+    builder.add_edge("enter_notes_extraction", "notes_extraction")
 builder.add_edge("set_prompt_template", "leave_skill")
 
 
@@ -626,10 +942,12 @@ def route_notes_extraction(state: State):
     if route == END:
         return END
     tool_calls = state["messages"][-1].tool_calls
+    if any(tc["name"] == EngagementMetadata.__name__ for tc in tool_calls):
+        return "record_engagement_metadata"
     did_cancel = any(tc["name"] == CompleteOrEscalate.__name__ for tc in tool_calls)
     if did_cancel:
-        if "prompt_template" in state and state["prompt_template"]:
-            logger.debug("the prompt template is set, hence leaving the skill")
+        if state.get("engagement_type"):
+            logger.debug("the engagement type is set, hence leaving the skill")
             return "leave_skill"
         else:
             return "set_prompt_template"
@@ -644,19 +962,188 @@ def route_notes_extraction(state: State):
 builder.add_conditional_edges(
     "notes_extraction",
     route_notes_extraction,
-    ["set_prompt_template", "leave_skill", END],
+    ["record_engagement_metadata", "set_prompt_template", "leave_skill", END],
 )
 
 
 # -------------------------------
 # Nodes for Agenda Creation
 # -------------------------------
-builder.add_node(
+add_node(
     "enter_agenda_creation",
     create_entry_node("Agenda Creation Agent", "agenda_creation"),
 )
-builder.add_node("agenda_creation", Assistant(agenda_creator_runnable))
-builder.add_edge("enter_agenda_creation", "agenda_creation")
+
+
+def confirmed_goals(messages: list) -> str:
+    """The confirmed engagement goals handed to the Agenda Creator Agent, or the latest goals confirmation message"""
+    for msg in reversed(messages):
+        for tool_call in getattr(msg, "tool_calls", None) or []:
+            if tool_call["name"] == ToAgendaCreator.__name__ and tool_call["args"].get("agenda_goals"):
+                return tool_call["args"]["agenda_goals"]
+        if isinstance(msg.content, str) and "### Engagement Goals Confirmation Message ###" in msg.content:
+            return msg.content
+    return None
+
+
+def regeneration_requested(messages: list) -> bool:
+    """Whether the user asked for a new agenda in the current turn: the regenerate flag of the hand-over of the primary
+    assistant to the Agenda Creator Agent, or the words of the latest message of the user"""
+    for msg in reversed(messages):
+        for tool_call in getattr(msg, "tool_calls", None) or []:
+            if tool_call["name"] == ToAgendaCreator.__name__ and tool_call["args"].get("regenerate"):
+                return True
+        if isinstance(msg, HumanMessage):
+            return isinstance(msg.content, str) and wants_regeneration(msg.content)
+    return False
+
+
+def agenda_presented(messages: list) -> bool:
+    """Whether an agenda was already presented for the latest goals confirmation message, i.e. the request to the
+    Agenda Creator Agent is a follow-up on it (e.g. a change of the start time) and not the creation of the agenda"""
+    for msg in reversed(messages):
+        if not isinstance(msg, AIMessage) or not isinstance(msg.content, str):
+            continue
+        if "### Innovation Hub Engagement Agenda ###" in msg.content:
+            return True
+        if GOALS_MARKER in msg.content:
+            return False
+    return False
+
+
+class AgendaCreator(Assistant):
+    """The Agenda Creator Agent. The first agenda it creates for the confirmed goals, or the one the user asked to
+    regenerate, is cached; the later changes the user asks for are not."""
+
+    def __call__(self, state: State, config: RunnableConfig):
+        update = super().__call__(state, config)
+        result = update["messages"]
+        key = state.get("agenda_cache_key")
+        if (
+            agenda_cache is not None
+            and key
+            and not result.tool_calls
+            and isinstance(result.content, str)
+            and "### Innovation Hub Engagement Agenda ###" in result.content
+            and (regeneration_requested(state["messages"]) or not (
+                agenda_presented(state["messages"]) or agenda_cache.contains(key)
+            ))
+        ):
+            agenda_cache.put(key, result.content)
+        return update
+
+
+agenda_creator = AgendaCreator(agenda_Creator_Agent_prompt, agenda_creation_tools + [CompleteOrEscalate])
+add_node("agenda_creation", agenda_creator)
+
+
+def match_speakers(state: State, config: RunnableConfig) -> dict:
+    """Assign the speakers to the confirmed engagement goals, from the speaker index of the hub"""
+    goals_message = confirmed_goals(state["messages"])
+    topics = extract_goal_topics(goals_message or "")
+    cityname = config.get("configurable", {}).get("hub_location")
+    if not topics or not cityname:
+        return {"matched_speakers": "None"}
+    index = build_speaker_index(read_hub_masterdata(cityname))
+    assignments = [assign_speaker(index, topic) for topic in topics]
+    logger.debug(f"Speakers matched to {len(topics)} engagement goals")
+    return {"matched_speakers": format_speaker_assignments(assignments)}
+
+
+def agenda_system_prompt(engagement_type: str) -> str:
+    """The instructions and the agenda template of the Agenda Creator Agent for the engagement type, as versioned in
+    the keys of the agendas"""
+    return agenda_creator_sys_prompt + agenda_creator_conversation_prompt + (get_prompt_for_engagement_type(engagement_type) or "")
+
+
+def goals_confirmation_message(messages: list) -> str:
+    """The latest '### Engagement Goals Confirmation Message ###' of the Notes Extractor Agent, else the goals handed
+    over to the Agenda Creator Agent"""
+    for msg in reversed(messages):
+        if isinstance(msg, AIMessage) and isinstance(msg.content, str) and GOALS_MARKER in msg.content:
+            return msg.content
+    return confirmed_goals(messages)
+
+
+def metadata_corrections(engagement_metadata: dict, goals_message: str) -> dict:
+    """The recorded engagement metadata that differs from the confirmation message, i.e. the corrections the user made
+    when confirming it. The fields the message does not show are not compared"""
+    fields = confirmation_fields(goals_message)
+    corrections = {}
+    for field, label in BATCH_FORM_FIELDS:
+        value = (engagement_metadata or {}).get(field)
+        shown = fields.get(canonical_text(label))
+        if value and shown is not None and canonical_text(str(value)) not in shown and shown not in canonical_text(str(value)):
+            corrections[field] = value
+    return corrections
+
+
+def agenda_key(state: State, goals_message: str, engagement_type: str) -> str:
+    """The key of the agenda of the goals, in the agenda cache and for the speculation, see tools/agenda_cache.py"""
+    return agenda_cache_key(
+        goals_message,
+        engagement_type,
+        state.get("hub_master_info"),
+        agenda_system_prompt(engagement_type),
+        metadata_corrections(state.get("engagement_metadata"), goals_message),
+    )
+
+
+def lookup_agenda(state: State, config: RunnableConfig) -> dict:
+    """Present the cached agenda of the confirmed goals, or the agenda speculated for them while the user reviewed
+    them, when there is one and the agenda is requested for the first time for these goals. A request for a new
+    agenda, or for a change to the agenda presented, goes to the Agenda Creator Agent"""
+    # Keyed by the message of the Notes Extractor Agent the user confirmed, not by the copy of the goals the primary
+    # assistant writes for the Agenda Creator Agent, which differs from one run to the next
+    goals_message = goals_confirmation_message(state["messages"])
+    thread_id = config.get("configurable", {}).get("thread_id")
+    if (agenda_cache is None and agenda_speculator is None) or not goals_message:
+        return {"agenda_cache_key": None}
+    engagement_type = state.get("engagement_type") or infer_engagement_type(state["messages"])
+    key = agenda_key(state, goals_message, engagement_type)
+    if regeneration_requested(state["messages"]):
+        logger.debug("The user asked for a new agenda, the cached and speculated agendas are not used")
+        if agenda_cache is not None:
+            agenda_cache.record_bypass()
+        if agenda_speculator is not None:
+            agenda_speculator.discard(thread_id, "regenerate")
+        return {"agenda_cache_key": key}
+    if agenda_presented(state["messages"]):
+        # The hand-over carries an instruction on the agenda presented, which the cached agenda does not follow
+        logger.debug("An agenda was already presented for these goals, the cached and speculated agendas are not used")
+        return {"agenda_cache_key": key}
+    agenda = agenda_cache.get(key) if agenda_cache is not None else None
+    if agenda is not None:
+        logger.debug(f"Presenting the cached agenda {key[:12]}")
+        if agenda_speculator is not None:
+            agenda_speculator.discard(thread_id, "cached")
+    elif agenda_speculator is not None:
+        agenda = agenda_speculator.claim(thread_id, key)
+        if agenda is None:
+            return {"agenda_cache_key": key}
+        logger.debug(f"Presenting the speculated agenda {key[:12]}")
+        if agenda_cache is not None:
+            agenda_cache.put(key, agenda)
+    else:
+        return {"agenda_cache_key": key}
+    return {"agenda_cache_key": key, "messages": [AIMessage(content=agenda)]}
+
+
+def route_lookup_agenda(state: State):
+    # The cached or speculated agenda is presented to the user, who is asked to confirm it as usual
+    if isinstance(state["messages"][-1], AIMessage):
+        return END
+    return "agenda_creation"
+
+
+add_node("match_speakers", match_speakers)
+add_node("lookup_agenda", lookup_agenda)
+builder.add_edge("enter_agenda_creation", "match_speakers")
+builder.add_edge("match_speakers", "lookup_agenda")
+builder.add_conditional_edges("lookup_agenda", route_lookup_agenda, ["agenda_creation", END])
+agenda_creation_tool_node = create_tool_node_with_fallback(agenda_creation_tools)
+add_node("agenda_creation_tools", agenda_creation_tool_node)
+builder.add_edge("agenda_creation_tools", "agenda_creation")
 
 
 def route_agenda_creation(state: State):
@@ -668,30 +1155,123 @@ def route_agenda_creation(state: State):
     if did_cancel:
         return "leave_skill"
 
-    # safe_toolnames = [
-    #     t.name if hasattr(t, "name") else t.__name__ for t in notes_extraction_tools
-    # ]
-    # if all(tc["name"] in safe_toolnames for tc in tool_calls):
-    #     return "notes_extraction_tools"
+    safe_toolnames = [
+        t.name if hasattr(t, "name") else t.__name__ for t in agenda_creation_tools
+    ]
+    if all(tc["name"] in safe_toolnames for tc in tool_calls):
+        return "agenda_creation_tools"
     return None
 
 
 builder.add_conditional_edges(
     "agenda_creation",
     route_agenda_creation,
-    ["leave_skill", END],
+    ["agenda_creation_tools", "leave_skill", END],
 )
 
+
+# -------------------------------
+# Speculative Agenda Creation
+# -------------------------------
+# The model calls of a speculation, the calls of the agent and its tool calls included
+SPECULATION_MAX_MODEL_CALLS = 4
+
+
+def create_speculative_agenda(state: State, config: RunnableConfig, cancelled: threading.Event) -> tuple:
+    """Create the agenda of the proposed goals on a worker thread, as the agenda_creation and agenda_creation_tools
+    nodes would. Returns the agenda, None when the agent did not complete it, and the tokens used."""
+    outcome = {}
+
+    def run(state: State, config: RunnableConfig):
+        messages = list(state["messages"])
+        try:
+            for _ in range(SPECULATION_MAX_MODEL_CALLS):
+                if cancelled.is_set():
+                    logger.debug("The speculative agenda is cancelled")
+                    return
+                result = agenda_creator({**state, "messages": messages}, config)["messages"]
+                messages.append(result)
+                if not result.tool_calls:
+                    if isinstance(result.content, str) and "### Innovation Hub Engagement Agenda ###" in result.content:
+                        outcome["agenda"] = result.content
+                    return
+                # Only the tools of the agent are run; a CompleteOrEscalate leaves the agenda to the user's turn
+                if route_agenda_creation({"messages": messages}) != "agenda_creation_tools":
+                    return
+                messages += agenda_creation_tool_node.invoke({"messages": messages}, config)["messages"]
+        finally:
+            outcome["tokens"] = current_run_tokens()
+
+    instrument_node("speculative_agenda_creation", run)(state, config)
+    return outcome.get("agenda"), outcome.get("tokens", 0)
+
+
+def speculate_agenda(state: State, config: RunnableConfig, proposal: AIMessage):
+    """Start the creation of the agenda of the goals the node proposes to the user, as if the user had confirmed them.
+
+    Called by the node that proposes them, not as a node of its own, so that the proposal stays the last update of the
+    turn, which is the reply to the user. A speculation that cannot be started leaves the turn unchanged.
+    """
+    configurable = config.get("configurable", {})
+    thread_id = configurable.get("thread_id")
+    if not thread_id:
+        return
+    try:
+        _speculate_agenda(thread_id, configurable, {**state, "messages": list(state["messages"]) + [proposal]}, config)
+    except Exception as e:
+        logger.warning(f"Unable to start the speculative agenda of the graph thread {thread_id}: {str(e)}")
+
+
+def _speculate_agenda(thread_id: str, configurable: dict, state: State, config: RunnableConfig):
+    goals_message = state["messages"][-1].content
+    engagement_type = state.get("engagement_type") or infer_engagement_type(state["messages"])
+    key = agenda_key(state, goals_message, engagement_type)
+    if agenda_cache is not None and agenda_cache.contains(key):
+        logger.debug("The agenda of the proposed goals is cached, it is not speculated")
+        return
+    # The goals are handed over to the Agenda Creator Agent from the confirmation message on
+    proposed_goals = goals_message[goals_message.index(GOALS_MARKER):]
+    handover = AIMessage(
+        content="",
+        tool_calls=[
+            {
+                "name": ToAgendaCreator.__name__,
+                "args": {"request": "Create the agenda for the Innovation Hub session", "agenda_goals": proposed_goals},
+                "id": f"speculative_{thread_id}",
+            }
+        ],
+    )
+    speculative_state = {
+        **state,
+        "engagement_type": engagement_type,
+        "agenda_cache_key": None,
+        "messages": list(state["messages"]) + [handover],
+    }
+    speculative_state["messages"] += create_entry_node("Agenda Creation Agent", "agenda_creation")(speculative_state)["messages"]
+    speculative_state.update(match_speakers(speculative_state, config))
+    # Only the settings of the conversation are kept; the callbacks and the internals of the graph run end with the turn
+    speculative_config = {
+        "configurable": {k: v for k, v in configurable.items() if not k.startswith(("__", "checkpoint"))}
+    }
+    agenda_speculator.start(
+        thread_id,
+        key,
+        lambda cancelled: create_speculative_agenda(speculative_state, speculative_config, cancelled),
+    )
+
 # -------------------------------
 # Nodes for Document Generation
 # -------------------------------
-builder.add_node(
+add_node(
     "enter_document_generation",
     create_entry_node("Document Generation Assistant", "document_generation"),
 )
-builder.add_node("document_generation", Assistant(document_generation_runnable))
+add_node(
+    "document_generation",
+    Assistant(document_generation_prompt, document_generation_tools + [CompleteOrEscalate]),
+)
 builder.add_edge("enter_document_generation", "document_generation")
-builder.add_node(
+add_node(
     "document_generation_tools",
     create_tool_node_with_fallback(document_generation_tools),
 )
@@ -732,7 +1312,7 @@ def pop_dialog_state(state: State) -> dict:
     to specific sub-graphs.
     """
     messages = []
-    if state["messages"][-1].tool_calls:
+    if getattr(state["messages"][-1], "tool_calls", None):
         # Note: Doesn't currently handle the edge case where the llm performs parallel tool calls
         messages.append(
             ToolMessage(
@@ -743,13 +1323,42 @@ def pop_dialog_state(state: State) -> dict:
     return {"dialog_state": "pop", "messages": messages}
 
 
-builder.add_node("leave_skill", pop_dialog_state)
-builder.add_edge("leave_skill", "primary_assistant")
+add_node("leave_skill", pop_dialog_state)
+
+
+def summarize_context(state: State) -> dict:
+    """At the end of a stage, summarize the earlier turns of the conversation once they are long enough."""
+    if not l_config.graph_context_max_tokens or not l_config.graph_context_summarize_min_tokens:
+        return {}
+    messages = state["messages"]
+    current_start = next(
+        (i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)), 0
+    )
+    summarized_id = state.get("summarized_message_id")
+    start = next((i + 1 for i, m in enumerate(messages) if summarized_id and m.id == summarized_id), 0)
+    pending = messages[start:current_start]
+    if not pending or count_messages_tokens(pending) < l_config.graph_context_summarize_min_tokens:
+        return {}
+    try:
+        summary = summarize_messages(get_chat_llm(), pending, state.get("context_summary"))
+    except Exception as e:
+        logger.warning(f"Unable to summarize the conversation, the earlier turns are trimmed instead: {str(e)}")
+        return {}
+    logger.debug(f"Summarized {len(pending)} messages of the conversation")
+    return {"context_summary": summary, "summarized_message_id": pending[-1].id}
+
+
+add_node("summarize_context", summarize_context)
+builder.add_edge("leave_skill", "summarize_context")
+builder.add_edge("summarize_context", "primary_assistant")
 
 # -------------------------------
 # Primary Assistant Node
 # -------------------------------
-builder.add_node("primary_assistant", Assistant(primary_agent_runnable))
+add_node(
+    "primary_assistant",
+    Assistant(primary_agent_prompt, [ToNotesExtractor, ToAgendaCreator, ToDocumentGenerator]),
+)
 
 
 def route_primary_assistant(state: State):
@@ -800,11 +1409,71 @@ def route_to_workflow(
 builder.add_conditional_edges("fetch_hub_info", route_to_workflow)
 
 
-memory = MemorySaver()
-graph = builder.compile(checkpointer=memory)
+# The checkpointer and the compiled graph are created on first use, not at import; see get_graph and warm_up
+_graph = None
+_memory = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """The compiled graph, compiled on first use."""
+    global _graph, _memory
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                start = time.perf_counter()
+                # Idle graph threads are evicted from the checkpointer; see graph_checkpointer in the configuration for the backend
+                _memory = build_checkpointer(l_config)
+                _graph = builder.compile(checkpointer=_memory)
+                logger.info(f"Graph compiled in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return _graph
+
+
+def get_checkpointer():
+    get_graph()
+    return _memory
+
+
+def warm_up():
+    """
+    Compile the graph, create the model clients (the chat model bound to the tools of each agent, and the client of
+    the Assistants API), acquire the first Entra ID token, load the tiktoken encoding of the token budget and compile
+    the agenda prompts of the hubs in the cache, ahead of the first turn, e.g. in the background at the startup of the
+    app.
+    """
+    start = time.perf_counter()
+    get_graph()
+    for assistant in assistants:
+        assistant.runnable
+    get_openai_client()
+    try:
+        get_openai_token_provider()()
+    except Exception as e:
+        logger.warning(f"Unable to acquire the Azure OpenAI token during the warm up: {str(e)}")
+    load_encoding()
+    precompile_agenda_prompts()
+    logger.info(f"Graph warmed up in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+def precompile_agenda_prompts() -> int:
+    """Compile the agenda prompts of all the engagement types for the Hub Master data in the cache."""
+    compiled = agenda_prompt_registry.precompile(
+        [summarize_hub_master(content) for content in hub_master_cache.contents()]
+    )
+    logger.debug(f"Precompiled {compiled} agenda prompts")
+    return compiled
+
+
+def __getattr__(name: str):
+    # graph_build.graph and graph_build.memory, compiled on first access
+    if name == "graph":
+        return get_graph()
+    if name == "memory":
+        return get_checkpointer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-# Uncomment below to generate and display the graph image if needed
-# graph_image = graph.get_graph().draw_mermaid_png()
+# To generate the graph image if needed:
+# graph_image = get_graph().get_graph().draw_mermaid_png()
 # with open("graph_bot_app.png", "wb") as f:
 #     f.write(graph_image)
-# display(Image("graph_bot_app.png"))
@@ -0,0 +1,222 @@
+"""
+The agendas created by the Agenda Creator Agent, cached by the content they were created from.
+
+An agenda is keyed by a canonical hash of the confirmation message of the Notes Extractor Agent (its body from the
+marker on, the closing questions the model writes after the goals aside), the corrections of the metadata the user
+made when confirming it, the engagement type, the Hub Master data, the system prompt of the agent (its instructions and
+agenda template) and the model deployment. When the same goals are sent again for the same hub (the user reruns the
+same briefing notes, or asks again for the agenda) the cached agenda is presented without calling the model. A request
+to regenerate the agenda bypasses the cache, and its result replaces the cached agenda.
+
+The entries are kept in memory, least recently used first out, and optionally in a directory shared by the instances
+of the app.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+# The words of the user that ask for a new agenda, instead of the cached one
+REGENERATE_PATTERN = re.compile(
+    r"\b(re-?generate|re-?create|redo|start over|(new|fresh|another|different) (version of the )?agenda)\b", re.IGNORECASE
+)
+# A negation before them in the same clause, e.g. 'no need to redo it'
+NEGATION_PATTERN = re.compile(r"\b(no|not|never|without|don'?t|do not|doesn'?t)\b[^.,;:!?]*$", re.IGNORECASE)
+
+
+GOALS_MARKER = "### Engagement Goals Confirmation Message ###"
+
+# A 'Field: value' line of the confirmation message, e.g. '**Date of the Engagement:** 15-Dec-2026'
+FIELD_PATTERN = re.compile(r"^[\s>*-]*\**\s*([A-Za-z][\w /&()'-]{1,40}?)\s*\**\s*:\s*\**\s*(\S.*)$", re.MULTILINE)
+
+
+# A closing remark of the confirmation message, e.g. 'Please confirm if these are correct.'
+REMARK_PATTERN = re.compile(
+    r"^(please|kindly|let me know|feel free|once you|if (this|these|everything|all)|reply|do you|can you|could you|would you)\b"
+)
+
+
+def canonical_text(text: str) -> str:
+    """The text without the Markdown emphasis, the case and the whitespace that do not change the agenda."""
+    text = re.sub(r"[*_`#]+", " ", text or "")
+    return " ".join(text.lower().split())
+
+
+def confirmation_fields(goals_message: str) -> dict:
+    """The 'Field: value' lines of the confirmation message, from its marker on, canonical."""
+    text = goals_message or ""
+    if GOALS_MARKER in text:
+        text = text[text.index(GOALS_MARKER) + len(GOALS_MARKER):]
+    return {canonical_text(label): canonical_text(value) for label, value in FIELD_PATTERN.findall(text)}
+
+
+def canonical_goals(goals_message: str) -> str:
+    """The body of the confirmation message from its marker on, canonical line by line. The closing questions and
+    remarks the model writes after the goals, and that differ from one run to the next, are left out."""
+    text = goals_message or ""
+    if GOALS_MARKER in text:
+        text = text[text.index(GOALS_MARKER) + len(GOALS_MARKER):]
+    lines = [line for line in (canonical_text(line) for line in text.splitlines()) if line]
+    while lines and (lines[-1].endswith("?") or REMARK_PATTERN.match(lines[-1])):
+        lines.pop()
+    return "\n".join(lines)
+
+
+def agenda_cache_key(
+    goals_message: str, engagement_type: str, hub_master_info: str, system_prompt: str, corrections: dict = None
+) -> str:
+    """The key of the agenda created from the confirmation message, for the engagement type and the Hub Master data of
+    the hub. corrections are the metadata the user corrected when confirming it, which the message does not show.
+
+    The system prompt of the agent carries the version of the instructions and of the agenda template.
+    """
+    parts = {
+        "goals": canonical_goals(goals_message),
+        "corrections": {field: canonical_text(str(value)) for field, value in (corrections or {}).items()},
+        "engagement_type": engagement_type,
+        "hub_master": hashlib.sha256((hub_master_info or "").encode("utf-8")).hexdigest(),
+        "prompt": hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest(),
+        "model": l_config.az_deployment_name,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def wants_regeneration(text: str) -> bool:
+    """Whether the message of the user asks for a new agenda, and not for no new agenda."""
+    for match in REGENERATE_PATTERN.finditer(text or ""):
+        if not NEGATION_PATTERN.search(text[max(0, match.start() - 40): match.start()]):
+            return True
+    return False
+
+
+class AgendaResultCache:
+    """Agendas keyed by agenda_cache_key, in memory and optionally on disk.
+
+    :param max_entries: The number of agendas kept in memory, least recently used first out.
+    :type max_entries: int
+    :param directory: The directory of the disk tier, none when empty. It is shared by the instances of the app.
+    :type directory: str
+    :param max_disk_entries: The number of agendas kept in the directory, oldest first out.
+    :type max_disk_entries: int
+    """
+
+    def __init__(self, max_entries: int = 256, directory: str = "", max_disk_entries: int = 2048):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self._agendas = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            agenda = self._agendas.get(key)
+            if agenda is not None:
+                self._agendas.move_to_end(key)
+                self.hits += 1
+                return agenda
+        agenda = self._read(key)
+        with self._lock:
+            if agenda is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, agenda)
+        return agenda
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            if key in self._agendas:
+                return True
+        return bool(self.directory) and os.path.exists(self._path(key))
+
+    def put(self, key: str, agenda: str):
+        with self._lock:
+            self._remember(key, agenda)
+        self._write(key, agenda)
+        logger.debug(f"Cached the agenda {key[:12]}, {len(agenda)} characters")
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def _remember(self, key: str, agenda: str):
+        self._agendas[key] = agenda
+        self._agendas.move_to_end(key)
+        if len(self._agendas) > self.max_entries:
+            self._agendas.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key: str) -> str:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)["agenda"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Unable to read the cached agenda {key[:12]}: {str(e)}")
+            return None
+
+    def _write(self, key: str, agenda: str):
+        if not self.directory:
+            return
+        try:
+            # Written to a temporary file first, so that another instance never reads a partial agenda
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"agenda": agenda}, f)
+            os.replace(temp_path, self._path(key))
+            self._prune()
+        except Exception as e:
+            logger.warning(f"Unable to write the cached agenda {key[:12]}: {str(e)}")
+
+    def _prune(self):
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith(".json")]
+        if len(entries) <= self.max_disk_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[: len(entries) - self.max_disk_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._agendas),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypasses": self.bypasses,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+            }
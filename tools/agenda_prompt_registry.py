@@ -0,0 +1,99 @@
+"""
+The system prompts of the Agenda Creator Agent, compiled once per engagement type and Hub Master data.
+
+The system prompt is sent in two parts. The first holds the instructions, the agenda template of the engagement type
+and the Hub Master data; it is the same, byte for byte, for all the conversations of a hub and engagement type, so
+that the prompt caching of the model service applies to it. The second holds what is specific to the conversation
+(the user name and the speakers matched to the goals), and is sent after it.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+from tools.agenda_selector import get_prompt_for_engagement_type
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+# The engagement types that have an agenda template, see tools/agenda_selector.py
+TEMPLATED_ENGAGEMENT_TYPES = ("BUSINESS_ENVISIONING", "SOLUTION_ENVISIONING", "RAPID_PROTOTYPE", "ADS")
+
+
+class AgendaPromptRegistry:
+    """Compiled system prompts, keyed by the engagement type and a digest of the Hub Master data.
+
+    :param instructions: The system prompt, with the {prompt_template} and {hub_master_info} placeholders.
+    :type instructions: str
+    :param max_entries: The number of compiled prompts kept, least recently used first out.
+    :type max_entries: int
+    """
+
+    def __init__(self, instructions: str, max_entries: int = 256):
+        self.instructions = instructions
+        self.max_entries = max_entries
+        self._prompts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(engagement_type: str, hub_master_info: str) -> tuple:
+        return engagement_type, hashlib.sha256((hub_master_info or "").encode("utf-8")).hexdigest()
+
+    def get(self, engagement_type: str, hub_master_info: str) -> str:
+        key = self._key(engagement_type, hub_master_info)
+        with self._lock:
+            prompt = self._prompts.get(key)
+            if prompt is not None:
+                self._prompts.move_to_end(key)
+                self.hits += 1
+                return prompt
+            self.misses += 1
+        return self._compile(key, engagement_type, hub_master_info)
+
+    def _compile(self, key: tuple, engagement_type: str, hub_master_info: str) -> str:
+        prompt = self.instructions.format(
+            prompt_template=get_prompt_for_engagement_type(engagement_type),
+            hub_master_info=hub_master_info,
+        )
+        with self._lock:
+            self._prompts[key] = prompt
+            if len(self._prompts) > self.max_entries:
+                self._prompts.popitem(last=False)
+        logger.debug(f"Compiled the agenda prompt for {engagement_type}, {len(prompt)} characters")
+        return prompt
+
+    def precompile(self, hub_master_infos: list) -> int:
+        """Compile the prompts of all the engagement types for the Hub Master data. Returns the number compiled."""
+        compiled = 0
+        for hub_master_info in hub_master_infos:
+            for engagement_type in TEMPLATED_ENGAGEMENT_TYPES:
+                key = self._key(engagement_type, hub_master_info)
+                with self._lock:
+                    if key in self._prompts:
+                        continue
+                self._compile(key, engagement_type, hub_master_info)
+                compiled += 1
+        return compiled
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._prompts),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,156 @@
+import copy
+import io
+import logging
+import re
+
+from docx import Document
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+# The section of the message of the Agenda Creator Agent that holds the agenda
+AGENDA_HEADER = "### Innovation Hub Engagement Agenda ###"
+
+# Layout of the table in 'Innovation Hub Agenda Format.docx'
+ENGAGEMENT_DETAILS_ROW = 0  # merged across the width of the table
+FIRST_AGENDA_ROW = 3  # after the merged 'Agenda' row and the row with the column names
+AGENDA_COLUMNS = ("time", "speaker", "topic", "description")
+
+# The metadata lines that precede the agenda table in the markdown, and the label used for them in the document
+METADATA_FIELDS = {
+    "customer_name": ("Customer Name", re.compile(r"^customer(?: name)?$")),
+    "date": ("Date of the Engagement", re.compile(r"^date(?: of (?:the )?engagement)?$")),
+    "location": ("Location", re.compile(r"^(?:location|venue|mode of delivery)$")),
+    "engagement_type": ("Engagement Type", re.compile(r"^(?:engagement type|type of engagement)$")),
+}
+
+
+def parse_agenda_markdown(markdown: str) -> dict:
+    """
+    Parse the agenda created by the Agenda Creator Agent: the metadata lines (Customer Name, Date, Location,
+    Engagement Type) and the markdown table with the Time, Speaker, Topic and Description of each agenda item.
+    Only the first table after the agenda header is the agenda, the other tables of the message are ignored.
+    """
+    metadata = {}
+    header = None
+    rows = []
+    in_agenda = AGENDA_HEADER not in markdown
+    for raw_line in markdown.splitlines():
+        line = raw_line.strip()
+        if AGENDA_HEADER in line:
+            in_agenda = True
+            continue
+        if line.startswith("|"):
+            if not in_agenda:
+                continue
+            cells = [_clean_markdown(c) for c in line.strip("|").split("|")]
+            if all(re.fullmatch(r":?-{2,}:?", c.replace(" ", "")) for c in cells if c):
+                continue  # the separator row under the header
+            if header is None:
+                header = [c.lower() for c in cells]
+                continue
+            rows.append(_map_columns(header, cells))
+            continue
+        if header is not None:
+            break  # the end of the agenda table
+
+        match = re.match(r"^[\s>*#-]*([A-Za-z ]+?)\s*\**\s*:\s*\**\s*(.+)$", line)
+        if match:
+            label = match.group(1).strip().lower()
+            for field, (_, pattern) in METADATA_FIELDS.items():
+                if field not in metadata and pattern.match(label):
+                    metadata[field] = _clean_markdown(match.group(2))
+
+    if not rows:
+        raise ValueError("No agenda table was found in the markdown content.")
+    return {"metadata": metadata, "rows": rows}
+
+
+def _map_columns(header: list, cells: list) -> dict:
+    row = {}
+    for position, column in enumerate(AGENDA_COLUMNS):
+        index = next((i for i, name in enumerate(header) if name.startswith(column)), position)
+        row[column] = cells[index] if index < len(cells) else ""
+    return row
+
+
+def _clean_markdown(text: str) -> str:
+    text = re.sub(r"<br\s*/?>", "\n", text, flags=re.IGNORECASE)
+    text = text.replace("\\t", "\n").replace("\t", "\n").replace("&nbsp;", " ")
+    text = re.sub(r"\*\*(.+?)\*\*", r"\1", text)
+    return "\n".join(part.strip() for part in text.split("\n")).strip()
+
+
+def document_file_name(metadata: dict) -> str:
+    """The file name in the format Agenda-$EngagementType-CustomerName.docx"""
+    parts = ["Agenda", metadata.get("engagement_type", ""), metadata.get("customer_name", "")]
+    parts = [re.sub(r"[^A-Za-z0-9_]+", "_", p).strip("_") for p in parts]
+    return "-".join(p for p in parts if p) + ".docx"
+
+
+def render_agenda_document(markdown: str, template_path: str = None) -> tuple:
+    """
+    Fill the agenda table in the Word document template with the agenda in markdown format.
+
+    Returns:
+        tuple: The file name, and the bytes of the .docx document.
+    """
+    agenda = parse_agenda_markdown(markdown)
+    document = Document(template_path or l_config.agenda_template_path)
+    table = document.tables[0]
+
+    details_cell = table.rows[ENGAGEMENT_DETAILS_ROW].cells[0]
+    lines = [
+        f"{label}: {agenda['metadata'][field]}"
+        for field, (label, _) in METADATA_FIELDS.items()
+        if agenda["metadata"].get(field)
+    ]
+    _set_cell_text(details_cell, "\n".join(["Engagement Details:"] + lines))
+
+    row_template = copy.deepcopy(table.rows[FIRST_AGENDA_ROW]._tr)
+    for index, item in enumerate(agenda["rows"]):
+        if index > 0:
+            table._tbl.append(copy.deepcopy(row_template))
+        cells = table.rows[FIRST_AGENDA_ROW + index].cells
+        for cell, column in zip(cells, AGENDA_COLUMNS):
+            _set_cell_text(cell, item[column])
+
+    output = io.BytesIO()
+    document.save(output)
+    file_name = document_file_name(agenda["metadata"])
+    logger.debug(f"Rendered the agenda document {file_name} with {len(agenda['rows'])} agenda items")
+    return file_name, output.getvalue()
+
+
+def _set_cell_text(cell, text: str):
+    """Replace the text of the cell with one paragraph per line, keeping the formatting of the first paragraph."""
+    paragraphs = cell.paragraphs
+    first = paragraphs[0]
+    for paragraph in paragraphs[1:]:
+        paragraph._p.getparent().remove(paragraph._p)
+    run_properties = first.runs[0]._r.rPr if first.runs else None
+    for run in list(first.runs):
+        run._r.getparent().remove(run._r)
+
+    paragraph = first
+    for index, line in enumerate(text.split("\n")):
+        if index > 0:
+            new_p = copy.deepcopy(first._p)
+            for r in new_p.findall("{http://schemas.openxmlformats.org/wordprocessingml/2006/main}r"):
+                new_p.remove(r)
+            paragraph._p.addnext(new_p)
+            paragraph = type(first)(new_p, first._parent)
+        run = paragraph.add_run(line)
+        if run_properties is not None:
+            run._r.insert(0, copy.deepcopy(run_properties))
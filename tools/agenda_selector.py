@@ -53,7 +53,7 @@ prompt_ads = """
         - **If no matching speaker is found, mark as "TBD" or ask the user.**
 
         ### **Step 2: Prioritized Speaker Selection**
-        - First, **check for an exact keyword match** in the ##SpeakerMappingTable.
+        - First, use the speaker matched to the goal of the topic under ##MatchedSpeakers, or the speaker returned by the `assign_speakers` tool for the topic.
         - If no **exact** match, use the **category-based mapping**:
             - **Industry topics** → Assign **Industry Advisors**
             - **Technical deep dives** → Assign **Technical Architects**
@@ -188,7 +188,7 @@ prompt_rapid_prototype = """
         - **If no matching speaker is found, mark as "TBD" or ask the user.**
 
         ### **Step 2: Prioritized Speaker Selection**
-        - First, **check for an exact keyword match** in the ##SpeakerMappingTable.
+        - First, use the speaker matched to the goal of the topic under ##MatchedSpeakers, or the speaker returned by the `assign_speakers` tool for the topic.
         - If no **exact** match, use the **category-based mapping**:
             - **Industry topics** → Assign **Industry Advisors**
             - **Technical deep dives** → Assign **Technical Architects**
@@ -270,7 +270,7 @@ prompt_business_envisioning = """
             - **If no matching speaker is found, mark as "TBD" or ask the user.**
 
             ### **Step 2: Prioritized Speaker Selection**
-            - First, **check for an exact keyword match** in the ##SpeakerMappingTable.
+            - First, use the speaker matched to the goal of the topic under ##MatchedSpeakers, or the speaker returned by the `assign_speakers` tool for the topic.
             - If no **exact** match, use the **category-based mapping**:
                 - **Industry topics** → Assign **Industry Advisors**
                 - **Technical deep dives** → Assign **Technical Architects**
@@ -369,7 +369,7 @@ prompt_solution_envisioning = """
         - **If no matching speaker is found, mark as "TBD" or ask the user.**
 
         ### **Step 2: Prioritized Speaker Selection**
-        - First, **check for an exact keyword match** in the ##SpeakerMappingTable.
+        - First, use the speaker matched to the goal of the topic under ##MatchedSpeakers, or the speaker returned by the `assign_speakers` tool for the topic.
         - If no **exact** match, use the **category-based mapping**:
             - **Industry topics** → Assign **Industry Advisors**
             - **Technical deep dives** → Assign **Technical Architects**
@@ -406,7 +406,7 @@ prompt_solution_envisioning = """
         - Confirm that each topic's duration is within the allowed limits.
         - Check that the mandatory first and last topics are correctly included.
         - Ensure that the topic sequencing follows the required order.
-        - Verify that speaker assignments strictly follow the normalized keyword matching against the ##SpeakerMappingTable, using only names from this table.
+        - Verify that speaker assignments follow the ##MatchedSpeakers or the `assign_speakers` tool, using only names from the ##SpeakerMappingTable.
         - Ensure that the same Speaker name is not assigned to multiple topics in the same session, unless explicitly stated in the input.
         - Confirm that session timings (start time, break intervals, and end time) are correctly applied.
     - If any rule is not met, adjust the output accordingly before delivering the final Agenda.
@@ -0,0 +1,226 @@
+"""
+The agenda of the engagement goals proposed by the Notes Extractor Agent, created in the background while the user
+reviews them.
+
+When the '### Engagement Goals Confirmation Message ###' is posted, the Agenda Creator Agent is run speculatively on
+the proposed goals, on a worker thread. When the user confirms the goals unchanged and the agenda is requested, the
+speculative agenda is presented as soon as it is ready, instead of being created then. A speculation is only used when
+its key, the agenda_cache_key of the proposed goals, is the key of the confirmed goals: when the user edits the goals,
+a new proposal replaces it, and a speculation that no longer matches (e.g. the user corrected the date when confirming)
+is discarded. A speculation still in progress is cancelled at its next model call.
+
+The outcome of the speculations (the hit rate) and the tokens spent on the discarded ones (the wasted tokens) are
+exposed at /api/stats.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+
+class _Speculation:
+    def __init__(self, key: str):
+        self.key = key
+        self.started_at = time.monotonic()
+        self.cancelled = threading.Event()
+        self.future = None
+        self.duration_ms = None
+
+
+class AgendaSpeculator:
+    """The speculative agendas, one per graph thread, created on a pool of worker threads.
+
+    The generate callable given to start creates the agenda: it is called with a threading.Event that is set when the
+    speculation is cancelled, and returns the agenda (None when it could not be created) and the tokens it used.
+
+    :param max_workers: The speculations created at the same time; the others wait for a worker.
+    :type max_workers: int
+    :param wait_seconds: How long a confirmed request waits for the speculation still in progress.
+    :type wait_seconds: float
+    :param max_age_seconds: The age after which a speculation that was not claimed is discarded.
+    :type max_age_seconds: float
+    :param max_entries: The graph threads with a speculation, oldest first out.
+    :type max_entries: int
+    """
+
+    def __init__(self, max_workers: int, wait_seconds: float, max_age_seconds: float, max_entries: int = 256):
+        self.wait_seconds = wait_seconds
+        self.max_age_seconds = max_age_seconds
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agenda-speculation")
+        self._speculations = OrderedDict()  # graph thread id -> _Speculation, oldest first
+        # Reentrant: the callback of a speculation discarded as it completes runs with the lock held
+        self._lock = threading.RLock()
+        self._closed = False
+        self.started = 0
+        self.hits = 0
+        self.discarded = {}  # reason -> count
+        self.failed = 0
+        self.tokens = 0
+        self.wasted_tokens = 0
+        self.saved_ms = 0.0
+        self.waited_ms = 0.0
+
+    def start(self, thread_id: str, key: str, generate) -> bool:
+        """Start the speculation of the graph thread, unless one with the same key is already there.
+
+        The previous speculation of the thread, for other goals, is discarded.
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self._expire()
+            previous = self._speculations.get(thread_id)
+            if previous is not None and previous.key == key and not previous.cancelled.is_set():
+                return False
+            if previous is not None:
+                del self._speculations[thread_id]
+                self._discard(previous, "superseded")
+            speculation = _Speculation(key)
+            speculation.future = self._executor.submit(self._run, speculation, generate)
+            self._speculations[thread_id] = speculation
+            self.started += 1
+            while len(self._speculations) > self.max_entries:
+                self._discard(self._speculations.popitem(last=False)[1], "evicted")
+        logger.debug(f"Speculating the agenda {key[:12]} of the graph thread {thread_id}")
+        return True
+
+    def claim(self, thread_id: str, key: str) -> str:
+        """The agenda speculated for the confirmed goals of the graph thread, waiting for it when it is in progress.
+
+        None when there is no speculation for these goals, or it failed; the agenda is then created as usual.
+        """
+        with self._lock:
+            speculation = self._speculations.pop(thread_id, None)
+            if speculation is None:
+                return None
+            if speculation.key != key:
+                self._discard(speculation, "goals_changed")
+                return None
+        start = time.monotonic()
+        try:
+            agenda, tokens = speculation.future.result(timeout=self.wait_seconds)
+        except FutureTimeoutError:
+            with self._lock:
+                self._discard(speculation, "timed_out")
+            return None
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.warning(f"The speculative agenda of the graph thread {thread_id} failed: {str(e)}")
+            return None
+        waited_ms = (time.monotonic() - start) * 1000
+        with self._lock:
+            if agenda is None:
+                self.failed += 1
+                self.tokens += tokens
+                self.wasted_tokens += tokens
+                return None
+            self.hits += 1
+            self.tokens += tokens
+            self.waited_ms += waited_ms
+            # The part of the creation of the agenda the user did not wait for
+            self.saved_ms += max(0.0, speculation.duration_ms - waited_ms)
+        self._log_outcome(thread_id, "hit", tokens, waited_ms)
+        return agenda
+
+    @staticmethod
+    def _run(speculation: _Speculation, generate) -> tuple:
+        start = time.monotonic()
+        try:
+            return generate(speculation.cancelled)
+        finally:
+            speculation.duration_ms = (time.monotonic() - start) * 1000
+
+    def discard(self, thread_id: str, reason: str):
+        """Discard the speculation of the graph thread, e.g. when the user asks for a new agenda."""
+        with self._lock:
+            speculation = self._speculations.pop(thread_id, None)
+            if speculation is not None:
+                self._discard(speculation, reason)
+
+    def _discard(self, speculation: _Speculation, reason: str):
+        # Called with the lock held. A speculation in progress stops at its next model call, its tokens are counted
+        # as wasted when it does
+        self.discarded[reason] = self.discarded.get(reason, 0) + 1
+        speculation.cancelled.set()
+        if speculation.future.cancel():
+            return
+        speculation.future.add_done_callback(lambda future: self._waste(future, reason))
+
+    def _waste(self, future, reason: str):
+        if future.cancelled() or future.exception() is not None:
+            return
+        _, tokens = future.result()
+        with self._lock:
+            self.tokens += tokens
+            self.wasted_tokens += tokens
+        self._log_outcome(None, reason, tokens, None)
+
+    def _expire(self):
+        # Called with the lock held
+        now = time.monotonic()
+        while self._speculations:
+            thread_id, speculation = next(iter(self._speculations.items()))
+            if now - speculation.started_at <= self.max_age_seconds:
+                return
+            del self._speculations[thread_id]
+            self._discard(speculation, "expired")
+
+    def _log_outcome(self, thread_id: str, outcome: str, tokens: int, waited_ms: float):
+        logger.info(
+            f"Speculative agenda {outcome}, {tokens} tokens",
+            extra={
+                "custom_dimensions": {
+                    "metric": "agenda_speculation",
+                    "graph_thread_id": thread_id,
+                    "speculation_outcome": outcome,
+                    "speculation_tokens": tokens,
+                    "speculation_waited_ms": round(waited_ms) if waited_ms is not None else None,
+                }
+            },
+        )
+
+    def close(self):
+        """Cancel the speculations, and stop the worker threads without waiting for the ones in progress."""
+        with self._lock:
+            self._closed = True
+            for speculation in self._speculations.values():
+                speculation.cancelled.set()
+                speculation.future.cancel()
+            self._speculations.clear()
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            discarded = sum(self.discarded.values())
+            outcomes = self.hits + discarded + self.failed
+            return {
+                "pending": len(self._speculations),
+                "started": self.started,
+                "hits": self.hits,
+                "discarded": dict(self.discarded),
+                "failed": self.failed,
+                "hit_rate": round(self.hits / outcomes, 3) if outcomes else None,
+                "tokens": self.tokens,
+                "wasted_tokens": self.wasted_tokens,
+                "saved_ms": round(self.saved_ms),
+                "waited_ms": round(self.waited_ms),
+            }
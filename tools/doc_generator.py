@@ -1,25 +1,30 @@
 import os
 import traceback
 from langchain_core.tools import tool
-from openai import AzureOpenAI
 from config import DefaultConfig
 from langchain_core.runnables import RunnableConfig
+import threading
 import time
 import json
 from azure.storage.blob import BlobServiceClient
 import logging
 from opencensus.ext.azure.log_exporter import AzureLogHandler
-from azure.identity import DefaultAzureCredential
 from azure.storage.blob import (
     generate_blob_sas,
     BlobSasPermissions,
 )
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from azure.mgmt.storage import StorageManagementClient
-from azure.mgmt.storage.models import StorageAccountUpdateParameters
 import datetime
 from config import DefaultConfig
-from util.az_blob_account_access import set_blob_account_public_access
+from tools.agenda_renderer import render_agenda_document
+from util.az_clients import get_blob_service_client, get_openai_client
+from util.az_blob_account_access import (
+    set_blob_account_public_access,
+    invalidate_blob_account_access,
+    is_access_error,
+    is_retryable_storage_error,
+)
+from util.retry import retry_call, storage_retry_policy
+from util.assistant_reconciler import assistant_reconciler
 
 l_config = DefaultConfig()
 
@@ -35,6 +40,9 @@ logger.setLevel(log_level)
 # logger.debug(f"Logging level set to {log_level_str}")
 # logger.setLevel(logging.DEBUG)
 
+# The upload of the agenda document to the blob storage
+_upload_policy = storage_retry_policy("agenda_document_upload", retry_if=is_retryable_storage_error)
+
 
 user_prompt_prefix = """
 Use the document format 'Innovation Hub Agenda Format.docx' available with you. Follow the instructions below to add the markdown content under [Agenda for Innovation Hub Session] below into the document. 
@@ -61,6 +69,31 @@ def generate_agenda_document(query: str, config: RunnableConfig) -> str:
     """
     print("preparing to generate the agenda Word document .........")
 
+    if l_config.agenda_renderer == "local":
+        try:
+            l_file_name, doc_data_bytes = render_agenda_document(query)
+        except Exception as e:
+            logger.error(f"Word Document Generator Agent: Local rendering of the agenda failed: {str(e)}")
+            if not l_config.agenda_renderer_fallback:
+                return "The Word document could not be created from the agenda. Please check that the agenda is in the Markdown table format and try again"
+            logger.debug("Word Document Generator Agent: Falling back to the Assistants API to generate the document")
+        else:
+            try:
+                return upload_agenda_document(doc_data_bytes, l_file_name)
+            except Exception as e:
+                logger.error(f"Word Document Generator Agent: Error occurred: {str(e)}")
+                logger.error(
+                    f"Word Document Generator Agent: Error details\n {traceback.format_exc()}"
+                )
+                return f"An error occurred when generating the Word document. Please try again later"
+    return generate_agenda_document_with_assistant(query, config)
+
+
+def generate_agenda_document_with_assistant(query: str, config: RunnableConfig) -> str:
+    """
+    Have the code interpreter of the Assistants API fill the Word document template with the markdown agenda,
+    and upload the document it creates to the blob storage.
+    """
     response = None
     try:
         configuration = config.get("configurable", {})
@@ -72,19 +105,11 @@ def generate_agenda_document(query: str, config: RunnableConfig) -> str:
             )
         response = ""
 
-        # Initialize Azure OpenAI Service client with Entra ID authentication
-        token_provider = get_bearer_token_provider(
-            DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
-        )
+        # The Azure OpenAI Service client (Entra ID authentication) shared across the process
+        client = get_openai_client()
 
-        client = AzureOpenAI(
-            azure_endpoint=l_config.az_openai_endpoint,
-            azure_ad_token_provider=token_provider,
-            api_version=l_config.az_openai_api_version,
-        )
-
-        # Get the assistant and thread instance for the session
-        client.beta.assistants.retrieve(assistant_id=l_config.az_assistant_id)
+        # The assistant is reconciled with its definition once per process; then get the thread instance for the session
+        assistant_reconciler.reconcile()
         l_thread = client.beta.threads.retrieve(thread_id=l_thread_id)
         logger.debug(
             f"Debug - Word Document Generator Agent retrieved successfully, along with the session thread of the user {l_thread.id}"
@@ -100,18 +125,10 @@ def generate_agenda_document(query: str, config: RunnableConfig) -> str:
             f"Word Document Generator Agent: Created message bearing Message id: {message.id}"
         )
 
-        # create a run
-        run = client.beta.threads.runs.create(
-            thread_id=l_thread.id,
-            assistant_id=l_config.az_assistant_id,
-            temperature=0.3,
-        )
-        logger.debug("Word Document Generator Agent: called thread run ...")
-
-        # wait for the run to complete
-        run = wait_for_run(run, l_thread.id, client)
+        # create a run, and wait for it to complete
+        run = execute_run(client, l_thread.id)
 
-        if run.status == "failed":
+        if run.status != "completed":
             logger.debug(
                 "Word Document Generator Agent: run has failed, extracting results ..."
             )
@@ -159,22 +176,7 @@ def generate_agenda_document(query: str, config: RunnableConfig) -> str:
         doc_data = client.files.content(l_file_id)
         doc_data_bytes = doc_data.read()
 
-        blob_account_name = l_config.az_storage_account_name
-        az_blob_storage_endpoint = f"https://{blob_account_name}.blob.core.windows.net/"
-        blob_container_name = l_config.az_storage_container_name
-        az_subscription_id = l_config.az_subscription_id
-        az_storage_rg_name = l_config.az_storage_rg_name
-
-        # Upload the document to Azure Blob Storage using managed identity
-        response = upload_document_to_blob_storage_using_mi(
-            doc_data_bytes,
-            az_blob_storage_endpoint,
-            blob_account_name,
-            blob_container_name,
-            l_file_name,
-            az_subscription_id,
-            az_storage_rg_name,
-        )
+        response = upload_agenda_document(doc_data_bytes, l_file_name)
     except Exception as e:
         logger.error(f"Word Document Generator Agent: Error occurred: {str(e)}")
         logger.error(
@@ -184,16 +186,133 @@ def generate_agenda_document(query: str, config: RunnableConfig) -> str:
     return response
 
 
-# function returns the run when status is no longer queued or in_progress
-def wait_for_run(run, thread_id, client):
-    while run.status == "queued" or run.status == "in_progress":
+def upload_agenda_document(doc_data_bytes: bytes, file_name: str) -> str:
+    blob_account_name = l_config.az_storage_account_name
+    az_blob_storage_endpoint = f"https://{blob_account_name}.blob.core.windows.net/"
+    blob_container_name = l_config.az_storage_container_name
+    az_subscription_id = l_config.az_subscription_id
+    az_storage_rg_name = l_config.az_storage_rg_name
+
+    # Upload the document to Azure Blob Storage using managed identity
+    return upload_document_to_blob_storage_using_mi(
+        doc_data_bytes,
+        az_blob_storage_endpoint,
+        blob_account_name,
+        blob_container_name,
+        file_name,
+        az_subscription_id,
+        az_storage_rg_name,
+    )
+
+
+def execute_run(client, thread_id):
+    """
+    Run the Document Generator assistant on the thread, and return the run once it has finished.
+    The run events are consumed as they are streamed; if streaming is disabled or the stream breaks,
+    the run is polled instead. Either way, the run is abandoned after assistants_run_deadline_seconds, also when the
+    stream stops sending events.
+    """
+    deadline = time.monotonic() + l_config.assistants_run_deadline_seconds
+    start_time = time.monotonic()
+    first_token_time = None
+    run_id = None
+
+    if l_config.assistants_run_streaming:
+        try:
+            with client.beta.threads.runs.stream(
+                thread_id=thread_id,
+                assistant_id=l_config.az_assistant_id,
+                temperature=0.3,
+            ) as stream:
+                logger.debug("Word Document Generator Agent: streaming the thread run ...")
+                # The deadline is checked as the events arrive; a stream that goes silent is closed by the watchdog at
+                # the deadline, and the run is then polled for and cancelled
+                watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), stream.close)
+                watchdog.daemon = True
+                watchdog.start()
+                try:
+                    for event in stream:
+                        if event.event == "thread.run.created":
+                            run_id = event.data.id
+                        elif first_token_time is None and event.event in (
+                            "thread.message.delta",
+                            "thread.run.step.delta",
+                        ):
+                            first_token_time = time.monotonic()
+                        if time.monotonic() > deadline:
+                            break
+                    else:
+                        if time.monotonic() <= deadline:
+                            run = stream.get_final_run()
+                            _log_run_timings("stream", run, start_time, first_token_time)
+                            return run
+                finally:
+                    watchdog.cancel()
+                logger.error("Word Document Generator Agent: the thread run exceeded its deadline")
+        except Exception as e:
+            logger.warning(
+                f"Word Document Generator Agent: streaming the thread run failed, polling for it instead: {str(e)}"
+            )
+
+    if run_id is None and l_config.assistants_run_streaming and time.monotonic() > deadline:
+        # The stream went silent before it reported its run: the run it started, if any, is the latest of the thread
+        latest = client.beta.threads.runs.list(thread_id=thread_id, limit=1).data
+        if not latest:
+            raise TimeoutError("The thread run did not start before its deadline")
+        run = latest[0]
+    elif run_id is None:
+        run = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=l_config.az_assistant_id,
+            temperature=0.3,
+        )
+        logger.debug("Word Document Generator Agent: called thread run ...")
+    else:
+        # the run was started by the stream, keep waiting on it rather than starting another one
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+
+    run = wait_for_run(run, thread_id, client, deadline=deadline)
+    _log_run_timings("poll", run, start_time, first_token_time)
+    return run
+
+
+# function returns the run when status is no longer queued or in_progress, or cancels it past the deadline
+def wait_for_run(run, thread_id, client, deadline=None):
+    # Poll quickly at first, since short runs complete in a second or two, then back off
+    interval = 0.25
+    while run.status in ("queued", "in_progress", "cancelling"):
+        if deadline is not None and time.monotonic() > deadline and run.status != "cancelling":
+            logger.error(f"Run {run.id} did not complete before its deadline, cancelling it")
+            try:
+                run = client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+            except Exception as e:
+                logger.warning(f"Unable to cancel the run {run.id}: {str(e)}")
+            break
+        time.sleep(interval)
+        interval = min(interval * 2, 4.0)
         run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
         # print("Run status:", run.status)
-        time.sleep(0.5)
     logger.debug(f"Run status: {run.status}")
     return run
 
 
+def _log_run_timings(mode, run, start_time, first_token_time):
+    total_ms = (time.monotonic() - start_time) * 1000
+    ttft_ms = (first_token_time - start_time) * 1000 if first_token_time else None
+    logger.info(
+        f"Word Document Generator Agent: run {run.status} in {total_ms:.0f} ms, time to first token: "
+        f"{f'{ttft_ms:.0f} ms' if ttft_ms is not None else 'n/a'}",
+        extra={
+            "custom_dimensions": {
+                "run_mode": mode,
+                "run_status": run.status,
+                "run_total_ms": round(total_ms),
+                "run_ttft_ms": round(ttft_ms) if ttft_ms is not None else None,
+            }
+        },
+    )
+
+
 def upload_document_to_blob_storage_using_mi(
     doc_data_bytes,
     blob_account_url,
@@ -219,51 +338,37 @@ def upload_document_to_blob_storage_using_mi(
 
     sas_token = None
 
-    # Add retry logic for the upload operation
-    max_retries = 3
-    retry_delay = 5  # seconds
-    success = False
-    blob_service_client = None
-    container_client = None
-
-    # When the public network access is set to enabled, from disabled, through this program, the upload of document when done immediately fails.
-    # So, we need to add a retry logic to upload the document to blob storage, including a delay of 5 seconds between each retry.
-    for attempt in range(max_retries):
-        try:
-            blob_service_client = BlobServiceClient(
-                account_url=blob_account_url, credential=DefaultAzureCredential()
-            )
+    def upload():
+        blob_service_client = get_blob_service_client(blob_account_url)
 
-            # Create a container client
-            container_client = blob_service_client.get_container_client(
-                blob_container_name
-            )
-            logger.debug(f"Upload attempt {attempt+1} of {max_retries}")
-            container_client.upload_blob(
-                name=file_name, data=doc_data_bytes, overwrite=True
-            )
-            success = True
-            logger.debug(
-                f"Word Document Generator Agent: Uploaded document '{file_name}' to blob container '{blob_container_name}' successfully."
-            )
-            break  # Exit the retry loop if upload succeeds
-        except Exception as e:
-            logger.warning(
-                f"Word Document Generator Agent: Upload attempt {attempt+1} failed: {str(e)}"
+        # Create a container client
+        container_client = blob_service_client.get_container_client(
+            blob_container_name
+        )
+        container_client.upload_blob(
+            name=file_name, data=doc_data_bytes, overwrite=True
+        )
+        logger.debug(
+            f"Word Document Generator Agent: Uploaded document '{file_name}' to blob container '{blob_container_name}' successfully."
+        )
+        return blob_service_client, container_client
+
+    def restore_access(error: Exception):
+        if is_access_error(error):
+            # The cached network access state is stale; have it checked (and restored) before the next attempt
+            invalidate_blob_account_access(blob_account_name)
+            set_blob_account_public_access(
+                blob_account_name=blob_account_name,
+                az_subscription_id=az_subscription_id,
+                az_storage_rg_name=az_storage_rg_name,
             )
-            if attempt < max_retries - 1:
-                logger.info(
-                    f"Word Document Generator Agent: Waiting {retry_delay} seconds before retry..."
-                )
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                logger.error(
-                    f"Word Document Generator Agent: All {max_retries} upload attempts failed"
-                )
-                raise  # Re-raise the exception after all retries fail
 
-    if not success:
+    # When the public network access is set to enabled, from disabled, through this program, the upload of document when done immediately fails.
+    # So the upload is retried, with a jittered exponential backoff, until the deadline of the upload.
+    try:
+        blob_service_client, container_client = retry_call(_upload_policy, upload, on_retry=restore_access)
+    except Exception as e:
+        logger.error(f"Word Document Generator Agent: The upload of the document failed: {str(e)}")
         response = f"Word Document Generator Agent: The Word document with the details of the Agenda has been created. However, there was an error while uploading the document to the blob storage. Shall I try once again?"
         return response
 
@@ -1,15 +1,21 @@
-from azure.identity import DefaultAzureCredential
 from config import DefaultConfig
-from azure.mgmt.storage import StorageManagementClient
-from azure.mgmt.storage.models import StorageAccountUpdateParameters
-from azure.storage.blob import BlobServiceClient
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotModifiedError
 import logging
 from opencensus.ext.azure.log_exporter import AzureLogHandler
+import threading
 import time
 import traceback
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
-from util.az_blob_account_access import set_blob_account_public_access
+from util.az_clients import get_blob_service_client
+from util.az_blob_account_access import (
+    set_blob_account_public_access,
+    invalidate_blob_account_access,
+    is_access_error,
+    is_retryable_storage_error,
+)
+from util.retry import storage_retry_policy
 
 l_config = DefaultConfig()
 logger = logging.getLogger(__name__)
@@ -25,6 +31,68 @@ logger.setLevel(log_level)
 # logger.setLevel(logging.DEBUG)
 
 
+class HubMasterCache:
+    """In-process cache of the Hub Master data documents, keyed by the normalized city name.
+
+    An entry is served as is until the TTL expires. It is then revalidated against the blob with its ETag
+    (If-None-Match), so the document is only downloaded again when it has changed.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # normalized city -> {"content", "etag", "validated_at"}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def lock_for(self, city: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(city, threading.Lock())
+
+    def get(self, city: str) -> dict:
+        return self._entries.get(city)
+
+    def is_fresh(self, city: str) -> bool:
+        entry = self._entries.get(city)
+        return entry is not None and time.monotonic() - entry["validated_at"] <= self.ttl_seconds
+
+    def store(self, city: str, content: str, etag: str):
+        self._entries[city] = {
+            "content": content,
+            "etag": etag,
+            "validated_at": time.monotonic(),
+        }
+
+    def mark_validated(self, city: str):
+        self._entries[city]["validated_at"] = time.monotonic()
+
+    def contents(self) -> list:
+        """The Hub Master data documents in the cache."""
+        return [entry["content"] for entry in list(self._entries.values())]
+
+
+hub_master_cache = HubMasterCache(l_config.hub_master_cache_ttl_seconds)
+_read_policy = storage_retry_policy("hub_master_read", retry_if=is_retryable_storage_error)
+_container_client = None
+
+
+def normalize_city(cityname: str) -> str:
+    # remove spaces and special characters from the city name
+    return ("".join(e for e in cityname if e.isalnum())).lower()
+
+
+def _get_container_client():
+    global _container_client
+    if _container_client is None:
+        # The BlobServiceClient using the managed identity credential is shared across the process
+        blob_service_client = get_blob_service_client(
+            f"https://{l_config.az_storage_account_name}.blob.core.windows.net/"
+        )
+        _container_client = blob_service_client.get_container_client(
+            l_config.az_blob_container_name_hubmaster
+        )
+    return _container_client
+
+
 @tool
 def get_hub_masterdata(config: RunnableConfig) -> str:
     """
@@ -34,86 +102,108 @@ def get_hub_masterdata(config: RunnableConfig) -> str:
     cityname = configuration.get("hub_location", None)
     if not cityname:
         raise ValueError("No Hub Location indicated.")
+    return read_hub_masterdata(cityname)
+
+
+def read_hub_masterdata(cityname: str) -> str:
+    """
+    Get the hub master data for the city, from the cache when it is fresh, else from the blob storage.
+    """
+    city = normalize_city(cityname)
+    if hub_master_cache.is_fresh(city):
+        return hub_master_cache.get(city)["content"]
+
+    # Only one caller per city reads the blob; the others pick up its result from the cache
+    with hub_master_cache.lock_for(city):
+        if hub_master_cache.is_fresh(city):
+            return hub_master_cache.get(city)["content"]
+        return _fetch_hub_masterdata(city)
+
+
+def _fetch_hub_masterdata(cityname: str) -> str:
     blob_account_name = l_config.az_storage_account_name
-    blob_account_url = f"https://{blob_account_name}.blob.core.windows.net/"
     blob_container_name = l_config.az_blob_container_name_hubmaster
     az_subscription_id = l_config.az_subscription_id
     az_storage_rg_name = l_config.az_storage_rg_name
 
-    # remove spaces and special characters from the city name
-    cityname = ("".join(e for e in cityname if e.isalnum())).lower()
-    
     file_name = f"hub-{cityname}.md"
-    response = None
-    flag = False
-
+    cached = hub_master_cache.get(cityname)
     flag = set_blob_account_public_access(
             l_config.az_storage_account_name,
             l_config.az_subscription_id,
             l_config.az_storage_rg_name,
         )
     if not flag:
+        if cached:
+            logger.warning(f"Storage not accessible, serving the cached Hub Master data for '{cityname}'")
+            return cached["content"]
         raise Exception("Issue accessing Speaker information for your Hub Location. Please try again later or contact the TAB administrator.")
 
     logger.debug(
         "Hub Master Template Retrieval - Proceeding now to read the Hub Master data from blob storage using managed identity..."
     )
 
-    # Add retry logic for the upload operation
-    max_retries = 3
-    retry_delay = 5  # seconds
-    success = False
-    blob_service_client = None
-    container_client = None
-
-    # When the public network access is updated to enabled, from a 'disabled' state, from the code here, the blob access, when tried soon after, fails.
-    # So, we need to add a retry logic to access the document in the blob storage, including a delay of 5 seconds between each retry.
-    for attempt in range(max_retries):
+    def read_blob():
+        # The blob is addressed directly, instead of listing the container
+        blob_client = _get_container_client().get_blob_client(file_name)
         try:
-            # Create a BlobServiceClient using the managed identity credential
-            blob_service_client = BlobServiceClient(
-                account_url=blob_account_url, credential=DefaultAzureCredential()
-            )
+            if cached:
+                # Download the document only if it changed since it was cached
+                downloader = blob_client.download_blob(
+                    etag=cached["etag"], match_condition=MatchConditions.IfModified
+                )
+            else:
+                downloader = blob_client.download_blob()
+        except ResourceNotModifiedError:
+            logger.debug(f"Hub Master data '{file_name}' is unchanged, keeping the cached copy")
+            hub_master_cache.mark_validated(cityname)
+            return cached["content"]
+        content = downloader.readall()
+        # Decode the content if it's in bytes
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        logger.debug(f"Hub Master file content:\n {content}")
+        hub_master_cache.store(cityname, content, downloader.properties.etag)
+        logger.debug(
+            f"read hub master data from '{file_name}' in blob container '{blob_container_name}' successfully."
+        )
+        return content
 
-            # Create a container client
-            container_client = blob_service_client.get_container_client(
-                blob_container_name
+    def restore_access(error: Exception):
+        if is_access_error(error):
+            # The cached network access state is stale; have it checked (and restored) before the next attempt
+            invalidate_blob_account_access(blob_account_name)
+            set_blob_account_public_access(
+                blob_account_name, az_subscription_id, az_storage_rg_name
             )
 
-            logger.debug(f"hub master data read attempt # {attempt+1} of {max_retries}")
-            blob_list = container_client.list_blobs()
-            for blob in blob_list:
-                if file_name in blob.name:
-                    # read the file content
-                    blob_client = container_client.get_blob_client(blob.name)
-                    response = blob_client.download_blob().readall()
-                    # Decode the content if it's in bytes
-                    if isinstance(response, bytes):
-                        response = response.decode("utf-8")
-                        logger.debug(f"Hub Master file content:\n {response}")
-                        success = True
-                        logger.debug(
-                            f"read hub master data from '{file_name}' in blob container '{blob_container_name}' successfully."
-                        )
-                        break
-            # if success:
-            break  # Exit the retry loop if successful
-
-        except Exception as e:
-            logger.warning(
-                f"Hub master data document read attempt {attempt+1} failed: {str(e)}"
-            )
-            if attempt < max_retries - 1:
-                logger.info(f"Waiting {retry_delay} seconds before retry...")
-                time.sleep(retry_delay)
-                retry_delay *= 2  # Exponential backoff
-            else:
-                logger.error(
-                    f"All {max_retries} hub master data document read attempts failed"
-                )
-    if not success:
+    # When the public network access is updated to enabled, from a 'disabled' state, from the code here, the blob access,
+    # when tried soon after, fails. So the read is retried, with a jittered exponential backoff; a missing document
+    # (404) is not retried.
+    try:
+        return retry_call(_read_policy, read_blob, on_retry=restore_access)
+    except Exception as e:
+        if cached:
+            logger.warning(f"Serving the cached Hub Master data for '{cityname}' after the read failed: {str(e)}")
+            return cached["content"]
         logger.error(
-            f"Unable to read the Hub Master data document from the blob storage ; file name: {file_name}"
+            f"Unable to read the Hub Master data document from the blob storage ; file name: {file_name}: {str(e)}"
         )
         raise Exception("Issue accessing Master data for the current Hub Location. Please contact the TAB administrator.")
-    return response
+
+
+def warm_hub_master_cache(hub_cities: str = None) -> int:
+    """
+    Load the Hub Master data of the comma separated hub cities (by default, DefaultConfig.hub_cities) into the cache.
+    Cities without a Hub Master data document are skipped. Returns the number of cities cached.
+    """
+    cities = [c.strip() for c in (hub_cities or l_config.hub_cities or "").split(",") if c.strip()]
+    warmed = 0
+    for city in cities:
+        try:
+            read_hub_masterdata(city)
+            warmed += 1
+        except Exception as e:
+            logger.debug(f"Hub Master data not cached for '{city}': {str(e)}")
+    logger.info(f"Hub Master data cache warmed for {warmed} of {len(cities)} hub cities")
+    return warmed
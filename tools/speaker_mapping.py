@@ -0,0 +1,252 @@
+import functools
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+from tools.hub_master import read_hub_masterdata
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+TBD = "TBD"
+
+# A match on a whole keyword phrase counts fully; a keyword only partly present in the topic counts for less
+PARTIAL_MATCH_WEIGHT = 0.5
+# The minimum score for a speaker to be assigned; below it the topic is left TBD
+MIN_MATCH_SCORE = 1.0
+
+_STOP_WORDS = {
+    "a", "an", "and", "for", "of", "the", "to", "in", "on", "with", "use", "cases", "case", "based", "using",
+    "session", "sessions", "discuss", "discussion", "overview", "how", "what", "our", "their", "its", "into",
+}
+
+
+@dataclass
+class SpeakerCategory:
+    """A row of the #SpeakerMappingTable in the hub master data."""
+
+    name: str
+    keywords: list
+    speaker: str
+    title: str
+
+
+@dataclass
+class SpeakerIndex:
+    """The #SpeakerMappingTable of a hub, compiled into an inverted index: keyword -> category -> speaker."""
+
+    location: str = ""
+    architects: list = field(default_factory=list)
+    categories: list = field(default_factory=list)
+    keyword_index: dict = field(default_factory=dict)  # keyword tokens -> [(category index, keyword)]
+    token_index: dict = field(default_factory=dict)  # token -> {keyword tokens}
+    idf: dict = field(default_factory=dict)  # token -> inverse category frequency
+
+
+def _tokens(text: str) -> tuple:
+    """Lower case word tokens, with the plural 's' removed, without the stop words."""
+    words = re.findall(r"[a-z0-9]+", text.lower().replace("&", " and "))
+    return tuple(
+        w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+        for w in words
+        if w not in _STOP_WORDS
+    )
+
+
+def _keyword_variants(keyword: str) -> list:
+    """'Azure Kubernetes Service (AKS)' -> the keyword, without the parenthesis, and the acronym; 'A / B' -> A and B"""
+    variants = []
+    for part in keyword.split("/"):
+        inner = re.findall(r"\(([^)]*)\)", part)
+        outer = re.sub(r"\([^)]*\)", " ", part)
+        variants += [outer] + inner
+    return [v.strip() for v in variants if v.strip()]
+
+
+def _clean_cell(text: str) -> str:
+    return re.sub(r"\s+", " ", text.replace("**", "")).strip()
+
+
+def parse_hub_master(markdown: str) -> tuple:
+    """
+    Parse the hub master data markdown: the '#Innovation Hub Location:', the '# Architects' and the rows of the
+    '#SpeakerMappingTable'. Returns the location, the list of architects and the list of SpeakerCategory.
+    """
+    location = ""
+    architects = []
+    categories = []
+    section = None
+    for raw_line in markdown.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            heading = line.lstrip("#").strip()
+            if heading.lower().startswith("innovation hub location:"):
+                location = heading.split(":", 1)[1].strip()
+                section = None
+            else:
+                section = heading.lower().replace(" ", "")
+            continue
+        if section == "architects":
+            architects.append(line)
+        elif section == "speakermappingtable" and line.startswith("|"):
+            cells = [c.strip() for c in line.strip("|").split("|")]
+            if len(cells) < 3 or cells[0].lower() == "category" or set(cells[0]) <= set("-: "):
+                continue
+            speaker_cell = cells[2]
+            bold = re.match(r"\*\*(.+?)\*\*\s*(.*)", speaker_cell)
+            speaker, title = (bold.group(1), bold.group(2)) if bold else (speaker_cell, "")
+            categories.append(
+                SpeakerCategory(
+                    name=_clean_cell(cells[0]),
+                    keywords=[_clean_cell(k) for k in cells[1].split(",") if k.strip()],
+                    speaker=_clean_cell(speaker),
+                    title=_clean_cell(title),
+                )
+            )
+    return location, architects, categories
+
+
+@functools.lru_cache(maxsize=64)
+def build_speaker_index(markdown: str) -> SpeakerIndex:
+    """Compile the hub master data into a SpeakerIndex. The index is cached per hub master document."""
+    location, architects, categories = parse_hub_master(markdown)
+    index = SpeakerIndex(location=location, architects=architects, categories=categories)
+    category_tokens = []
+    for position, category in enumerate(categories):
+        tokens = set()
+        # The category name is indexed as a keyword too, e.g. 'Retail Industry'
+        for keyword in category.keywords + [category.name]:
+            for variant in _keyword_variants(keyword):
+                key = _tokens(variant)
+                if not key:
+                    continue
+                index.keyword_index.setdefault(key, []).append((position, variant))
+                for token in key:
+                    index.token_index.setdefault(token, set()).add(key)
+                tokens.update(key)
+        category_tokens.append(tokens)
+
+    # Tokens common to many categories (e.g. 'ai', 'microsoft') weigh less than the specific ones (e.g. 'fabric')
+    count = max(len(categories), 1)
+    for token in index.token_index:
+        frequency = sum(1 for tokens in category_tokens if token in tokens)
+        index.idf[token] = math.log((count + 1) / frequency)
+    logger.debug(
+        f"Speaker index for '{location}': {len(categories)} categories, {len(index.keyword_index)} keywords"
+    )
+    return index
+
+
+def _contains(sequence: tuple, sub: tuple) -> bool:
+    size = len(sub)
+    return any(sequence[i:i + size] == sub for i in range(len(sequence) - size + 1))
+
+
+def assign_speaker(index: SpeakerIndex, topic: str) -> dict:
+    """
+    Assign the speaker for the topic, deterministically:
+    - the keywords (and category names) found whole in the topic score the sum of the weights of their tokens,
+      the keywords found in part score less
+    - the category with the most specific (highest scoring) keyword wins, ties going to the higher total score
+    - a topic that scores below MIN_MATCH_SCORE is left TBD
+    """
+    topic_tokens = _tokens(topic)
+    topic_set = set(topic_tokens)
+    scores = {}  # category index -> [best keyword score, total score, {matched keyword: score}]
+    candidate_keys = set()
+    for token in topic_set:
+        candidate_keys.update(index.token_index.get(token, ()))
+
+    for key in candidate_keys:
+        weight = sum(index.idf.get(t, 0.0) for t in key)
+        if _contains(topic_tokens, key):
+            score = weight
+        else:
+            overlap = [t for t in key if t in topic_set]
+            if len(overlap) * 2 < len(key):
+                continue
+            score = PARTIAL_MATCH_WEIGHT * sum(index.idf.get(t, 0.0) for t in overlap)
+        for position, keyword in index.keyword_index[key]:
+            entry = scores.setdefault(position, [0.0, 0.0, {}])
+            entry[0] = max(entry[0], score)
+            entry[1] += score
+            entry[2][keyword] = max(entry[2].get(keyword, 0.0), score)
+
+    ranked = sorted(scores.items(), key=lambda item: (item[1][0], item[1][1], -item[0]), reverse=True)
+    if not ranked or ranked[0][1][0] < MIN_MATCH_SCORE:
+        return {"topic": topic, "speaker": TBD, "title": "", "category": None, "matched_keywords": []}
+
+    position, (best, _, keywords) = ranked[0]
+    category = index.categories[position]
+    return {
+        "topic": topic,
+        "speaker": category.speaker,
+        "title": category.title,
+        "category": category.name,
+        "matched_keywords": sorted(keywords, key=keywords.get, reverse=True),
+        "score": round(best, 2),
+    }
+
+
+def summarize_hub_master(markdown: str) -> str:
+    """
+    The hub master data for the prompts: the location, the architects and the speaker of each category,
+    without the topic keywords, which are matched by assign_speaker instead.
+    """
+    index = build_speaker_index(markdown)
+    lines = [f"#Innovation Hub Location: {index.location}", "", "# Architects"]
+    lines += index.architects
+    lines += ["", "#SpeakerMappingTable", "", "| Category | Speaker Name |", "|---|---|"]
+    lines += [f"| {c.name} | {c.speaker}, {c.title} |" for c in index.categories]
+    return "\n".join(lines)
+
+
+def extract_goal_topics(goals_message: str) -> list:
+    """The goals (with their details) in the '### Engagement Goals Confirmation Message ###' of the Notes Extractor."""
+    topics = []
+    for line in goals_message.splitlines():
+        match = re.match(r"^[\s>*-]*\**\s*Goal\s*\d*\s*\**\s*:\s*\**\s*(.+)$", line, flags=re.IGNORECASE)
+        if match:
+            topics.append(match.group(1).strip(" *"))
+        elif topics and re.match(r"^\s+[-*]\s+\S", line):
+            topics[-1] += "; " + line.strip().lstrip("-* ").strip()
+    return topics
+
+
+def format_speaker_assignments(assignments: list) -> str:
+    lines = ["| Topic | Speaker | Category |", "|---|---|---|"]
+    for a in assignments:
+        speaker = f"{a['speaker']}, {a['title']}" if a["title"] else a["speaker"]
+        lines.append(f"| {a['topic']} | {speaker} | {a['category'] or '-'} |")
+    return "\n".join(lines)
+
+
+@tool
+def assign_speakers(topics: list[str], config: RunnableConfig) -> str:
+    """
+    Assign the speakers from the Innovation Hub's #SpeakerMappingTable to the agenda topics.
+    Returns a Markdown table of the topic, the speaker with the job title, and the category matched.
+    The speaker is TBD when no speaker matches the topic.
+    """
+    configuration = config.get("configurable", {})
+    cityname = configuration.get("hub_location", None)
+    if not cityname:
+        raise ValueError("No Hub Location indicated.")
+    index = build_speaker_index(read_hub_masterdata(cityname))
+    return format_speaker_assignments([assign_speaker(index, topic) for topic in topics])
@@ -0,0 +1,177 @@
+"""
+The definition of the Azure OpenAI Assistant used by the Document Generator Agent (its instructions, the code
+interpreter tool with the Agenda Document Template files, and its temperature), and its reconciliation with the live
+Assistant.
+
+The Assistant is reconciled once per process, at startup or before the first Assistants thread is created: the live
+definition is retrieved and hashed, and the Assistant is only updated when its hash differs from the hash of the
+definition below (a drift). The drift and the timings of the reconciliation are exposed at /api/stats.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+from util.az_clients import get_openai_client
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+ASSISTANT_INSTRUCTIONS = """
+    You are an AI Assistant tasked with helping the Technical Architects at the Microsoft Innovation Hub prepare a Microsoft Office Word Document (.docx format) containing the planned Agenda for the Customer Engagement.
+    You have been provided with an empty Word document - Innovation Hub Agenda Format.docx
+
+    You need to take the Markdown format agenda provided by the user and fill the Word document above.
+    You will set the values like the following:
+    - Customer Name
+    - Date of the Engagement
+    - Location where the Innovation Hub Session would be held
+    - Engagement Type: (Whether Business Envisioning, or Solution Envisioning, or ADS, or Rapid Prototype or Hackathon, or Consult)
+    - Fill in the topics in the agenda into the table provided. You will have to add rows to the table as required, to accommodate all the topics mentioned by the user in the Markdown format
+    - Save the document with a File Name in the format [Agenda-$EngagementType-CustomerName.docx]
+    """
+
+ASSISTANT_TEMPERATURE = 0.3
+
+
+def desired_definition() -> dict:
+    """The definition of the Assistant, as the arguments of assistants.update"""
+    return {
+        "instructions": ASSISTANT_INSTRUCTIONS,
+        "tools": [{"type": "code_interpreter"}],
+        "tool_resources": {
+            "code_interpreter": {"file_ids": [f.strip() for f in l_config.file_ids if f.strip()]}
+        },
+        "temperature": ASSISTANT_TEMPERATURE,
+    }
+
+
+def _canonical(instructions, tool_types, file_ids, temperature) -> dict:
+    return {
+        "instructions": instructions or "",
+        "tools": sorted(tool_types),
+        "file_ids": sorted(file_ids or []),
+        "temperature": round(temperature, 3) if temperature is not None else None,
+    }
+
+
+def _canonical_desired(definition: dict) -> dict:
+    return _canonical(
+        definition["instructions"],
+        [tool["type"] for tool in definition["tools"]],
+        definition["tool_resources"]["code_interpreter"]["file_ids"],
+        definition["temperature"],
+    )
+
+
+def _canonical_live(assistant) -> dict:
+    tool_resources = getattr(assistant, "tool_resources", None)
+    code_interpreter = getattr(tool_resources, "code_interpreter", None)
+    return _canonical(
+        assistant.instructions,
+        [tool.type for tool in assistant.tools or []],
+        getattr(code_interpreter, "file_ids", None),
+        assistant.temperature,
+    )
+
+
+def definition_digest(canonical: dict) -> str:
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class AssistantReconciler:
+    """Brings the live Assistant in line with its definition, once per process.
+
+    :param assistant_id: The id of the Assistant.
+    :type assistant_id: str
+    :param definition: The definition of the Assistant, see desired_definition.
+    :type definition: dict
+    """
+
+    def __init__(self, assistant_id: str, definition: dict):
+        self.assistant_id = assistant_id
+        self.definition = definition
+        self.digest = definition_digest(_canonical_desired(definition))
+        self._lock = threading.Lock()
+        self.reconciled = False
+        self.drift = None
+        self.drifted_fields = []
+        self.updated = False
+        self.retrieve_ms = None
+        self.update_ms = None
+        self.reconciled_at = None
+        self.errors = 0
+
+    def reconcile(self) -> bool:
+        """Reconcile the Assistant, unless it already was in this process. Returns whether it had drifted."""
+        if self.reconciled:
+            return self.drift
+        # Only one caller reconciles; the others wait for it and reuse its result
+        with self._lock:
+            if self.reconciled:
+                return self.drift
+            try:
+                return self._reconcile()
+            except Exception:
+                self.errors += 1
+                raise
+
+    def _reconcile(self) -> bool:
+        client = get_openai_client()
+        start = time.perf_counter()
+        live = _canonical_live(client.beta.assistants.retrieve(assistant_id=self.assistant_id))
+        self.retrieve_ms = (time.perf_counter() - start) * 1000
+
+        desired = _canonical_desired(self.definition)
+        self.drifted_fields = [field for field in desired if desired[field] != live[field]]
+        self.drift = definition_digest(live) != self.digest
+        if self.drift:
+            start = time.perf_counter()
+            client.beta.assistants.update(self.assistant_id, **self.definition)
+            self.update_ms = (time.perf_counter() - start) * 1000
+            self.updated = True
+        self.reconciled = True
+        self.reconciled_at = time.time()
+        logger.info(
+            f"Assistant {self.assistant_id} reconciled: "
+            + (f"updated the drifted {', '.join(self.drifted_fields)}" if self.drift else "no drift"),
+            extra={
+                "custom_dimensions": {
+                    "metric": "assistant_reconcile",
+                    "assistant_drift": self.drift,
+                    "assistant_drifted_fields": ",".join(self.drifted_fields),
+                    "assistant_retrieve_ms": round(self.retrieve_ms),
+                    "assistant_update_ms": round(self.update_ms) if self.update_ms is not None else None,
+                    "assistant_definition_digest": self.digest,
+                }
+            },
+        )
+        return self.drift
+
+    def stats(self) -> dict:
+        return {
+            "reconciled": self.reconciled,
+            "definition_digest": self.digest,
+            "drift": self.drift,
+            "drifted_fields": self.drifted_fields,
+            "updated": self.updated,
+            "retrieve_ms": round(self.retrieve_ms, 1) if self.retrieve_ms is not None else None,
+            "update_ms": round(self.update_ms, 1) if self.update_ms is not None else None,
+            "reconciled_at": self.reconciled_at,
+            "errors": self.errors,
+        }
+
+
+assistant_reconciler = AssistantReconciler(l_config.az_assistant_id, desired_definition())
@@ -0,0 +1,195 @@
+"""
+A pool of Assistants API threads created ahead of the sessions that use them.
+
+A new session takes a thread from the pool instead of creating one on its first turn; a background worker creates the
+threads that replace the ones taken, and deletes the pooled threads older than the max age so that a session never
+starts on a stale thread. The threads of the expired sessions are deleted in the background as well, and the pooled
+threads when the app shuts down, so that no thread is left behind on the service.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+from util.az_clients import get_openai_client
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+
+class AssistantThreadPool:
+    """Assistants API threads ready to be used by new sessions.
+
+    :param target_size: The number of threads kept ready; 0 creates each thread when it is taken.
+    :type target_size: int
+    :param max_age_seconds: The age after which a pooled thread is deleted and replaced.
+    :type max_age_seconds: float
+    """
+
+    def __init__(self, target_size: int, max_age_seconds: float):
+        self.target_size = target_size
+        self.max_age_seconds = max_age_seconds
+        self._threads = deque()  # (thread id, created at), oldest first
+        self._to_delete = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._closed = False
+        self.created = 0
+        self.taken = 0
+        self.misses = 0
+        self.expired = 0
+        self.deleted = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the background worker, which fills the pool; it is also started by the first session."""
+        with self._lock:
+            if self._worker is not None or self._closed:
+                return
+            self._worker = threading.Thread(target=self._run, name="assistant-thread-pool", daemon=True)
+            self._worker.start()
+
+    def take(self) -> str:
+        """The id of a thread for a new session, from the pool when it has one, else created now."""
+        self.start()
+        self._wake.set()
+        now = time.monotonic()
+        with self._lock:
+            while self._threads:
+                thread_id, created_at = self._threads.popleft()
+                if now - created_at <= self.max_age_seconds:
+                    self.taken += 1
+                    return thread_id
+                self._expire(thread_id)
+            self.misses += 1
+        logger.debug("The Assistants thread pool is empty, creating the thread of the session now")
+        return self._create()
+
+    async def take_async(self) -> str:
+        """Same as take, without blocking the event loop when the thread has to be created."""
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            while self._threads:
+                thread_id, created_at = self._threads.popleft()
+                if now - created_at <= self.max_age_seconds:
+                    self.taken += 1
+                    self._wake.set()
+                    return thread_id
+                self._expire(thread_id)
+        return await asyncio.get_running_loop().run_in_executor(None, self.take)
+
+    def retire(self, thread_id: str):
+        """Delete, in the background, the thread of a session that has ended, or that a failed session start took."""
+        if not thread_id:
+            return
+        with self._lock:
+            self._to_delete.append(thread_id)
+        if self._closed:
+            self._delete_pending()
+            return
+        self.start()
+        self._wake.set()
+
+    def _expire(self, thread_id: str):
+        # Called with the lock held
+        self.expired += 1
+        self._to_delete.append(thread_id)
+
+    def _create(self) -> str:
+        thread_id = get_openai_client().beta.threads.create().id
+        with self._lock:
+            self.created += 1
+        return thread_id
+
+    def _delete(self, thread_id: str):
+        try:
+            get_openai_client().beta.threads.delete(thread_id)
+            with self._lock:
+                self.deleted += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.debug(f"Unable to delete the Assistants thread {thread_id}: {str(e)}")
+
+    def _delete_pending(self):
+        while True:
+            with self._lock:
+                if not self._to_delete:
+                    return
+                thread_id = self._to_delete.popleft()
+            self._delete(thread_id)
+
+    def _refill(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._threads and now - self._threads[0][1] > self.max_age_seconds:
+                self._expire(self._threads.popleft()[0])
+            missing = self.target_size - len(self._threads)
+        for _ in range(max(0, missing)):
+            if self._closed:
+                return
+            try:
+                thread_id = self._create()
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logger.warning(f"Unable to create an Assistants thread for the pool: {str(e)}")
+                return
+            with self._lock:
+                if self._closed:
+                    self._to_delete.append(thread_id)
+                    return
+                self._threads.append((thread_id, time.monotonic()))
+
+    def _run(self):
+        # Wakes up when a thread is taken or retired, and at least often enough to replace the threads as they age
+        interval = max(1.0, min(self.max_age_seconds / 2, 60.0))
+        while not self._closed:
+            self._refill()
+            self._delete_pending()
+            self._wake.wait(timeout=interval)
+            self._wake.clear()
+
+    def close(self):
+        """Stop the background worker, and delete the threads of the pool that were not taken."""
+        with self._lock:
+            self._closed = True
+            self._to_delete.extend(thread_id for thread_id, _ in self._threads)
+            self._threads.clear()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout=10)
+        self._delete_pending()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ready": len(self._threads),
+                "target_size": self.target_size,
+                "created": self.created,
+                "taken": self.taken,
+                "misses": self.misses,
+                "expired": self.expired,
+                "deleted": self.deleted,
+                "errors": self.errors,
+            }
+
+
+assistant_thread_pool = AssistantThreadPool(
+    l_config.assistant_thread_pool_size,
+    l_config.assistant_thread_pool_max_age_minutes * 60,
+)
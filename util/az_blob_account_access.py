@@ -1,12 +1,24 @@
-from azure.mgmt.storage import StorageManagementClient
 from azure.mgmt.storage.models import StorageAccountUpdateParameters
-from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import (
+    HttpResponseError,
+    ServiceRequestError,
+    ServiceResponseError,
+)
+import asyncio
 import logging
 from opencensus.ext.azure.log_exporter import AzureLogHandler
+import threading
 import time
 import traceback
 from config import DefaultConfig
-from azure.identity import DefaultAzureCredential
+from util.az_clients import get_storage_management_client
+from util.retry import (
+    CircuitOpenError,
+    RetryPolicy,
+    retry_async,
+    retry_call,
+    storage_retry_policy,
+)
 from azure.storage.blob import (
     generate_blob_sas,
     BlobSasPermissions,
@@ -27,6 +39,93 @@ logger.setLevel(log_level)
 # logger.setLevel(logging.DEBUG)
 
 
+class BlobAccountAccessCache:
+    """Process-wide cache of the last known public network access state of Storage Accounts.
+
+    A state of 'Enabled' is trusted until the TTL expires, or until a data-plane call reports a 403 or a
+    network error and the entry is invalidated. Concurrent checks for the same account are coalesced: only
+    one caller queries the management plane, the others wait on the account lock and reuse its result.
+    """
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._states = {}  # account name -> (public_network_access, checked at)
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def lock_for(self, blob_account_name: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(blob_account_name, threading.Lock())
+
+    def is_enabled(self, blob_account_name: str) -> bool:
+        entry = self._states.get(blob_account_name)
+        if entry is None:
+            return False
+        state, checked_at = entry
+        if time.monotonic() - checked_at > self.ttl_seconds:
+            return False
+        return state == "Enabled"
+
+    def record(self, blob_account_name: str, state: str):
+        self._states[blob_account_name] = (state, time.monotonic())
+
+    def invalidate(self, blob_account_name: str = None):
+        if blob_account_name is None:
+            self._states.clear()
+        else:
+            self._states.pop(blob_account_name, None)
+
+
+access_cache = BlobAccountAccessCache(l_config.az_storage_access_ttl_seconds)
+
+
+def is_access_error(error: Exception) -> bool:
+    """
+    Whether a data-plane error indicates that the cached network access state can no longer be trusted.
+    """
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True
+    return isinstance(error, HttpResponseError) and error.status_code == 403
+
+
+def is_retryable_storage_error(error: Exception) -> bool:
+    """
+    Whether a Storage call that failed with the error may succeed when retried: the network errors, the 403 returned
+    while the public network access takes effect, throttling and the server errors.
+    """
+    if is_access_error(error) or isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, HttpResponseError):
+        return error.status_code in (408, 429) or (error.status_code or 0) >= 500
+    return False
+
+
+class PublicAccessPendingError(Exception):
+    """The update of the public network access of the Storage Account has not taken effect yet."""
+
+
+# The management plane calls, and the polling of the public network access once its update has been requested
+_access_policy = storage_retry_policy("storage_public_access", retry_if=is_retryable_storage_error)
+_access_poll_policy = RetryPolicy(
+    "storage_public_access_poll",
+    max_attempts=30,
+    base_delay_seconds=2,
+    max_delay_seconds=10,
+    deadline_seconds=l_config.az_storage_retry_deadline_seconds,
+    retry_if=lambda e: isinstance(e, PublicAccessPendingError) or is_retryable_storage_error(e),
+)
+# The checks in progress on the event loop, per account
+_pending_checks = {}
+
+
+def invalidate_blob_account_access(blob_account_name: str = None):
+    """
+    Drop the cached network access state, so that the next check goes to the management plane.
+    """
+    logger.debug(f"Invalidating the cached network access state for Storage Account: {blob_account_name}")
+    access_cache.invalidate(blob_account_name)
+
+
 def set_blob_account_public_access(
     blob_account_name: str,
     az_subscription_id: str,
@@ -35,81 +134,134 @@ def set_blob_account_public_access(
     
     """
     Set the blob account public access to allow public access.
+    The management plane is only queried when the cached state has expired or was invalidated.
+    Waits on the calling thread; on the event loop, use set_blob_account_public_access_async.
     """
-    access_set= False
+    if access_cache.is_enabled(blob_account_name):
+        return True
 
-    try:
-        # Get the managed identity credential
-        azure_credential = DefaultAzureCredential()
+    # Only one caller per account performs the check; the others pick up its result from the cache.
+    with access_cache.lock_for(blob_account_name):
+        if access_cache.is_enabled(blob_account_name):
+            return True
+        return _check_and_set_public_access(
+            blob_account_name, az_subscription_id, az_storage_rg_name
+        )
+
+
+async def set_blob_account_public_access_async(
+    blob_account_name: str,
+    az_subscription_id: str,
+    az_storage_rg_name: str
+) -> bool:
+    """
+    Same as set_blob_account_public_access, without blocking the event loop: the management plane calls run on the
+    default executor and the waits are asynchronous. Concurrent checks for the same account share one check.
+    """
+    if access_cache.is_enabled(blob_account_name):
+        return True
 
-        # Create a BlobServiceClient using the managed identity credential
-        storage_mgmt_client = StorageManagementClient(
-            azure_credential, az_subscription_id
+    check = _pending_checks.get(blob_account_name)
+    if check is None:
+        check = asyncio.ensure_future(
+            _check_and_set_public_access_async(blob_account_name, az_subscription_id, az_storage_rg_name)
         )
+        _pending_checks[blob_account_name] = check
+        check.add_done_callback(lambda _: _pending_checks.pop(blob_account_name, None))
+    # A turn that is cancelled does not cancel the check the other turns wait on
+    return await asyncio.shield(check)
 
-        # Check if the storage account allows public access
-        # If not, update the storage account to allow public access
-        properties = storage_mgmt_client.storage_accounts.get_properties(
-            resource_group_name=az_storage_rg_name, account_name=blob_account_name
+
+def _get_public_access(blob_account_name: str, az_subscription_id: str, az_storage_rg_name: str) -> str:
+    # The Storage management client, using the shared managed identity credential
+    storage_mgmt_client = get_storage_management_client(az_subscription_id)
+    properties = storage_mgmt_client.storage_accounts.get_properties(
+        resource_group_name=az_storage_rg_name, account_name=blob_account_name
+    )
+    return properties.public_network_access
+
+
+def _request_public_access(blob_account_name: str, az_subscription_id: str, az_storage_rg_name: str):
+    logger.debug(
+        "Public network access is not enabled. Updating storage account..."
+    )
+    storage_mgmt_client = get_storage_management_client(az_subscription_id)
+
+    # Define the update parameters to allow public access
+    update_params = StorageAccountUpdateParameters(
+        network_rule_set={"default_action": "Allow", "bypass": "AzureServices"},
+        public_network_access="Enabled",
+    )
+
+    # Update the storage account to allow public access
+    storage_mgmt_client.storage_accounts.update(
+        az_storage_rg_name, blob_account_name, update_params
+    )
+
+
+def _require_public_access(blob_account_name: str, az_subscription_id: str, az_storage_rg_name: str):
+    logger.debug(
+        "Checking the status of public network access to the Storage Account current ..."
+    )
+    if _get_public_access(blob_account_name, az_subscription_id, az_storage_rg_name) != "Enabled":
+        raise PublicAccessPendingError(
+            f"The public network access to the Storage Account '{blob_account_name}' is not enabled yet"
         )
-        if properties.public_network_access != "Enabled":
+
+
+def _check_and_set_public_access(
+    blob_account_name: str,
+    az_subscription_id: str,
+    az_storage_rg_name: str
+) -> bool:
+    account = (blob_account_name, az_subscription_id, az_storage_rg_name)
+    try:
+        # Check if the storage account allows public access
+        # If not, update the storage account to allow public access, and wait for the update to take effect
+        if retry_call(_access_policy, _get_public_access, *account) != "Enabled":
+            retry_call(_access_policy, _request_public_access, *account)
+            retry_call(_access_poll_policy, _require_public_access, *account)
             logger.debug(
-                "Public network access is not enabled. Updating storage account..."
+                "Public network access to the Storage Account is now updated to allow."
             )
+            time.sleep(l_config.az_storage_access_settle_seconds)  # this is to let the access take effect
+        access_cache.record(blob_account_name, "Enabled")
+        return True
+    except Exception as e:
+        _log_access_error(e)
+        return False
 
-            # Define the update parameters to allow public access
-            update_params = StorageAccountUpdateParameters(
-                network_rule_set={"default_action": "Allow", "bypass": "AzureServices"},
-                public_network_access="Enabled",
-            )
 
-            # Update the storage account to allow public access
-            storage_mgmt_client.storage_accounts.update(
-                az_storage_rg_name, blob_account_name, update_params
+async def _check_and_set_public_access_async(
+    blob_account_name: str,
+    az_subscription_id: str,
+    az_storage_rg_name: str
+) -> bool:
+    account = (blob_account_name, az_subscription_id, az_storage_rg_name)
+    try:
+        if await retry_async(_access_policy, _get_public_access, *account) != "Enabled":
+            await retry_async(_access_policy, _request_public_access, *account)
+            await retry_async(_access_poll_policy, _require_public_access, *account)
+            logger.debug(
+                "Public network access to the Storage Account is now updated to allow."
             )
-
-            # add a while loop to check the value of mgmt_response.allow_blob_public_access
-            # break when the value is True
-            start_time = time.time()
-            flag = True
-            while flag:
-                # GETTING UPDATED PROPERTIES OF STORAGE ACCOUNT
-                logger.debug(
-                    "Checking the status of public network access to the Storage Account current ..."
-                )
-                properties_l = storage_mgmt_client.storage_accounts.get_properties(
-                    resource_group_name=az_storage_rg_name,
-                    account_name=blob_account_name,
-                )
-                if properties_l.public_network_access == "Enabled":
-                    logger.debug(
-                        "Public network access to the Storage Account is now updated to allow."
-                    )
-                    time.sleep(10) # this is to let the access take effect
-                    access_set = True
-                    flag = False
-                    break
-                else:
-                    time.sleep(5)
-                    logger.debug(
-                        "The Storage Account is not enabled for public access, trying again..."
-                    )
-                    # beyond 1 minute, break the loop and return an error message
-                    if time.time() - start_time > 60:
-                        logger.error(
-                            "Timeout: Despite repeated attempts, Unable to set Public network access to the Storage account to 'allow'."
-                        )
-                        flag = False
-                    continue
-        else:
-            # logger.debug(
-            #     "Public network access to the Storage Account is already enabled."
-            # )
-            access_set = True
+            await asyncio.sleep(l_config.az_storage_access_settle_seconds)  # this is to let the access take effect
+        access_cache.record(blob_account_name, "Enabled")
+        return True
     except Exception as e:
+        _log_access_error(e)
+        return False
+
+
+def _log_access_error(error: Exception):
+    if isinstance(error, (PublicAccessPendingError, asyncio.TimeoutError)):
+        logger.error(
+            "Timeout: Despite repeated attempts, Unable to set Public network access to the Storage account to 'allow'."
+        )
+    elif isinstance(error, CircuitOpenError):
+        logger.error(f"The public network access to the Storage Account is not checked: {error}")
+    else:
         logger.error(
-            f"Error while checking or updating public network access to the Storage Account: {e}"
+            f"Error while checking or updating public network access to the Storage Account: {error}"
         )
         logger.error(traceback.format_exc())
-    return access_set
-
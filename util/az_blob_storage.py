@@ -1,11 +1,11 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-import json
+import asyncio
+import hashlib
+from collections import OrderedDict
 from typing import Dict, List
 
-from jsonpickle import encode
-from jsonpickle.unpickler import Unpickler
 from azure.core import MatchConditions
 from azure.core.exceptions import (
     HttpResponseError,
@@ -15,9 +15,13 @@ from azure.core.exceptions import (
 from azure.storage.blob.aio import (
     BlobServiceClient,
     BlobClient,
-    StorageStreamDownloader,
 )
 from botbuilder.core import Storage
+from data_models.state_codec import encode_state, decode_state
+from util.az_blob_account_access import (
+    invalidate_blob_account_access,
+    is_access_error,
+)
 
 
 class TABBlobStorageSettings:
@@ -32,6 +36,10 @@ class TABBlobStorageSettings:
     :param connection_string: Connection string of the Blob Storage account.
         Required if not using account_name and account_key.
     :type connection_string: str
+    :param max_concurrency: The maximum number of blob downloads or uploads in flight at a time.
+    :type max_concurrency: int
+    :param max_tracked_blobs: The number of blobs for which the content hash is remembered, to skip unchanged writes.
+    :type max_tracked_blobs: int
     """
 
     # def __init__(
@@ -51,40 +59,68 @@ class TABBlobStorageSettings:
         container_name: str,
         account_url: str = "",
         credential: str = "",
+        max_concurrency: int = 8,
+        max_tracked_blobs: int = 10000,
     ):
         self.container_name = container_name
         self.account_url = account_url
         self.credential = credential
+        self.max_concurrency = max_concurrency
+        self.max_tracked_blobs = max_tracked_blobs
 
 class BlobStorage(Storage):
     """An Azure Blob based storage provider for a bot.
 
     This class uses a single Azure Storage Blob Container.
-    Each entity or StoreItem is serialized into a JSON string and stored in an individual text blob.
+    Each entity or StoreItem is serialized into a compact, versioned JSON string (see data_models/state_codec.py)
+    and stored in an individual text blob. Blobs written earlier with jsonpickle are migrated on read.
     Each blob is named after the store item key,  which is encoded so that it conforms a valid blob name.
     If an entity is an StoreItem, the storage object will set the entity's e_tag
     property value to the blob's e_tag upon read. Afterward, an match_condition with the ETag value
     will be generated during Write. New entities start with a null e_tag.
+    The blobs of a read or write are transferred concurrently, bounded by settings.max_concurrency,
+    over the single BlobServiceClient (and HTTP session) created for this instance.
+    The hash of the content last read or written is remembered per blob, and a write whose serialized content
+    is byte-identical to it is skipped. The number of performed and skipped writes is reported by get_write_stats().
 
     :param settings: Settings used to instantiate the Blob service.
     :type settings: :class:`botbuilder.azure.BlobStorageSettings`
+    :param container_client: An existing container client to use instead of creating one from the settings,
+        e.g. one pointing at a local storage emulator.
     """
 
-    def __init__(self, settings: TABBlobStorageSettings):
+    def __init__(self, settings: TABBlobStorageSettings, container_client=None):
         if not settings.container_name:
             raise Exception("Container name is required.")
 
-        if settings.credential:
-            blob_service_client = BlobServiceClient(
-                account_url=settings.account_url, credential=settings.credential
+        self.__blob_service_client = None
+        if container_client is None:
+            if settings.credential:
+                self.__blob_service_client = BlobServiceClient(
+                    account_url=settings.account_url, credential=settings.credential
+                )
+            container_client = self.__blob_service_client.get_container_client(
+                settings.container_name
             )
 
-        self.__container_client = blob_service_client.get_container_client(
-            settings.container_name
-        )
+        self.__container_client = container_client
+        self.__account_name = container_client.account_name
+        self.__semaphore = asyncio.Semaphore(settings.max_concurrency)
+        self.__max_tracked_blobs = settings.max_tracked_blobs
+        self.__content_hashes = OrderedDict()  # blob name -> hash of the content last read or written
+        self.__write_stats = {"performed": 0, "skipped": 0}
 
         self.__initialized = False
 
+    def get_write_stats(self) -> Dict[str, int]:
+        """The number of blob uploads performed, and skipped because the content was unchanged."""
+        return dict(self.__write_stats)
+
+    async def close(self):
+        """Close the HTTP session shared by the blob operations."""
+        if self.__blob_service_client is not None:
+            await self.__blob_service_client.close()
+
     async def _initialize(self):
         if self.__initialized is False:
             # This should only happen once - assuming this is a singleton.
@@ -108,18 +144,26 @@ class BlobStorage(Storage):
 
         await self._initialize()
 
-        items = {}
+        results = await asyncio.gather(*(self._read_key(key) for key in keys))
 
-        for key in keys:
-            blob_client = self.__container_client.get_blob_client(key)
+        return {key: item for key, item in zip(keys, results) if item is not None}
 
+    async def _read_key(self, key: str) -> object:
+        blob_client = self.__container_client.get_blob_client(key)
+
+        async with self.__semaphore:
             try:
-                items[key] = await self._inner_read_blob(blob_client)
+                return await self._inner_read_blob(blob_client, key)
             except HttpResponseError as err:
                 if err.status_code == 404:
-                    continue
-
-        return items
+                    return None
+                # A read that is refused (e.g. 403 while the public network access is disabled) is not an absent
+                # item: the turn must fail rather than start from an empty state that then overwrites the stored one
+                self._on_data_plane_error(err)
+                raise
+            except Exception as err:
+                self._on_data_plane_error(err)
+                raise
 
     async def write(self, changes: Dict[str, object]):
         """Stores a new entity in the configured blob container.
@@ -135,26 +179,43 @@ class BlobStorage(Storage):
 
         await self._initialize()
 
-        for name, item in changes.items():
-            blob_reference = self.__container_client.get_blob_client(name)
-
-            e_tag = None
-            if isinstance(item, dict):
-                e_tag = item.get("e_tag", None)
-            elif hasattr(item, "e_tag"):
-                e_tag = item.e_tag
-            e_tag = None if e_tag == "*" else e_tag
-            if e_tag == "":
-                raise Exception("blob_storage.write(): etag missing")
+        await asyncio.gather(
+            *(self._write_item(name, item) for name, item in changes.items())
+        )
 
-            item_str = self._store_item_to_str(item)
+    async def _write_item(self, name: str, item: object):
+        blob_reference = self.__container_client.get_blob_client(name)
+
+        e_tag = None
+        if isinstance(item, dict):
+            e_tag = item.get("e_tag", None)
+        elif hasattr(item, "e_tag"):
+            e_tag = item.e_tag
+        e_tag = None if e_tag == "*" else e_tag
+        if e_tag == "":
+            raise Exception("blob_storage.write(): etag missing")
+
+        item_str = self._store_item_to_str(item)
+        content_hash = self._content_hash(item_str)
+        if self.__content_hashes.get(name) == content_hash:
+            # The stored blob already holds exactly this content
+            self.__write_stats["skipped"] += 1
+            return
 
-            if e_tag:
-                await blob_reference.upload_blob(
-                    item_str, match_condition=MatchConditions.IfNotModified, etag=e_tag
-                )
-            else:
-                await blob_reference.upload_blob(item_str, overwrite=True)
+        async with self.__semaphore:
+            try:
+                if e_tag:
+                    await blob_reference.upload_blob(
+                        item_str, match_condition=MatchConditions.IfNotModified, etag=e_tag
+                    )
+                else:
+                    await blob_reference.upload_blob(item_str, overwrite=True)
+            except Exception as err:
+                self.__content_hashes.pop(name, None)
+                self._on_data_plane_error(err)
+                raise
+        self.__write_stats["performed"] += 1
+        self._remember_content_hash(name, content_hash)
 
     async def delete(self, keys: List[str]):
         """Deletes entity blobs from the configured container.
@@ -168,6 +229,7 @@ class BlobStorage(Storage):
         await self._initialize()
 
         for key in keys:
+            self.__content_hashes.pop(key, None)
             blob_client = self.__container_client.get_blob_client(key)
             try:
                 await blob_client.delete_blob()
@@ -175,17 +237,35 @@ class BlobStorage(Storage):
             except ResourceNotFoundError:
                 pass
 
+    def _on_data_plane_error(self, error: Exception):
+        # A 403 or a network error usually means public network access to the account was switched off again,
+        # so the cached access state is dropped and re-checked on the next turn.
+        if is_access_error(error):
+            invalidate_blob_account_access(self.__account_name)
+
     def _store_item_to_str(self, item: object) -> str:
-        return encode(item)
+        return encode_state(item)
+
+    @staticmethod
+    def _content_hash(item_str: str) -> str:
+        return hashlib.sha256(item_str.encode("utf-8")).hexdigest()
+
+    def _remember_content_hash(self, name: str, content_hash: str):
+        self.__content_hashes[name] = content_hash
+        self.__content_hashes.move_to_end(name)
+        while len(self.__content_hashes) > self.__max_tracked_blobs:
+            self.__content_hashes.popitem(last=False)
 
-    async def _inner_read_blob(self, blob_client: BlobClient):
+    async def _inner_read_blob(self, blob_client: BlobClient, name: str):
         blob = await blob_client.download_blob()
+        item_str = await blob.content_as_text()
+        self._remember_content_hash(name, self._content_hash(item_str))
 
-        return await self._blob_to_store_item(blob)
+        return self._blob_to_store_item(item_str, blob.properties.etag)
 
     @staticmethod
-    async def _blob_to_store_item(blob: StorageStreamDownloader) -> object:
-        item = json.loads(await blob.content_as_text())
-        item["e_tag"] = blob.properties.etag.replace('"', "")
-        result = Unpickler().restore(item)
-        return result
\ No newline at end of file
+    def _blob_to_store_item(item_str: str, etag: str) -> object:
+        item = decode_state(item_str)
+        if isinstance(item, dict):
+            item["e_tag"] = etag.replace('"', "")
+        return item
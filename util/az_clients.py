@@ -0,0 +1,128 @@
+"""
+Process-wide registry of the Azure SDK and Azure OpenAI clients.
+
+A single DefaultAzureCredential is shared by all the clients, so that the credential chain is probed once and the
+access tokens are cached across calls. The clients are created on first use and keep their HTTP connection pools
+alive for the life of the process; close_clients() releases them on shutdown.
+"""
+import logging
+import threading
+
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+
+_clients = {}
+_lock = threading.RLock()
+
+
+def _get_or_create(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                logger.debug(f"Creating the shared client: {name}")
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def set_client(name: str, client):
+    """Register a client under the name, in place of the one the registry would create (e.g. a stub)."""
+    with _lock:
+        _clients[name] = client
+
+
+def get_credential() -> DefaultAzureCredential:
+    return _get_or_create("credential", DefaultAzureCredential)
+
+
+def get_openai_token_provider():
+    return _get_or_create(
+        "openai_token_provider",
+        lambda: get_bearer_token_provider(get_credential(), COGNITIVE_SERVICES_SCOPE),
+    )
+
+
+def get_openai_client():
+    """The Azure OpenAI client, used for the chat completions and the Assistants API."""
+
+    def create():
+        from openai import AzureOpenAI
+
+        return AzureOpenAI(
+            azure_endpoint=l_config.az_openai_endpoint,
+            azure_ad_token_provider=get_openai_token_provider(),
+            api_version=l_config.az_openai_api_version,
+        )
+
+    return _get_or_create("openai", create)
+
+
+def get_chat_llm():
+    """The LangChain chat model used by the agents in the graph."""
+
+    def create():
+        from langchain_openai import AzureChatOpenAI
+
+        return AzureChatOpenAI(
+            azure_endpoint=l_config.az_openai_endpoint,
+            azure_deployment=l_config.az_deployment_name,
+            azure_ad_token_provider=get_openai_token_provider(),
+            openai_api_type=l_config.az_api_type,
+            api_version=l_config.az_openai_api_version,
+            temperature=0.3,
+        )
+
+    return _get_or_create("chat_llm", create)
+
+
+def get_blob_service_client(account_url: str):
+    """The (synchronous) Blob service client for the account."""
+
+    def create():
+        from azure.storage.blob import BlobServiceClient
+
+        return BlobServiceClient(account_url=account_url, credential=get_credential())
+
+    return _get_or_create(f"blob:{account_url.rstrip('/')}", create)
+
+
+def get_storage_management_client(az_subscription_id: str):
+
+    def create():
+        from azure.mgmt.storage import StorageManagementClient
+
+        return StorageManagementClient(get_credential(), az_subscription_id)
+
+    return _get_or_create(f"storage_mgmt:{az_subscription_id}", create)
+
+
+def close_clients():
+    """Close the shared clients and their connection pools."""
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+    for name, client in clients:
+        close = getattr(client, "close", None)
+        if not callable(close):
+            continue
+        try:
+            close()
+        except Exception as e:
+            logger.warning(f"Error closing the shared client {name}: {str(e)}")
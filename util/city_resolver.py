@@ -0,0 +1,211 @@
+"""
+Offline resolution of the Innovation Hub location (city) the user enters, against DefaultConfig.hub_cities.
+
+The hub cities, and the aliases of the cities, are compiled once into an index of normalized names with their
+Soundex codes. The user input is matched exactly, then fuzzily (Damerau-Levenshtein distance and Soundex) against
+the index. An LLM is only needed when the input matches more than one hub city equally well.
+"""
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+# Common alternate names and spellings of the hub cities. An alias is only indexed when its city is a hub city.
+DEFAULT_CITY_ALIASES = {
+    "Bangalore": "Bengaluru",
+    "Bengaluru Karnataka": "Bengaluru",
+    "Bombay": "Mumbai",
+    "NYC": "New York",
+    "New York City": "New York",
+    "Manhattan": "New York",
+    "Bay Area": "Silicon Valley",
+    "Mountain View": "Silicon Valley",
+    "San Jose": "Silicon Valley",
+    "Santa Clara": "Silicon Valley",
+    "Palo Alto": "Silicon Valley",
+    "Saint Louis": "St. Louis",
+    "St Louis": "St. Louis",
+    "STL": "St. Louis",
+    "Washington DC": "Washington",
+    "DC": "Washington",
+    "Reston": "Washington",
+    "CDMX": "Mexico City",
+    "Ciudad de Mexico": "Mexico City",
+    "Sao Paolo": "Sao Paulo",
+    "Bruxelles": "Brussels",
+    "Brussel": "Brussels",
+    "Kobenhavn": "Copenhagen",
+    "Tel Aviv": "Herzliya",
+    "Herzelia": "Herzliya",
+    "Constantinople": "Istanbul",
+    "Joburg": "Johannesburg",
+    "Jozi": "Johannesburg",
+    "Milano": "Milan",
+    "Munchen": "Munich",
+    "Muenchen": "Munich",
+    "Warszawa": "Warsaw",
+    "Zuerich": "Zurich",
+    "Peking": "Beijing",
+    "Taipei City": "Taipei",
+    "Dallas Fort Worth": "Dallas",
+    "DFW": "Dallas",
+    "Philly": "Philadelphia",
+}
+
+# Words that are not part of a city name in the answers of the users, e.g. "I work at the Bengaluru hub"
+_FILLER_WORDS = {
+    "i", "im", "am", "a", "an", "the", "in", "at", "of", "from", "to", "is", "its", "it", "my", "our", "we",
+    "work", "working", "with", "based", "located", "location", "city", "hub", "innovation", "mtc", "center",
+    "centre", "microsoft", "please", "thanks", "thank", "you", "yes", "and", "or", "office",
+}
+
+_MAX_NGRAM = 3
+
+
+@dataclass
+class CityResolution:
+    """The hub city matched for the user input, or the equally good candidates when the match is ambiguous."""
+
+    city: str = None
+    candidates: list = field(default_factory=list)
+    method: str = "none"  # exact, alias, fuzzy, phonetic, or none
+
+    @property
+    def is_ambiguous(self) -> bool:
+        return self.city is None and len(self.candidates) > 1
+
+
+def normalize_text(text: str) -> str:
+    """Lower case, strip the accents (São Paulo -> sao paulo) and replace the punctuation with spaces."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def soundex(word: str) -> str:
+    codes = {}
+    for letters, digit in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")):
+        for letter in letters:
+            codes[letter] = digit
+    word = "".join(c for c in word.lower() if c.isalpha())
+    if not word:
+        return ""
+    result = word[0].upper()
+    previous = codes.get(word[0], "")
+    for c in word[1:]:
+        digit = codes.get(c, "")
+        if digit and digit != previous:
+            result += digit
+        if c not in "hw":
+            previous = digit
+    return (result + "000")[:4]
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Damerau-Levenshtein (optimal string alignment) distance."""
+    if a == b:
+        return 0
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+
+def _max_distance(length: int) -> int:
+    # Short names only match exactly, so that e.g. "also" does not resolve to Oslo
+    if length < 5:
+        return 0
+    if length < 8:
+        return 1
+    return 2
+
+
+class CityResolver:
+    """Resolve the user input to one of the hub cities, without a model call."""
+
+    def __init__(self, hub_cities: str, aliases: dict = None):
+        self.cities = [c.strip() for c in (hub_cities or "").split(",") if c.strip()]
+        self._index = {}  # normalized name (without spaces) -> (city, is_alias, soundex code)
+        for city in self.cities:
+            self._add(city, city, False)
+        city_keys = {self._key(city): city for city in self.cities}
+        for alias, city in {**DEFAULT_CITY_ALIASES, **(aliases or {})}.items():
+            target = city_keys.get(self._key(city))
+            if target:
+                self._add(alias, target, True)
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return normalize_text(name).replace(" ", "")
+
+    def _add(self, name: str, city: str, is_alias: bool):
+        key = self._key(name)
+        if key and key not in self._index:
+            self._index[key] = (city, is_alias, soundex(key))
+
+    def _phrases(self, text: str) -> list:
+        """The whole input, and its word n-grams that are not made only of filler words, as index keys."""
+        words = normalize_text(text).split()
+        phrases = ["".join(words)] if words else []
+        for size in range(min(_MAX_NGRAM, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                ngram = words[start:start + size]
+                if all(w in _FILLER_WORDS for w in ngram):
+                    continue
+                phrases.append("".join(ngram))
+        return list(dict.fromkeys(phrases))
+
+    def resolve(self, text: str) -> CityResolution:
+        phrases = self._phrases(text or "")
+        if not phrases:
+            return CityResolution()
+
+        exact = {}
+        for phrase in phrases:
+            if phrase in self._index:
+                city, is_alias, _ = self._index[phrase]
+                exact.setdefault(city, "alias" if is_alias else "exact")
+        if len(exact) == 1:
+            city, method = next(iter(exact.items()))
+            return CityResolution(city=city, candidates=[city], method=method)
+        if exact:
+            return CityResolution(candidates=sorted(exact))
+
+        # Fuzzy matching: the lowest edit distance within the tolerance for the length of the name
+        best_score, best = None, {}
+        for phrase in phrases:
+            phrase_code = soundex(phrase)
+            for key, (city, _, code) in self._index.items():
+                # Names that sound alike are tolerated a larger distance (e.g. "Bengalooru")
+                tolerance = max(_max_distance(len(key)), len(key) // 3 if len(key) >= 5 and code == phrase_code else 0)
+                if abs(len(phrase) - len(key)) > tolerance:
+                    continue
+                distance = edit_distance(phrase, key)
+                if distance > tolerance:
+                    continue
+                method = "fuzzy" if distance <= _max_distance(len(key)) else "phonetic"
+                if best_score is None or distance < best_score:
+                    best_score, best = distance, {city: method}
+                elif distance == best_score:
+                    best.setdefault(city, method)
+
+        if len(best) == 1:
+            city, method = next(iter(best.items()))
+            return CityResolution(city=city, candidates=[city], method=method)
+        return CityResolution(candidates=sorted(best))
+
+
+def parse_city_aliases(value: str) -> dict:
+    """Parse aliases configured as 'Alias=City, Alias=City'."""
+    aliases = {}
+    for pair in (value or "").split(","):
+        if "=" in pair:
+            alias, city = pair.split("=", 1)
+            if alias.strip() and city.strip():
+                aliases[alias.strip()] = city.strip()
+    return aliases
@@ -0,0 +1,249 @@
+"""
+Context management for the messages the agents in the graph send to the model.
+
+The messages in the graph State are kept in full by the checkpointer. What is sent to the model on each hop is:
+- a summary of the earlier stages of the conversation, created when a stage completes (see summarize_messages)
+- the pinned artifacts: the confirmed engagement goals and the latest agenda, verbatim
+- the messages of the earlier turns, most recent first, that fit in the token budget
+- the messages of the current turn, in full
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+from util.graph_metrics import record_llm_usage
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+GOALS_MARKER = "### Engagement Goals Confirmation Message ###"
+AGENDA_MARKER = "### Innovation Hub Engagement Agenda ###"
+
+# The per message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# The time after which the load of the encoding is attempted again, when it failed
+ENCODING_RETRY_SECONDS = 300
+
+_encoding = None
+_encoding_loading = False
+_encoding_failed_at = None
+_encoding_lock = threading.Lock()
+_token_counts = OrderedDict()  # message id -> token count
+_token_counts_lock = threading.Lock()  # the graph turns of the conversations count tokens on several threads
+_MAX_CACHED_COUNTS = 20000
+
+
+def load_encoding():
+    """
+    Load the tiktoken encoding, from the directory of tiktoken_cache_dir when it is set, else from the tiktoken cache
+    or the download of the encoding file. Blocks until it is loaded (the download has no timeout), hence is called at
+    startup by the warm up of the graph, or on a background thread; never on the path of a turn.
+
+    Returns the encoding, or None when the token counts are estimated (token_counter), the encoding is being loaded by
+    another thread or its load failed.
+    """
+    global _encoding, _encoding_loading, _encoding_failed_at
+    if l_config.token_counter != "tiktoken":
+        return None
+    with _encoding_lock:
+        if _encoding is not None or _encoding_loading:
+            return _encoding
+        _encoding_loading = True
+    try:
+        if l_config.tiktoken_cache_dir:
+            os.environ["TIKTOKEN_CACHE_DIR"] = l_config.tiktoken_cache_dir
+        import tiktoken
+
+        start = time.perf_counter()
+        encoding = tiktoken.get_encoding("o200k_base")
+        logger.info(f"tiktoken encoding loaded in {(time.perf_counter() - start) * 1000:.0f} ms")
+    except Exception as e:
+        logger.warning(
+            f"tiktoken is not available, token counts are estimated and the load is retried in {ENCODING_RETRY_SECONDS} s: {str(e)}"
+        )
+        with _encoding_lock:
+            _encoding_failed_at = time.monotonic()
+            _encoding_loading = False
+        return None
+    with _encoding_lock:
+        _encoding = encoding
+        _encoding_loading = False
+    return encoding
+
+
+def _get_encoding():
+    """The tiktoken encoding once it is loaded, else None: the token counts are then estimated, and the encoding is
+    loaded on a background thread, unless its last load failed less than ENCODING_RETRY_SECONDS ago."""
+    if _encoding is not None or l_config.token_counter != "tiktoken":
+        return _encoding
+    with _encoding_lock:
+        if _encoding_loading or (
+            _encoding_failed_at is not None and time.monotonic() - _encoding_failed_at < ENCODING_RETRY_SECONDS
+        ):
+            return None
+    threading.Thread(target=load_encoding, name="tiktoken-encoding", daemon=True).start()
+    return None
+
+
+def _message_text(message) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = " ".join(
+            part.get("text", "") if isinstance(part, dict) else str(part) for part in content
+        )
+    text = content or ""
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        text += f" {tool_call.get('name', '')} {tool_call.get('args', '')}"
+    return text
+
+
+def count_tokens(message) -> int:
+    message_id = getattr(message, "id", None)
+    if message_id:
+        with _token_counts_lock:
+            count = _token_counts.get(message_id)
+        if count is not None:
+            return count
+
+    text = _message_text(message)
+    encoding = _get_encoding()
+    count = (len(encoding.encode(text)) if encoding else len(text) // 4) + MESSAGE_OVERHEAD_TOKENS
+
+    # The estimates made while the encoding is not loaded yet are not kept, the message is counted again once it is
+    if message_id and (encoding or l_config.token_counter != "tiktoken"):
+        with _token_counts_lock:
+            _token_counts[message_id] = count
+            if len(_token_counts) > _MAX_CACHED_COUNTS:
+                _token_counts.popitem(last=False)
+    return count
+
+
+def count_messages_tokens(messages: list) -> int:
+    return sum(count_tokens(m) for m in messages)
+
+
+def _contains_marker(message, marker: str) -> bool:
+    if isinstance(message.content, str) and marker in message.content:
+        return True
+    return any(marker in str(tc.get("args", "")) for tc in getattr(message, "tool_calls", None) or [])
+
+
+def find_pinned_messages(messages: list) -> list:
+    """The latest messages with the confirmed engagement goals and with the agenda, in the order of the conversation."""
+    positions = set()
+    for marker in (GOALS_MARKER, AGENDA_MARKER):
+        for index in range(len(messages) - 1, -1, -1):
+            if _contains_marker(messages[index], marker):
+                positions.add(index)
+                break
+    return [messages[index] for index in sorted(positions)]
+
+
+def _last_human_index(messages: list) -> int:
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return index
+    return 0
+
+
+def _index_of(messages: list, message_id: str) -> int:
+    if message_id:
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].id == message_id:
+                return index
+    return -1
+
+
+def _preamble(summary: str, pinned: list) -> list:
+    parts = []
+    if summary:
+        parts.append(f"Summary of the conversation so far:\n{summary}")
+    for message in pinned:
+        parts.append(f"Confirmed earlier in the conversation:\n{_message_text(message)}")
+    return [SystemMessage(content="\n\n".join(parts))] if parts else []
+
+
+def build_context(
+    messages: list, summary: str = None, summarized_message_id: str = None, max_tokens: int = None
+) -> list:
+    """
+    The messages to send to the model for the conversation, within the max_tokens budget (0 disables the trimming).
+    The messages of the current turn, from the last message of the user, are always sent.
+    """
+    max_tokens = l_config.graph_context_max_tokens if max_tokens is None else max_tokens
+    if not max_tokens or not messages:
+        return messages
+
+    current_start = _last_human_index(messages)
+    current_turn = messages[current_start:]
+    earlier = messages[_index_of(messages, summarized_message_id) + 1:current_start]
+    if not summary and count_messages_tokens(messages) <= max_tokens:
+        return messages
+
+    pinned = find_pinned_messages(messages[:current_start])
+    budget = (
+        max_tokens
+        - count_messages_tokens(current_turn)
+        - count_messages_tokens(_preamble(summary, pinned))
+    )
+    kept = []
+    for message in reversed(earlier):
+        cost = count_tokens(message)
+        if cost > budget:
+            break
+        budget -= cost
+        kept.insert(0, message)
+    # Start on a message of the user, so that no tool message is sent without the tool call it answers
+    while kept and not isinstance(kept[0], HumanMessage):
+        kept.pop(0)
+
+    kept_ids = {id(m) for m in kept}
+    preamble = _preamble(summary, [m for m in pinned if id(m) not in kept_ids])
+    context = preamble + kept + current_turn
+    logger.debug(
+        f"Context of {len(messages)} messages trimmed to {len(context)} messages, "
+        f"{count_messages_tokens(context)} tokens (budget {max_tokens})"
+    )
+    return context
+
+
+def summarize_messages(llm, messages: list, previous_summary: str = None) -> str:
+    """Summarize the messages of a completed stage of the conversation, extending the previous summary."""
+    transcript = []
+    for message in messages:
+        if isinstance(message, ToolMessage):
+            continue
+        role = "User" if isinstance(message, HumanMessage) else "Assistant" if isinstance(message, AIMessage) else "System"
+        text = _message_text(message)
+        if text.strip():
+            transcript.append(f"{role}: {text}")
+
+    instructions = (
+        "Summarize the conversation below between a Technical Architect of the Microsoft Innovation Hub and "
+        "the assistant that helps them prepare an engagement agenda. Keep the customer name, engagement type, "
+        "dates, participants, confirmed decisions, open questions and the current stage of the work. Omit the "
+        "content of the briefing notes, the engagement goals and the agenda tables; they are kept separately. "
+        "Answer with the summary only, in at most 200 words."
+    )
+    if previous_summary:
+        instructions += f"\n\nExtend this summary of the earlier conversation:\n{previous_summary}"
+    response = llm.invoke(
+        [SystemMessage(content=instructions), HumanMessage(content="\n\n".join(transcript))]
+    )
+    record_llm_usage(response)
+    return response.content
@@ -0,0 +1,207 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import MemorySaver
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+
+class BoundedMemorySaver(MemorySaver):
+    """An in-process LangGraph checkpointer that evicts idle graph threads.
+
+    Every checkpoint written for a thread marks it as recently used. Threads that are idle beyond the TTL,
+    and the least recently used threads beyond max_threads, are deleted along with their checkpoints and writes.
+
+    :param max_threads: The maximum number of graph threads retained in memory.
+    :type max_threads: int
+    :param ttl_seconds: The idle time after which a graph thread is evicted.
+    :type ttl_seconds: int
+    """
+
+    def __init__(self, max_threads: int, ttl_seconds: int, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.ttl_seconds = ttl_seconds
+        self._last_access = OrderedDict()  # thread id -> last access time, least recently used first
+        self._access_lock = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config["configurable"]["thread_id"])
+        return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        super().put_writes(config, writes, task_id, task_path)
+        self._touch(config["configurable"]["thread_id"])
+
+    def _touch(self, thread_id: str):
+        now = time.monotonic()
+        with self._access_lock:
+            self._last_access[thread_id] = now
+            self._last_access.move_to_end(thread_id)
+            evicted = []
+            for l_thread_id, last_access in self._last_access.items():
+                if (
+                    len(self._last_access) - len(evicted) > self.max_threads
+                    or now - last_access > self.ttl_seconds
+                ):
+                    evicted.append(l_thread_id)
+                else:
+                    break
+            for l_thread_id in evicted:
+                del self._last_access[l_thread_id]
+        for l_thread_id in evicted:
+            self.delete_thread(l_thread_id)
+        if evicted:
+            logger.debug(f"Evicted {len(evicted)} idle graph threads from the checkpointer")
+
+    def thread_memory_usage(self, thread_id: str) -> int:
+        """The number of bytes of serialized checkpoints, channel values and pending writes held for the thread."""
+        size = 0
+        for checkpoints in list(self.storage.get(thread_id, {}).values()):
+            for checkpoint, metadata, _ in list(checkpoints.values()):
+                size += len(checkpoint[1]) + len(metadata[1])
+        for key, value in list(self.blobs.items()):
+            if key[0] == thread_id:
+                size += len(value[1])
+        for key, writes in list(self.writes.items()):
+            if key[0] == thread_id:
+                size += sum(len(write[2][1]) for write in writes.values())
+        return size
+
+    def memory_usage_by_thread(self) -> dict:
+        return {
+            thread_id: self.thread_memory_usage(thread_id)
+            for thread_id in list(self._last_access.keys())
+        }
+
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:  # the on-disk store is optional
+    SqliteSaver = None
+
+
+if SqliteSaver is not None:
+
+    class BoundedSqliteSaver(SqliteSaver):
+        """An SQLite backed LangGraph checkpointer that evicts idle graph threads.
+
+        The last access time of each thread is kept in the database alongside the checkpoints, so that
+        app instances sharing the database file also share the eviction decisions.
+        Eviction runs after every sweep_interval checkpoint writes.
+        """
+
+        def __init__(
+            self,
+            conn: sqlite3.Connection,
+            max_threads: int,
+            ttl_seconds: int,
+            sweep_interval: int = 50,
+            **kwargs,
+        ):
+            super().__init__(conn, **kwargs)
+            self.max_threads = max_threads
+            self.ttl_seconds = ttl_seconds
+            self.sweep_interval = sweep_interval
+            self._writes_since_sweep = 0
+
+        def setup(self) -> None:
+            if self.is_setup:
+                return
+            super().setup()
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS thread_access (
+                    thread_id TEXT PRIMARY KEY,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self.conn.commit()
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._touch(config["configurable"]["thread_id"])
+            return result
+
+        def _touch(self, thread_id: str):
+            with self.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO thread_access (thread_id, last_access) VALUES (?, ?) "
+                    "ON CONFLICT(thread_id) DO UPDATE SET last_access = excluded.last_access",
+                    (thread_id, time.time()),
+                )
+            self._writes_since_sweep += 1
+            if self._writes_since_sweep >= self.sweep_interval:
+                self._writes_since_sweep = 0
+                self.evict_idle_threads()
+
+        def evict_idle_threads(self) -> int:
+            with self.cursor() as cur:
+                cur.execute(
+                    "SELECT thread_id FROM thread_access WHERE last_access < ? "
+                    "UNION SELECT thread_id FROM "
+                    "(SELECT thread_id FROM thread_access ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (time.time() - self.ttl_seconds, self.max_threads),
+                )
+                evicted = [row[0] for row in cur.fetchall()]
+            for thread_id in evicted:
+                self.delete_thread(thread_id)
+                with self.cursor() as cur:
+                    cur.execute("DELETE FROM thread_access WHERE thread_id = ?", (thread_id,))
+            if evicted:
+                logger.debug(f"Evicted {len(evicted)} idle graph threads from the checkpoint database")
+            return len(evicted)
+
+        def thread_memory_usage(self, thread_id: str) -> int:
+            """The number of bytes of serialized checkpoints and pending writes stored for the thread."""
+            with self.cursor(transaction=False) as cur:
+                cur.execute(
+                    "SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints WHERE thread_id = ?",
+                    (thread_id,),
+                )
+                size = cur.fetchone()[0]
+                cur.execute(
+                    "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes WHERE thread_id = ?",
+                    (thread_id,),
+                )
+                return size + cur.fetchone()[0]
+
+        def memory_usage_by_thread(self) -> dict:
+            with self.cursor(transaction=False) as cur:
+                cur.execute("SELECT thread_id FROM thread_access")
+                thread_ids = [row[0] for row in cur.fetchall()]
+            return {thread_id: self.thread_memory_usage(thread_id) for thread_id in thread_ids}
+
+
+def build_checkpointer(config: DefaultConfig = l_config):
+    """
+    Create the graph checkpointer configured through graph_checkpointer: 'memory' (default) or 'sqlite'.
+    """
+    max_threads = config.graph_max_threads
+    ttl_seconds = config.graph_thread_ttl_minutes * 60
+    if config.graph_checkpointer == "sqlite":
+        if SqliteSaver is None:
+            raise ImportError(
+                "graph_checkpointer is set to 'sqlite', but langgraph-checkpoint-sqlite is not installed"
+            )
+        logger.debug(f"Using the SQLite graph checkpointer at {config.graph_checkpoint_db_path}")
+        conn = sqlite3.connect(config.graph_checkpoint_db_path, check_same_thread=False)
+        return BoundedSqliteSaver(conn, max_threads=max_threads, ttl_seconds=ttl_seconds)
+    return BoundedMemorySaver(max_threads=max_threads, ttl_seconds=ttl_seconds)
@@ -0,0 +1,245 @@
+"""
+Latency and token accounting for the nodes of the LangGraph graph, per node and per conversation.
+
+Each node of the graph is wrapped with instrument_node(). A node run records its wall time, the prompt and completion
+tokens of the model calls made in it (see record_llm_usage), the retries of the Assistant 'Respond with a real
+output' loop, and the duration of each tool called. Each run is logged with custom dimensions through the
+AzureLogHandler, and aggregated in process for the stats endpoint (see snapshot).
+"""
+import contextvars
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from langchain_core.runnables import Runnable
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+# The number of recent latencies kept per node and per tool, for the percentiles
+LATENCY_SAMPLES = 1000
+MAX_TRACKED_CONVERSATIONS = 1000
+
+_current_run = contextvars.ContextVar("graph_node_run", default=None)
+
+
+class _NodeRun:
+    def __init__(self, node: str):
+        self.node = node
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.retries = 0
+
+
+class _Aggregate:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.retries = 0
+
+    def add(self, duration_ms: float, error: bool, run: _NodeRun = None):
+        self.count += 1
+        self.errors += int(error)
+        self.total_ms += duration_ms
+        self.latencies.append(duration_ms)
+        if run is not None:
+            self.prompt_tokens += run.prompt_tokens
+            self.cached_prompt_tokens += run.cached_prompt_tokens
+            self.completion_tokens += run.completion_tokens
+            self.llm_calls += run.llm_calls
+            self.retries += run.retries
+
+    def to_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms),
+            "p50_ms": round(_percentile(latencies, 50)),
+            "p95_ms": round(_percentile(latencies, 95)),
+            "max_ms": round(latencies[-1]) if latencies else 0,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            # The share of the prompt tokens served from the prompt cache of the model service
+            "prompt_cache_hit_ratio": round(self.cached_prompt_tokens / self.prompt_tokens, 3) if self.prompt_tokens else None,
+            "completion_tokens": self.completion_tokens,
+            "llm_calls": self.llm_calls,
+            "retries": self.retries,
+        }
+
+
+def _percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+    rank = min(len(values) - 1, max(0, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+class GraphMetrics:
+    """In-process aggregates of the node runs and tool calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes = {}
+        self._tools = {}
+        self._conversations = OrderedDict()  # graph thread id -> _Aggregate, least recently updated first
+        self.started_at = time.time()
+
+    def record_node(self, node: str, conversation_id: str, duration_ms: float, error: bool, run: _NodeRun):
+        with self._lock:
+            self._nodes.setdefault(node, _Aggregate()).add(duration_ms, error, run)
+            if conversation_id:
+                conversation = self._conversations.pop(conversation_id, None) or _Aggregate()
+                conversation.add(duration_ms, error, run)
+                self._conversations[conversation_id] = conversation
+                if len(self._conversations) > MAX_TRACKED_CONVERSATIONS:
+                    self._conversations.popitem(last=False)
+
+    def record_tool(self, tool_name: str, duration_ms: float, error: bool):
+        with self._lock:
+            self._tools.setdefault(tool_name, _Aggregate()).add(duration_ms, error)
+
+    def snapshot(self, top_conversations: int = 10) -> dict:
+        with self._lock:
+            nodes = {name: agg.to_dict() for name, agg in self._nodes.items()}
+            tools = {name: agg.to_dict() for name, agg in self._tools.items()}
+            conversations = sorted(
+                ((cid, agg.to_dict()) for cid, agg in self._conversations.items()),
+                key=lambda item: item[1]["prompt_tokens"] + item[1]["completion_tokens"],
+                reverse=True,
+            )
+        return {
+            "uptime_seconds": round(time.time() - self.started_at),
+            "nodes": nodes,
+            "tools": tools,
+            "conversations_tracked": len(conversations),
+            "top_conversations_by_tokens": dict(conversations[:top_conversations]),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._nodes.clear()
+            self._tools.clear()
+            self._conversations.clear()
+            self.started_at = time.time()
+
+
+graph_metrics = GraphMetrics()
+
+
+def record_llm_usage(message):
+    """Add the token usage of a model response to the node run in progress."""
+    run = _current_run.get()
+    if run is None:
+        return
+    run.llm_calls += 1
+    usage = getattr(message, "usage_metadata", None) or {}
+    run.prompt_tokens += usage.get("input_tokens", 0) or 0
+    run.cached_prompt_tokens += (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    run.completion_tokens += usage.get("output_tokens", 0) or 0
+
+
+def record_retry():
+    """Count a retry of the model call in the node run in progress."""
+    run = _current_run.get()
+    if run is not None:
+        run.retries += 1
+
+
+def current_run_tokens() -> int:
+    """The prompt and completion tokens of the model calls made so far in the node run in progress."""
+    run = _current_run.get()
+    return run.prompt_tokens + run.completion_tokens if run is not None else 0
+
+
+def _conversation_id(config) -> str:
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+def _accepts_config(node) -> bool:
+    target = node.__call__ if not inspect.isfunction(node) and not inspect.ismethod(node) else node
+    try:
+        return "config" in inspect.signature(target).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def instrument_node(name: str, node):
+    """
+    Wrap a graph node (a function or callable taking the state, and optionally the config), or a Runnable such as
+    a ToolNode, so that each of its runs is timed, logged and aggregated.
+    """
+    is_runnable = isinstance(node, Runnable)
+    pass_config = is_runnable or _accepts_config(node)
+
+    def instrumented(state, config):
+        run = _NodeRun(name)
+        token = _current_run.set(run)
+        tool_names = []
+        if is_runnable:
+            last_message = state["messages"][-1] if state.get("messages") else None
+            tool_names = [tc["name"] for tc in getattr(last_message, "tool_calls", None) or []]
+        start = time.perf_counter()
+        error = False
+        try:
+            if is_runnable:
+                return node.invoke(state, config)
+            return node(state, config) if pass_config else node(state)
+        except Exception:
+            error = True
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            _current_run.reset(token)
+            conversation_id = _conversation_id(config)
+            graph_metrics.record_node(name, conversation_id, duration_ms, error, run)
+            for tool_name in tool_names:
+                # The tool calls of a tool node run in parallel, each is accounted the duration of the node
+                graph_metrics.record_tool(tool_name, duration_ms, error)
+            _log_node_run(name, conversation_id, duration_ms, error, run, tool_names)
+
+    instrumented.__name__ = name
+    return instrumented
+
+
+def _log_node_run(name, conversation_id, duration_ms, error, run, tool_names):
+    logger.info(
+        f"Graph node {name} ran in {duration_ms:.0f} ms, tokens: {run.prompt_tokens} prompt, "
+        f"{run.completion_tokens} completion",
+        extra={
+            "custom_dimensions": {
+                "metric": "graph_node_run",
+                "graph_node": name,
+                "graph_thread_id": conversation_id,
+                "node_duration_ms": round(duration_ms),
+                "node_error": error,
+                "llm_calls": run.llm_calls,
+                "llm_prompt_tokens": run.prompt_tokens,
+                "llm_cached_prompt_tokens": run.cached_prompt_tokens,
+                "llm_completion_tokens": run.completion_tokens,
+                "llm_retries": run.retries,
+                "tools": ",".join(tool_names),
+            }
+        },
+    )
@@ -0,0 +1,68 @@
+import asyncio
+import contextlib
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+
+class GraphTurnExecutor:
+    """Runs the synchronous LangGraph turns off the aiohttp event loop.
+
+    The turns execute on a bounded pool of worker threads, so that at most max_concurrent_turns graph
+    turns run at the same time, and a long agenda generation for one user does not stall the other conversations.
+    Turns belonging to the same conversation are serialized, and run in the order in which they were received: the
+    bot holds the conversation (see conversation) from the load of the conversation state to its save, so that a turn
+    reads the state saved by the previous one.
+
+    :param max_concurrent_turns: The number of graph turns that can run in parallel, across all conversations.
+    :type max_concurrent_turns: int
+    """
+
+    def __init__(self, max_concurrent_turns: int):
+        if max_concurrent_turns < 1:
+            raise ValueError("max_concurrent_turns must be at least 1")
+        self.max_concurrent_turns = max_concurrent_turns
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_turns, thread_name_prefix="graph-turn"
+        )
+        # conversation id -> [lock, number of turns holding or waiting on the lock]
+        self._conversation_locks = {}
+
+    @contextlib.asynccontextmanager
+    async def conversation(self, conversation_id: str):
+        """Hold the conversation for a turn, from the load of its state to its save, after the earlier turns of the
+        conversation have completed. The turns waiting on the conversation are let in in the order they were received."""
+        entry = self._conversation_locks.setdefault(conversation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                # no other turn of this conversation is pending, release the lock
+                self._conversation_locks.pop(conversation_id, None)
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the worker pool. The caller holds the conversation of the turn."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        logger.debug("Shutting down the graph turn executor")
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,353 @@
+"""
+Retries of the calls to the Azure services, shared by the Storage operations of the bot and the graph tools.
+
+A RetryPolicy retries a failed call after a jittered exponential backoff, until the call succeeds, the error is not
+retryable, the attempts are used up or the deadline of the operation is reached. A RetryBudget shared by the
+policies caps the share of the calls that are retries, so that an outage is not amplified by every conversation
+retrying at once. A CircuitBreaker per operation fails the calls fast, for a reset period, once the operation has
+failed repeatedly.
+
+retry_async waits with asyncio.sleep, and runs synchronous operations on the default executor, so it never blocks the
+event loop. retry_call is its synchronous counterpart, for the code that already runs on a worker thread (the tools
+of the graph).
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+
+class CircuitOpenError(Exception):
+    """The operation has failed repeatedly and is not attempted until the circuit breaker resets."""
+
+
+class RetryBudget:
+    """A token bucket of retries, shared by the policies that use it.
+
+    Each operation deposits ratio tokens and each retry withdraws one, so that in the long run at most ratio
+    retries are made per operation. The bucket starts full, which allows a burst of max_tokens retries.
+
+    :param ratio: The retries allowed per operation.
+    :type ratio: float
+    :param max_tokens: The size of the bucket.
+    :type max_tokens: float
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tokens": round(self._tokens, 2), "exhausted": self.exhausted}
+
+
+class CircuitBreaker:
+    """Fails the calls of an operation fast once it has failed failure_threshold times in a row.
+
+    After reset_seconds, a single trial call is let through (half open): its success closes the circuit, its failure
+    opens it again.
+
+    :param name: The name of the operation, used in the logs.
+    :type name: str
+    :param failure_threshold: The consecutive failures that open the circuit.
+    :type failure_threshold: int
+    :param reset_seconds: The time the circuit stays open before a trial call.
+    :type reset_seconds: float
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def before_call(self):
+        """Raises CircuitOpenError when the call is not allowed."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self.reset_seconds and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f"The circuit of '{self.name}' is open after {self._failures} consecutive failures")
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"The circuit of '{self.name}' is closed again")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+                logger.warning(f"The circuit of '{self.name}' is open for {self.reset_seconds} s after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Let another call be the trial, when the trial call was abandoned (e.g. its task was cancelled) and neither
+        succeeded nor failed."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self._failures, "rejected": self.rejected}
+
+
+class RetryPolicy:
+    """How the calls of an operation are retried.
+
+    The delay before retry n is drawn between half and all of min(max_delay_seconds, base_delay_seconds * 2 ** (n - 1)),
+    so that the callers that failed together do not retry together.
+
+    :param name: The name of the operation, used in the logs.
+    :type name: str
+    :param max_attempts: The attempts made, the first one included.
+    :type max_attempts: int
+    :param base_delay_seconds: The delay before the first retry, before the jitter.
+    :type base_delay_seconds: float
+    :param max_delay_seconds: The largest delay between two attempts.
+    :type max_delay_seconds: float
+    :param deadline_seconds: The time after which the operation is not retried, counted from the first attempt.
+    :type deadline_seconds: float
+    :param retry_if: Whether a call that failed with the error is retried; by default all the errors are.
+    :type retry_if: Callable[[Exception], bool]
+    :param budget: The retry budget shared with other policies, if any.
+    :type budget: RetryBudget
+    :param breaker: The circuit breaker of the operation, if any.
+    :type breaker: CircuitBreaker
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 3,
+        base_delay_seconds: float = 1.0,
+        max_delay_seconds: float = 30.0,
+        deadline_seconds: float = 60.0,
+        retry_if=None,
+        budget: RetryBudget = None,
+        breaker: CircuitBreaker = None,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.deadline_seconds = deadline_seconds
+        self.retry_if = retry_if
+        self.budget = budget
+        self.breaker = breaker
+
+    def backoff(self, retry: int) -> float:
+        ceiling = min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (retry - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class _Attempts:
+    """The state of one retried operation, shared by retry_call and retry_async."""
+
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.number = 0
+        self.started = time.monotonic()
+        if policy.budget is not None:
+            policy.budget.deposit()
+
+    def remaining_seconds(self) -> float:
+        return self.policy.deadline_seconds - (time.monotonic() - self.started)
+
+    def begin(self):
+        if self.policy.breaker is not None:
+            self.policy.breaker.before_call()
+        self.number += 1
+
+    def succeeded(self):
+        if self.policy.breaker is not None:
+            self.policy.breaker.record_success()
+
+    def abandoned(self):
+        if self.policy.breaker is not None:
+            self.policy.breaker.release_trial()
+
+    def failed(self, error: Exception) -> float:
+        """The delay before the next attempt, or None when the error is to be raised."""
+        policy = self.policy
+        if policy.retry_if is not None and not policy.retry_if(error):
+            # A definite answer of the service (e.g. not found), not a failure of the operation
+            if policy.breaker is not None:
+                policy.breaker.record_success()
+            return None
+        if policy.breaker is not None:
+            policy.breaker.record_failure()
+        if self.number >= policy.max_attempts:
+            logger.error(f"{policy.name}: all {policy.max_attempts} attempts failed: {str(error)}")
+            return None
+        delay = policy.backoff(self.number)
+        if delay > self.remaining_seconds():
+            logger.error(f"{policy.name}: attempt {self.number} failed and the deadline of {policy.deadline_seconds} s is reached: {str(error)}")
+            return None
+        if policy.budget is not None and not policy.budget.withdraw():
+            logger.warning(f"{policy.name}: attempt {self.number} failed and the retry budget is exhausted: {str(error)}")
+            return None
+        logger.info(f"{policy.name}: attempt {self.number} of {policy.max_attempts} failed, retrying in {delay:.1f} s: {str(error)}")
+        return delay
+
+
+def retry_call(policy: RetryPolicy, operation, *args, on_retry=None, **kwargs):
+    """Call operation(*args, **kwargs) under the policy, waiting on the calling thread between the attempts.
+
+    on_retry(error), when given, is called before each retry, e.g. to restore the access the call failed on.
+    """
+    attempts = _Attempts(policy)
+    while True:
+        attempts.begin()
+        try:
+            result = operation(*args, **kwargs)
+        except Exception as e:
+            delay = attempts.failed(e)
+            if delay is None:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(delay)
+            continue
+        except BaseException:
+            # e.g. KeyboardInterrupt, the attempt neither succeeded nor failed
+            attempts.abandoned()
+            raise
+        attempts.succeeded()
+        return result
+
+
+async def retry_async(policy: RetryPolicy, operation, *args, on_retry=None, **kwargs):
+    """Await operation(*args, **kwargs) under the policy, without blocking the event loop.
+
+    A synchronous operation runs on the default executor. Each attempt is abandoned when the deadline of the operation
+    is reached (asyncio.TimeoutError). on_retry(error), when given, is awaited before each retry when it is a
+    coroutine function, else called on the executor.
+    """
+    loop = asyncio.get_running_loop()
+
+    def start():
+        if inspect.iscoroutinefunction(operation):
+            return operation(*args, **kwargs)
+        return loop.run_in_executor(None, functools.partial(operation, *args, **kwargs))
+
+    attempts = _Attempts(policy)
+    while True:
+        attempts.begin()
+        try:
+            result = await asyncio.wait_for(start(), timeout=max(0.0, attempts.remaining_seconds()))
+        except asyncio.TimeoutError:
+            if policy.breaker is not None:
+                policy.breaker.record_failure()
+            logger.error(f"{policy.name}: the deadline of {policy.deadline_seconds} s is reached")
+            raise
+        except Exception as e:
+            delay = attempts.failed(e)
+            if delay is None:
+                raise
+            if on_retry is not None:
+                if inspect.iscoroutinefunction(on_retry):
+                    await on_retry(e)
+                else:
+                    await loop.run_in_executor(None, on_retry, e)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # The task is cancelled (e.g. at shutdown), the attempt neither succeeded nor failed
+            attempts.abandoned()
+            raise
+        attempts.succeeded()
+        return result
+
+
+# The retry budget of the calls to the Storage Account, and the circuit breakers of its operations
+storage_retry_budget = RetryBudget(l_config.az_storage_retry_budget_ratio)
+_breakers = {}
+_breakers_guard = threading.Lock()
+
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    """The circuit breaker of the operation, created on first use with the settings of DefaultConfig."""
+    with _breakers_guard:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=l_config.az_storage_circuit_failure_threshold,
+                reset_seconds=l_config.az_storage_circuit_reset_seconds,
+            )
+        return _breakers[name]
+
+
+def storage_retry_policy(name: str, retry_if=None) -> RetryPolicy:
+    """The retry policy of a Storage operation, with the settings of DefaultConfig, the shared budget and its breaker."""
+    return RetryPolicy(
+        name,
+        max_attempts=l_config.az_storage_retry_max_attempts,
+        base_delay_seconds=l_config.az_storage_retry_base_delay_seconds,
+        max_delay_seconds=l_config.az_storage_retry_max_delay_seconds,
+        deadline_seconds=l_config.az_storage_retry_deadline_seconds,
+        retry_if=retry_if,
+        budget=storage_retry_budget,
+        breaker=circuit_breaker(name),
+    )
+
+
+def retry_stats() -> dict:
+    """The state of the retry budget and of the circuit breakers, for the stats endpoint."""
+    with _breakers_guard:
+        breakers = dict(_breakers)
+    return {
+        "budget": storage_retry_budget.stats(),
+        "circuits": {name: breaker.stats() for name, breaker in breakers.items()},
+    }
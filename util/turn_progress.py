@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+
+from botbuilder.core import TurnContext
+from botbuilder.schema import Activity, ActivityTypes, ResourceResponse
+from opencensus.ext.azure.log_exporter import AzureLogHandler
+from config import DefaultConfig
+
+l_config = DefaultConfig()
+
+logger = logging.getLogger(__name__)
+logger.addHandler(
+    AzureLogHandler(connection_string=l_config.az_application_insights_key)
+)
+
+# Set the logging level based on the configuration
+log_level_str = l_config.log_level.upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+logger.setLevel(log_level)
+
+# The channels show the typing indicator for a few seconds after a typing activity, it is repeated while the turn runs
+TYPING_INTERVAL_SECONDS = 3.0
+
+# The status shown to the user once a node of the graph has completed, for the work that follows it
+NODE_STATUS = {
+    "enter_notes_extraction": "Reading the briefing notes and extracting the engagement goals ...",
+    "enter_agenda_creation": "Matching the speakers of the hub to the engagement goals ...",
+    "match_speakers": "Drafting the agenda ...",
+    "agenda_creation_tools": "Drafting the agenda ...",
+    "enter_document_generation": "Generating the Word document of the agenda ...",
+    "document_generation_tools": "Preparing the link to the Word document ...",
+    "leave_skill": "Wrapping up ...",
+}
+
+# The agents whose answer is shown to the user as the model generates it
+STREAMED_NODES = {"primary_assistant", "notes_extraction", "agenda_creation", "document_generation"}
+
+
+class TurnProgress:
+    """Shows the progress of a graph turn in the conversation, while the turn runs on a worker thread.
+
+    A typing indicator is sent until the turn completes. On the channels that support updating a message, a status
+    message is posted and updated in place, at most once per update interval, with the stage of the graph and the
+    answer of the agent as it is generated; the final response then replaces it. On the other channels the final
+    response is sent as a new message.
+
+    The publish_* methods are called from the worker thread that runs the graph.
+
+    :param turn_context: The context of the turn.
+    :type turn_context: TurnContext
+    :param update_supported: Whether the channel supports updating a message the bot has sent.
+    :type update_supported: bool
+    :param update_interval_seconds: The minimum time between two updates of the status message.
+    :type update_interval_seconds: float
+    """
+
+    def __init__(self, turn_context: TurnContext, update_supported: bool, update_interval_seconds: float):
+        self.turn_context = turn_context
+        self.update_supported = update_supported
+        self.update_interval_seconds = update_interval_seconds
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopped = False
+        self._dirty = False
+        self._status = None
+        self._partial = ""
+        self._partial_id = None
+        self._activity_id = None
+        self._shown = None
+        self._task = None
+        self._started = time.perf_counter()
+        self.updates = 0
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def publish_node(self, node: str):
+        """A node of the graph has completed."""
+        status = NODE_STATUS.get(node)
+        if status and self.update_supported:
+            self._loop.call_soon_threadsafe(self._set_status, status)
+
+    def publish_token(self, node: str, message_id: str, text: str):
+        """A chunk of the answer of the model, in the node of the graph."""
+        if node in STREAMED_NODES and text and self.update_supported:
+            self._loop.call_soon_threadsafe(self._append, message_id, text)
+
+    def _set_status(self, status: str):
+        self._status = status
+        self._partial = ""
+        self._mark_dirty()
+
+    def _append(self, message_id: str, text: str):
+        # A new model call replaces the answer of the previous one
+        if message_id != self._partial_id:
+            self._partial_id = message_id
+            self._partial = ""
+        self._partial += text
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        if not self._dirty:
+            self._dirty = True
+            self._wake.set()
+
+    async def _run(self):
+        next_typing = next_update = time.monotonic()
+        while not self._stopped:
+            now = time.monotonic()
+            if now >= next_typing:
+                await self._send_typing()
+                next_typing = now + TYPING_INTERVAL_SECONDS
+            if self._dirty and now >= next_update:
+                self._dirty = False
+                await self._show(self._partial or self._status)
+                next_update = time.monotonic() + self.update_interval_seconds
+
+            if self._stopped:
+                break
+            wake_at = min(next_typing, next_update) if self._dirty else next_typing
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, wake_at - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_typing(self):
+        try:
+            await self.turn_context.send_activity(Activity(type=ActivityTypes.typing))
+        except Exception as e:
+            logger.debug(f"Could not send the typing indicator: {str(e)}")
+
+    async def _show(self, text: str):
+        if not text or text == self._shown:
+            return
+        try:
+            if self._activity_id is None:
+                response = await self.turn_context.send_activity(text)
+                self._activity_id = response.id if response else None
+            else:
+                await self.turn_context.update_activity(
+                    Activity(id=self._activity_id, type=ActivityTypes.message, text=text)
+                )
+            self._shown = text
+            self.updates += 1
+        except Exception as e:
+            # Keep the turn going; the final response is still delivered
+            logger.warning(f"Could not update the progress of the turn, the updates are disabled: {str(e)}")
+            self.update_supported = False
+
+    async def stop(self):
+        """Stop the typing indicator and the updates; an update in flight is completed first."""
+        self._stopped = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+
+    async def deliver(self, response: str) -> ResourceResponse:
+        """Deliver the final response of the turn, in place of the status message where there is one."""
+        logger.debug(
+            f"Turn completed in {time.perf_counter() - self._started:.1f} s, with {self.updates} progress updates"
+        )
+        if self._activity_id is not None and self.update_supported:
+            if response == self._shown:
+                return ResourceResponse(id=self._activity_id)
+            try:
+                await self.turn_context.update_activity(
+                    Activity(id=self._activity_id, type=ActivityTypes.message, text=response)
+                )
+                return ResourceResponse(id=self._activity_id)
+            except Exception as e:
+                logger.warning(f"Could not replace the status message with the response: {str(e)}")
+        return await self.turn_context.send_activity(response)